@@ -0,0 +1,131 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Fleet deadhead / revenue per mile in one vectorized pass vs a per trip python loop.
+
+Builds --trips synthetic trips over --trucks trucks between --cities "lat, lon" locations,
+times load (sql -> DataFrame), coordinates, compute and summarize for the whole fleet, then
+the same per trip arithmetic done the usual way (sort, loop, math.* per row) over the same trips.
+
+usage: python benchmarks/bench_analytics.py [--trucks 5000] [--trips 1000000] [--cities 2000]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import math
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from config.migrations import migrate
+from services import analytics
+from messages import LoadStatus
+
+
+START = datetime(2020, 1, 1)
+
+
+def seed(conn, trucks, trips, cities):
+    rng = random.Random(7)
+    places = [f'{rng.uniform(25, 48):.4f}, {rng.uniform(-123, -70):.4f}' for _ in range(cities)]
+    # per row triggers (search index, history, counters) are dropped while seeding and put back after
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'trips'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    rows = []
+    for i in range(trips):
+        pickup = START + timedelta(hours=rng.randint(0, 5 * 365 * 24))
+        rows.append((i % trucks + 1, 'Broker', f'RC{i}', float(rng.randint(500, 5000)), rng.choice(places),
+                     rng.choice(places), pickup.strftime('%Y-%m-%dT%H:%M:%S'),
+                     (pickup + timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%S'), LoadStatus.DELIVERED,
+                     '2020-01-01 00:00:00', '2020-01-01 00:00:00'))
+        if len(rows) == 100000:
+            conn.executemany('INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, '
+                             'dropoff_location, pickup_date, delivery_date, status, created_at, updated_at) '
+                             'VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+            rows = []
+    if rows:
+        conn.executemany('INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, '
+                         'dropoff_location, pickup_date, delivery_date, status, created_at, updated_at) '
+                         'VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+
+
+def loop(rows):
+    """
+    The per trip version: rows are (id, truck_id, rate, pickup_location, dropoff_location, pickup_date)
+    """
+    def point(location):
+        lat, lon = location.split(',')
+        return math.radians(float(lat)), math.radians(float(lon))
+
+    def miles(a, b):
+        h = math.sin((b[0] - a[0]) / 2) ** 2 + math.cos(a[0]) * math.cos(b[0]) * math.sin((b[1] - a[1]) / 2) ** 2
+        return 2 * analytics.EARTH_RADIUS_MILES * math.asin(math.sqrt(h)) * analytics.ROAD_FACTOR
+
+    totals = {}
+    previous = None
+    for trip_id, truck_id, rate, pickup, dropoff, _ in sorted(rows, key=lambda row: (row[1], row[5], row[0])):
+        pickup, dropoff = point(pickup), point(dropoff)
+        loaded = miles(pickup, dropoff)
+        deadhead = miles(previous[1], pickup) if previous and previous[0] == truck_id else 0.0
+        total = totals.setdefault(truck_id, [0.0, 0.0, 0.0])
+        total[0] += rate
+        total[1] += loaded
+        total[2] += deadhead
+        previous = (truck_id, dropoff)
+    return {truck: (rate / (loaded + deadhead), deadhead / (loaded + deadhead))
+            for truck, (rate, loaded, deadhead) in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trucks', type=int, default=5000)
+    parser.add_argument('--trips', type=int, default=1000000)
+    parser.add_argument('--cities', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    migrate(conn)
+    start = time.perf_counter()
+    seed(conn, args.trucks, args.trips, args.cities)
+    print(f'seeded {args.trucks} trucks, {args.trips} trips in {time.perf_counter() - start:.1f}s')
+
+    steps = {}
+    start = time.perf_counter()
+    trips = analytics.load_trips(conn)
+    steps['load (sql -> DataFrame)'] = time.perf_counter() - start
+    for label, run in (('coordinates', analytics.with_coordinates), ('compute', analytics.compute),
+                       ('summarize', analytics.summarize)):
+        start = time.perf_counter()
+        trips = run(trips)
+        steps[label] = time.perf_counter() - start
+    per_truck, fleet = trips
+    print(f'{"vectorized step":<28}{"seconds":>10}')
+    for label, seconds in steps.items():
+        print(f'{label:<28}{seconds:>10.2f}')
+    engine = sum(seconds for label, seconds in steps.items() if not label.startswith('load'))
+    print(f'{"total (without load)":<28}{engine:>10.2f}   fleet revenue/mile {fleet["revenue_per_mile"].iloc[0]:.2f}, '
+          f'deadhead {fleet["deadhead_pct"].iloc[0]:.1f}%')
+
+    rows = conn.execute('SELECT id, truck_id, rate, pickup_location, dropoff_location, pickup_date FROM trips '
+                        'WHERE status != ?', (LoadStatus.CANCELLED,)).fetchall()
+    start = time.perf_counter()
+    loop(rows)
+    seconds = time.perf_counter() - start
+    print(f'{"per trip loop":<28}{seconds:>10.2f}   ({seconds / engine:.1f}x the vectorized pass)')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Requests/sec and p99 latency of sync `def` handlers vs the async handlers on AsyncDB.
+
+Both apps serve the same two routes (GET one trip, GET a page of trips) on the same
+database and storage settings. Requests are sent in process over httpx's ASGI transport
+with `--concurrency` clients at a time, so the numbers are the app and database cost without
+the network.
+
+Keep --concurrency below Starlette's threadpool (40 threads): past that every thread of the
+sync app can be blocked waiting for a connection while the releases queue for a thread.
+
+usage: python benchmarks/bench_async.py [--rows 20000] [--requests 5000] [--concurrency 32]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI, Depends
+
+from config.aio import AsyncDB
+from config.migrations import migrate
+from config.storage import Storage, WAL
+from services.trip import Trip
+
+
+def seed(path, rows):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    trip = Trip('Broker', 'RC0', 1500.0, 'Greensboro, NC', 'Raleigh, NC',
+                '2025-06-25T10:00:00', '2025-06-30T18:00:00', 1).__dict__
+    Trip.bulk_create(conn, [dict(trip, rate_con_number=f'RC{i}', truck_id=i % 300) for i in range(rows)], chunk_size=5000)
+    conn.close()
+
+
+def sync_app(storage):
+    app = FastAPI()
+
+    @app.get('/trips/{trip_id}')
+    def get_trip(trip_id: int, conn=Depends(storage.read_db)):
+        return Trip.get(conn, trip_id).raw()
+
+    @app.get('/trips/')
+    def get_trips(truck_id: int, limit: int = 50, conn=Depends(storage.read_db)):
+        return Trip.filter(conn, truck_id=truck_id, limit=limit).raw()
+
+    return app
+
+
+def async_app(db):
+    app = FastAPI()
+
+    @app.get('/trips/{trip_id}')
+    async def get_trip(trip_id: int):
+        return (await db.get(Trip, trip_id)).raw()
+
+    @app.get('/trips/')
+    async def get_trips(truck_id: int, limit: int = 50):
+        return (await db.filter(Trip, truck_id=truck_id, limit=limit)).raw()
+
+    return app
+
+
+async def load(app, rows, requests, concurrency):
+    rng = random.Random(7)
+    urls = [f'/trips/{rng.randint(1, rows)}' if i % 2 else f'/trips/?truck_id={rng.randint(0, 299)}'
+            for i in range(requests)]
+    timings = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        queue = iter(urls)
+
+        async def worker():
+            for url in queue:
+                start = time.perf_counter()
+                response = await client.get(url)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.text
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    timings.sort()
+    return requests / elapsed, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--readers', type=int, default=8)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'bench.db')
+    seed(path, args.rows)
+    storage = Storage(path, mode=WAL, readers=args.readers)
+    db = AsyncDB(storage)
+
+    print(f'{args.requests} requests, {args.concurrency} concurrent clients, {args.readers} readers, {args.rows} trips')
+    print(f'{"handlers":<10}{"req/s":>10}{"p99 ms":>10}')
+    for label, app in (('sync', sync_app(storage)), ('async', async_app(db))):
+        rps, p99 = asyncio.run(load(app, args.rows, args.requests, args.concurrency))
+        print(f'{label:<10}{rps:>10.0f}{p99:>10.1f}')
+
+    db.close()
+    storage.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Truck availability queries on the in-memory index vs the same question asked in sql.
+
+Seeds --trucks trucks with back to back trips (1-4 days each, 0-2 day gaps) until there are
+--trips trips, then times is_free for one truck, free_trucks for the whole fleet, and the
+same queries after a burst of new trips (delta and merge path).
+
+usage: python benchmarks/bench_availability.py [--trucks 5000] [--trips 1000000] [--queries 500]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from config.migrations import migrate
+from services.availability import AvailabilityIndex
+from services.trip import Trip
+from services.truck import Truck
+from messages import LoadStatus
+
+
+START = datetime(2020, 1, 1)
+FREE_SQL = ('SELECT id FROM trucks WHERE status = ? AND id NOT IN (SELECT truck_id FROM trips '
+            'WHERE status != ? AND pickup_date < ? AND delivery_date > ?) ORDER BY id')
+CONFLICT_SQL = 'SELECT id FROM trips WHERE truck_id = ? AND status != ? AND pickup_date < ? AND delivery_date > ?'
+
+
+def iso(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def seed(conn, trucks, trips):
+    rng = random.Random(7)
+    Truck.bulk_create(conn, [Truck(f'P{i}', 'Volvo', 2020, 10000).__dict__ for i in range(trucks)], chunk_size=5000)
+    # per row triggers (search index, history, counters) are dropped while seeding and put back after
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'trips'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    per_truck = trips // trucks
+    rows = []
+    for truck_id in range(1, trucks + 1):
+        moment = START + timedelta(hours=rng.randint(0, 72))
+        for _ in range(per_truck):
+            end = moment + timedelta(hours=rng.randint(24, 96))
+            rows.append((truck_id, 'Broker', 'RC', 1500.0, 'A', 'B', iso(moment), iso(end), LoadStatus.DELIVERED,
+                         '2020-01-01 00:00:00', '2020-01-01 00:00:00'))
+            moment = end + timedelta(hours=rng.randint(0, 48))
+        if len(rows) >= 100000:
+            conn.executemany('INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, '
+                             'dropoff_location, pickup_date, delivery_date, status, created_at, updated_at) '
+                             'VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+            rows = []
+    conn.executemany('INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, '
+                     'dropoff_location, pickup_date, delivery_date, status, created_at, updated_at) '
+                     'VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+    return conn.execute('SELECT MAX(delivery_date) FROM trips').fetchone()[0]
+
+
+def timed(run, args):
+    timings = []
+    for arg in args:
+        start = time.perf_counter()
+        run(*arg)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return sum(timings) / len(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trucks', type=int, default=5000)
+    parser.add_argument('--trips', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--sql', action='store_true', help='also time the sql version (slow)')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    migrate(conn)
+    start = time.perf_counter()
+    last = datetime.fromisoformat(seed(conn, args.trucks, args.trips))
+    print(f'seeded {args.trucks} trucks, {args.trips} trips in {time.perf_counter() - start:.1f}s')
+
+    index = AvailabilityIndex()
+    start = time.perf_counter()
+    index.load(conn)
+    print(f'index load {time.perf_counter() - start:.2f}s, {index.stats()}')
+
+    rng = random.Random(11)
+    span = int((last - START).total_seconds() // 3600)
+
+    def window():
+        moment = START + timedelta(hours=rng.randint(0, span))
+        return iso(moment), iso(moment + timedelta(hours=rng.randint(4, 72)))
+
+    truck_queries = [(conn, rng.randint(1, args.trucks), *window()) for _ in range(args.queries)]
+    fleet_queries = [(conn, *window()) for _ in range(args.queries)]
+
+    print(f'{"query":<34}{"avg ms":>10}{"p99 ms":>10}')
+    report = [('is_free (one truck)', index.is_free, truck_queries),
+              ('free_trucks (fleet)', index.free_trucks, fleet_queries)]
+    if args.sql:
+        report += [('sql conflicts (one truck)',
+                    lambda c, truck, a, b: c.execute(CONFLICT_SQL, (truck, LoadStatus.CANCELLED, b, a)).fetchall(),
+                    truck_queries),
+                   ('sql free trucks (fleet)',
+                    lambda c, a, b: c.execute(FREE_SQL, ('active', LoadStatus.CANCELLED, b, a)).fetchall(),
+                    fleet_queries[:20])]
+    for label, run, queries in report:
+        avg, p99 = timed(run, queries)
+        print(f'{label:<34}{avg:>10.3f}{p99:>10.3f}')
+
+    # new trips land in the delta, then get merged
+    trip = Trip('Broker', 'RC', 1500.0, 'A', 'B', iso(last), iso(last + timedelta(days=2)), 1).__dict__
+    for burst in (100, 5000):
+        Trip.bulk_create(conn, [dict(trip, truck_id=rng.randint(1, args.trucks)) for _ in range(burst)], chunk_size=5000)
+        start = time.perf_counter()
+        index.refresh(conn)
+        refreshed = (time.perf_counter() - start) * 1000
+        avg, p99 = timed(index.free_trucks, fleet_queries)
+        print(f'{"after " + str(burst) + " new trips":<34}{avg:>10.3f}{p99:>10.3f}   (refresh {refreshed:.1f} ms, '
+              f'merges {index.merges})')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Batch geocoding of a whole trips table with the offline gazetteer.
+
+Seeds --trips trips whose pickup / dropoff are drawn from --addresses distinct street
+addresses in real us cities (fleets keep going back to the same shippers and receivers),
+then times geocode_trips cold (empty geocodes table and LRU), again warm (answers read back
+from the geocodes table) and the analytics resolver on the same locations from the LRU.
+
+usage: python benchmarks/bench_geocode.py [--trips 1000000] [--addresses 50000]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+
+import pandas as pd
+
+from config.migrations import migrate
+from location.location import Geocoder, Gazetteer, geocode_trips
+from messages import LoadStatus
+
+
+STREETS = ['Main St', 'Hewitt St', 'Glenwood Ave.', 'Market St', 'Oak Ridge Rd', 'Industrial Blvd', 'Commerce Dr']
+
+
+def addresses(count):
+    """
+    Street addresses in gazetteer cities, written the different ways people write them
+    """
+    rng = random.Random(7)
+    gazetteer = Gazetteer()
+    gazetteer.load()
+    cities = sorted(gazetteer.cities)
+    zips = sorted(gazetteer.zips)
+    found = []
+    for _ in range(count):
+        state, city = rng.choice(cities)
+        street = f'{rng.randint(1, 9999)} {rng.choice(STREETS)}'
+        style = rng.random()
+        if style < 0.5:
+            found.append(f'{street} {city.title()}, {state}')
+        elif style < 0.8:
+            found.append(f'{street}, {city.title()}, {state} {rng.choice(zips)}')
+        else:
+            found.append(f'{street.upper()},{city},{state}')
+    return found
+
+
+def seed(conn, trips, places):
+    rng = random.Random(11)
+    # per row triggers (search index, history, counters) are dropped while seeding and put back after
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'trips'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.executemany(
+        'INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, dropoff_location, '
+        'pickup_date, delivery_date, status, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+        ((i % 5000 + 1, 'Broker', f'RC{i}', 1500.0, rng.choice(places), rng.choice(places),
+          '2025-06-25T10:00:00', '2025-06-30T18:00:00', LoadStatus.DELIVERED, '2025-06-01 00:00:00',
+          '2025-06-01 00:00:00') for i in range(trips)))
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trips', type=int, default=1000000)
+    parser.add_argument('--addresses', type=int, default=50000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    migrate(conn)
+    places = addresses(args.addresses)
+    start = time.perf_counter()
+    seed(conn, args.trips, places)
+    print(f'seeded {args.trips} trips over {args.addresses} addresses in {time.perf_counter() - start:.1f}s')
+
+    gazetteer = Gazetteer()
+    start = time.perf_counter()
+    gazetteer.load()
+    print(f'{"gazetteer load":<34}{time.perf_counter() - start:>8.2f}s')
+
+    for label, geocoder in (('geocode_trips cold', Geocoder(gazetteer)), ('geocode_trips warm (table)', Geocoder(gazetteer))):
+        start = time.perf_counter()
+        counts = geocode_trips(conn, geocoder)
+        print(f'{label:<34}{time.perf_counter() - start:>8.2f}s   {counts}')
+
+    locations = pd.Series(places, dtype=object)
+    start = time.perf_counter()
+    geocoder.resolve(conn, locations)
+    print(f'{"resolve again (lru)":<34}{time.perf_counter() - start:>8.2f}s   {geocoder.stats()}')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Geofence matching per ping as the number of active trips grows.
+
+For each --trips size, seeds that many active trips (one truck each, pickup and dropoff as
+"lat, lon" so no geocoding is timed) in a temp database, builds the GeofenceIndex and feeds
+it --pings pings of trucks near their pickups. Compared with measuring every fence for each
+ping, which is what matching without the index costs.
+
+usage: python benchmarks/bench_geofence.py [--trips 1000 10000 100000] [--pings 20000]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from config.migrations import migrate
+from location.geofence import GeofenceIndex
+from location.location import haversine_miles
+from messages import LoadStatus
+
+
+def seed(conn, trips, rng):
+    pickups = np.column_stack([rng.uniform(25, 48, trips), rng.uniform(-123, -70, trips)])
+    dropoffs = np.column_stack([rng.uniform(25, 48, trips), rng.uniform(-123, -70, trips)])
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'trips'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.executemany(
+        'INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, dropoff_location, '
+        'pickup_date, delivery_date, status, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+        ((i + 1, 'Broker', f'RC{i}', 1500.0, f'{pickups[i, 0]:.5f}, {pickups[i, 1]:.5f}',
+          f'{dropoffs[i, 0]:.5f}, {dropoffs[i, 1]:.5f}', '2025-07-01T08:00:00', '2025-07-02T08:00:00',
+          LoadStatus.SCHEDULED, '2025-06-01 00:00:00', '2025-06-01 00:00:00') for i in range(trips)))
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+    return pickups
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trips', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--pings', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f'{"active trips":>12}{"build":>10}{"index / ping":>16}{"scan / ping":>16}')
+    for trips in args.trips:
+        rng = np.random.default_rng(7)
+        tmp = tempfile.TemporaryDirectory()
+        conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+        migrate(conn)
+        pickups = seed(conn, trips, rng)
+
+        fences = GeofenceIndex()
+        start = time.perf_counter()
+        fences.observe(conn, [], [], [], [])
+        build = time.perf_counter() - start
+
+        # one truck in five is at its pickup, the rest are somewhere near it
+        trucks = rng.integers(1, trips + 1, args.pings)
+        near = rng.random(args.pings) < 0.2
+        lats = pickups[trucks - 1, 0] + np.where(near, rng.normal(0, 0.005, args.pings), rng.normal(0, 1, args.pings))
+        lons = pickups[trucks - 1, 1] + np.where(near, rng.normal(0, 0.005, args.pings), rng.normal(0, 1, args.pings))
+        stamps = np.arange(args.pings) + 1000
+        start = time.perf_counter()
+        for first in range(0, args.pings, 500):
+            batch = slice(first, first + 500)
+            fences.observe(conn, trucks[batch], lats[batch], lons[batch], stamps[batch])
+        indexed = (time.perf_counter() - start) / args.pings
+
+        # without the index: every fence measured for a ping, then the truck's own picked out
+        sample = min(args.pings, 200)
+        start = time.perf_counter()
+        for i in range(sample):
+            miles = haversine_miles(lats[i], lons[i], fences._fence_lat, fences._fence_lon)
+            (miles <= fences._fence_radius) & (fences._fence_trip == trucks[i])
+        scanned = (time.perf_counter() - start) / sample
+        print(f'{trips:>12}{build:>9.2f}s{indexed * 1e6:>14.1f}us{scanned * 1e6:>14.1f}us')
+        conn.close()
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: k nearest trucks from the spatial grid vs measuring every truck.
+
+Places --trucks trucks around real us cities (fleets bunch up near shippers and freeways),
+then runs --queries "k nearest within radius" lookups at random city points three ways:
+the grid of TruckLocationStore.nearest, one numpy haversine over every position, and a
+per truck python loop. Also times nearby_trucks end to end (grid + active status read from
+a temp trucks table) and a batch of pings, which is where the grid is kept up to date.
+
+usage: python benchmarks/bench_nearby.py [--trucks 10000] [--queries 2000] [--k 10] [--radius 150]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import math
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from config.migrations import migrate
+from location.location import TruckLocationStore, Gazetteer, haversine_miles, EARTH_RADIUS_MILES
+from services.truck import TruckStatus, nearby_trucks
+
+
+def scan(store, lat, lon, radius, k):
+    """
+    Every position measured, the way within() worked before the grid
+    """
+    ids = np.flatnonzero(store._ts)
+    miles = haversine_miles(lat, lon, store._lat[ids], store._lon[ids])
+    inside = miles <= radius
+    ids, miles = ids[inside], miles[inside]
+    order = np.lexsort((ids, miles))[:k]
+    return ids[order], miles[order]
+
+
+def loop(points, lat, lon, radius, k):
+    lat, lon = math.radians(lat), math.radians(lon)
+    found = []
+    for truck_id, (truck_lat, truck_lon) in points.items():
+        truck_lat, truck_lon = math.radians(truck_lat), math.radians(truck_lon)
+        h = (math.sin((truck_lat - lat) / 2) ** 2
+             + math.cos(lat) * math.cos(truck_lat) * math.sin((truck_lon - lon) / 2) ** 2)
+        miles = 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+        if miles <= radius:
+            found.append((miles, truck_id))
+    return sorted(found)[:k]
+
+
+def timed(label, queries, run, baseline=None):
+    start = time.perf_counter()
+    for lat, lon in queries:
+        run(lat, lon)
+    seconds = time.perf_counter() - start
+    speedup = f'   {baseline / seconds:.0f}x' if baseline else ''
+    print(f'{label:<30}{seconds / len(queries) * 1e6:>10.0f}us{speedup}')
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trucks', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=150.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    gazetteer = Gazetteer()
+    gazetteer.load()
+    cities = np.array([(lat, lon) for lat, lon in gazetteer.cities.values()])
+    homes = cities[rng.integers(0, len(cities), args.trucks)]
+    lats = homes[:, 0] + rng.normal(0, 0.3, args.trucks)
+    lons = homes[:, 1] + rng.normal(0, 0.3, args.trucks)
+    ids = np.arange(1, args.trucks + 1)
+    queries = cities[rng.integers(0, len(cities), args.queries)].tolist()
+
+    store = TruckLocationStore()
+    store.update_many(ids, lats, lons)
+    points = dict(zip(ids.tolist(), zip(lats.tolist(), lons.tolist())))
+    found = sum(len(store.nearest(lat, lon, args.radius, args.k)[0]) for lat, lon in queries) / len(queries)
+    for lat, lon in queries[:50]:
+        assert store.nearest(lat, lon, args.radius, args.k)[0].tolist() == scan(store, lat, lon, args.radius, args.k)[0].tolist()
+    print(f'{args.trucks} trucks in {store.stats()["grid_cells"]} grid cells, {args.queries} queries, '
+          f'k={args.k} within {args.radius:.0f} miles ({found:.1f} found on average)')
+
+    baseline = timed('python loop', queries, lambda lat, lon: loop(points, lat, lon, args.radius, args.k))
+    timed('numpy scan of every truck', queries, lambda lat, lon: scan(store, lat, lon, args.radius, args.k), baseline)
+    timed('grid nearest', queries, lambda lat, lon: store.nearest(lat, lon, args.radius, args.k), baseline)
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    migrate(conn)
+    # one truck in ten is not active
+    statuses = np.where(rng.random(args.trucks) < 0.1, TruckStatus.MAINTANANCE, TruckStatus.ACTIVE)
+    conn.executemany('INSERT INTO trucks (id, license_plate, model, year, towing_capacity, status, created_at, updated_at) '
+                     "VALUES (?, ?, 'Volvo', 2020, 10000, ?, '2025-01-01 00:00:00', '2025-01-01 00:00:00')",
+                     ((truck_id, f'T{truck_id}', status) for truck_id, status in zip(ids.tolist(), statuses.tolist())))
+    conn.commit()
+    timed('nearby_trucks (grid + active)', queries,
+          lambda lat, lon: nearby_trucks(conn, lat, lon, args.radius, args.k, store=store), baseline)
+    conn.close()
+    tmp.cleanup()
+
+    # a minute of pings from the whole fleet, trucks move up to about a mile
+    moves = rng.normal(0, 0.01, (2, args.trucks))
+    start = time.perf_counter()
+    store.update_many(ids, lats + moves[0], lons + moves[1])
+    seconds = time.perf_counter() - start
+    print(f'{"ping batch (grid kept current)":<30}{seconds * 1e3:>10.1f}ms for {args.trucks} pings')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: A payroll run over --drivers drivers and --trips trips.
+
+Seeds a temp database with drivers on all three pay models and trips between a few hundred
+places ("lat, lon" so the geocoder is not what is timed), delivered over two months, then:
+- run_payroll for the first half month, chunk by chunk, and the same period again with
+  recompute (the snapshot rewritten)
+- a run that is stopped after a few chunks and carries on
+- the per driver way for comparison: one query per driver and a python loop over its trips,
+  timed on --sample drivers and scaled to all of them
+
+usage: python benchmarks/bench_payroll.py [--drivers 10000] [--trips 1000000] [--chunk 2000] [--sample 200]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import math
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from config.migrations import migrate
+from messages import LoadStatus, PayModel
+from services import payroll
+from services.analytics import ROAD_FACTOR
+from location.location import EARTH_RADIUS_MILES
+
+START, END = '2025-07-01', '2025-07-16'
+
+
+def seed(conn, drivers, trips, rng):
+    models = np.array([PayModel.PER_MILE, PayModel.PERCENTAGE, PayModel.FLAT])[rng.integers(0, 3, drivers)]
+    rates = np.select([models == PayModel.PER_MILE, models == PayModel.PERCENTAGE], [0.6, 25.0], 400.0)
+    conn.executemany("INSERT INTO drivers (id, license_number, pay_rate, pay_model, status, profile_id, created_at, updated_at) "
+                     "VALUES (?, ?, ?, ?, 'active', 1, '2025-01-01 00:00:00', '2025-01-01 00:00:00')",
+                     ((i + 1, f'L{i}', rate, model) for i, (rate, model) in enumerate(zip(rates.tolist(), models.tolist()))))
+    places = [f'{lat:.5f}, {lon:.5f}' for lat, lon in zip(rng.uniform(25, 48, 300), rng.uniform(-123, -70, 300))]
+    pickups, dropoffs = rng.integers(0, len(places), trips), rng.integers(0, len(places), trips)
+    driver_ids = rng.integers(1, drivers + 1, trips)
+    rate = np.round(rng.uniform(800, 4000, trips), 2)
+    delivered = np.datetime64('2025-07-01T08:00') + rng.integers(0, 60 * 24 * 60, trips).astype('timedelta64[m]')
+    status = np.where(rng.random(trips) < 0.9, LoadStatus.DELIVERED, LoadStatus.IN_TRANSIT)
+    # the aggregate triggers are not what is measured here
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'trips'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.executemany(
+        'INSERT INTO trips (truck_id, driver_id, broker, rate_con_number, rate, pickup_location, dropoff_location, '
+        "pickup_date, delivery_date, status, created_at, updated_at) VALUES (1, ?, 'Broker', 'RC', ?, ?, ?, "
+        "'2025-07-01T00:00:00', ?, ?, '2025-06-01 00:00:00', '2025-06-01 00:00:00')",
+        zip(driver_ids.tolist(), rate.tolist(), (places[i] for i in pickups.tolist()), (places[i] for i in dropoffs.tolist()),
+            delivered.astype(str).tolist(), status.tolist()))
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.commit()
+
+
+def per_driver(conn, driver_id):
+    """
+    The per driver loop, one query and python arithmetic per trip
+    """
+    model, pay_rate = conn.execute('SELECT pay_model, pay_rate FROM drivers WHERE id = ?', (driver_id,)).fetchone()
+    pay = 0.0
+    for rate, pickup, dropoff in conn.execute(
+            'SELECT rate, pickup_location, dropoff_location FROM trips WHERE driver_id = ? AND delivery_date >= ? '
+            'AND delivery_date < ? AND status = ?', (driver_id, START, END, LoadStatus.DELIVERED)):
+        if model == PayModel.PER_MILE:
+            lat1, lon1 = (math.radians(float(part)) for part in pickup.split(','))
+            lat2, lon2 = (math.radians(float(part)) for part in dropoff.split(','))
+            h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            pay += 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h)) * ROAD_FACTOR * pay_rate
+        elif model == PayModel.PERCENTAGE:
+            pay += rate * pay_rate / 100
+        else:
+            pay += pay_rate
+    return pay
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--drivers', type=int, default=10000)
+    parser.add_argument('--trips', type=int, default=1000000)
+    parser.add_argument('--chunk', type=int, default=payroll.PAYROLL_CHUNK_DRIVERS)
+    parser.add_argument('--sample', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    migrate(conn)
+    start = time.perf_counter()
+    seed(conn, args.drivers, args.trips, np.random.default_rng(7))
+    print(f'seeded {args.drivers} drivers and {args.trips} trips in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    run = payroll.run_payroll(conn, START, END, chunk=args.chunk)
+    first = time.perf_counter() - start
+    print(f'{"run_payroll":<28}{first:>8.2f}s   {run["drivers"]} drivers, {run["trips"]} trips, '
+          f'pay {run["driver_pay"]:,.0f} of {run["gross"]:,.0f}')
+    # the first run also loads the gazetteer, the recompute is the warm cost
+    start = time.perf_counter()
+    payroll.run_payroll(conn, START, END, recompute=True, chunk=args.chunk)
+    warm = time.perf_counter() - start
+    print(f'{"run_payroll recompute":<28}{warm:>8.2f}s')
+
+    # stopped after two chunks, then carried on
+    run = payroll.start_run(conn, '2025-07-16', '2025-08-01')
+    start = time.perf_counter()
+    for _ in range(2):
+        run = payroll.save_chunk(conn, run, *payroll.next_chunk(conn, run, args.chunk))
+    run = payroll.run_payroll(conn, '2025-07-16', '2025-08-01', chunk=args.chunk)
+    print(f'{"stopped and resumed":<28}{time.perf_counter() - start:>8.2f}s   {run["status"]}, {run["drivers"]} drivers')
+
+    sample = min(args.sample, args.drivers)
+    start = time.perf_counter()
+    for driver_id in range(1, sample + 1):
+        per_driver(conn, driver_id)
+    looped = (time.perf_counter() - start) / sample * args.drivers
+    print(f'{"per driver loop (scaled)":<28}{looped:>8.2f}s   ({looped / warm:.1f}x the recompute)')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
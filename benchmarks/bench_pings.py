@@ -0,0 +1,108 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Ping ingestion, one UPDATE + commit per ping vs the write behind PingBuffer.
+
+Creates --trucks trucks in a temp WAL database (synchronous as --synchronous) and feeds them
+--pings pings, every truck drifting a little from its last position:
+- writer time per ping: Truck.update(location=...) style, one UPDATE and one commit each,
+  against PingBuffer.flush, one executemany + commit per --flush-size pings
+- the whole ingest path: ingest_pings in batches of --batch (validation, truck check, buffer,
+  location store and grid) plus the flushes, with the flush latency from PingBuffer.stats()
+
+usage: python benchmarks/bench_pings.py [--trucks 10000] [--pings 200000] [--batch 500] [--flush-size 10000]
+                                        [--synchronous NORMAL]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+
+from config.migrations import migrate
+from location.location import PingBuffer, TruckLocationStore
+from services.truck import ingest_pings
+
+
+def connect(path, synchronous):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f'PRAGMA synchronous = {synchronous}')
+    return conn
+
+
+def generate(trucks, count):
+    rng = random.Random(7)
+    positions = {truck_id: [rng.uniform(25, 48), rng.uniform(-123, -70)] for truck_id in range(1, trucks + 1)}
+    start_ts = int(time.time()) - count
+    pings = []
+    for i in range(count):
+        truck_id = rng.randint(1, trucks)
+        position = positions[truck_id]
+        position[0] += rng.uniform(-0.01, 0.01)
+        position[1] += rng.uniform(-0.01, 0.01)
+        pings.append({'truck_id': truck_id, 'lat': position[0], 'lon': position[1], 'ts': start_ts + i})
+    return pings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trucks', type=int, default=10000)
+    parser.add_argument('--pings', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--flush-size', type=int, default=10000)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = connect(os.path.join(tmp.name, 'bench.db'), args.synchronous)
+    migrate(conn)
+    conn.executemany('INSERT INTO trucks (id, license_plate, model, year, towing_capacity, status, created_at, updated_at) '
+                     "VALUES (?, ?, 'Volvo', 2020, 10000, 'active', '2025-01-01 00:00:00', '2025-01-01 00:00:00')",
+                     ((truck_id, f'T{truck_id}') for truck_id in range(1, args.trucks + 1)))
+    conn.commit()
+    pings = generate(args.trucks, args.pings)
+
+    # the per ping path is slow, a slice of the pings is enough to get its cost
+    sample = pings[:min(len(pings), 20000)]
+    start = time.perf_counter()
+    for ping in sample:
+        conn.execute('UPDATE trucks SET location = ?, updated_at = ? WHERE id = ?',
+                      (f"{ping['lat']:.5f}, {ping['lon']:.5f}", '2025-01-01 00:00:00', ping['truck_id']))
+        conn.commit()
+    per_ping = (time.perf_counter() - start) / len(sample)
+    sample_buffer = PingBuffer(capacity=len(sample))
+    sample_buffer.add([ping['truck_id'] for ping in sample], [ping['lat'] for ping in sample],
+                      [ping['lon'] for ping in sample], [ping['ts'] for ping in sample])
+    start = time.perf_counter()
+    sample_buffer.flush(conn)
+    flushed = (time.perf_counter() - start) / len(sample)
+    print(f'writer time per ping, synchronous = {args.synchronous}')
+    print(f'{"  UPDATE + commit per ping":<32}{per_ping * 1e6:>10.1f}us')
+    print(f'{"  PingBuffer.flush":<32}{flushed * 1e6:>10.1f}us   ({per_ping / flushed:.0f}x less)')
+
+    buffer = PingBuffer(capacity=args.flush_size + args.batch, flush_size=args.flush_size)
+    store = TruckLocationStore()
+    start = time.perf_counter()
+    for first in range(0, len(pings), args.batch):
+        res = ingest_pings(conn, pings[first:first + args.batch], buffer=buffer, store=store)
+        assert res.apicode == 202, res.raw()
+        if buffer.stats()['waiting'] >= args.flush_size:
+            buffer.flush(conn)
+    buffer.flush(conn)
+    buffered = len(pings) / (time.perf_counter() - start)
+    stats = buffer.stats()
+    print(f'{"ingest_pings + flushes":<32}{buffered:>10,.0f} pings/s, per ping updates top out at {1 / per_ping:,.0f}')
+    print(f'{"flushes":<32}{stats["flushes"]:>10}   latency ms {stats["flush_ms"]}')
+    print(f'truck_pings rows {conn.execute("SELECT COUNT(*) FROM truck_pings").fetchone()[0]}, '
+          f'trucks with a position {store.stats()["trucks"]}')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Revenue report from the revenue_daily rollup vs grouping the trips table.
+
+Inserts --trips trips (--trucks trucks, --brokers brokers, pickups spread over three years)
+into a temp database with and without the rollup triggers, then runs year long revenue
+queries both from revenue_daily (services/revenue.py) and with the same GROUP BY over trips,
+and a full aggregates.rebuild_revenue.
+
+usage: python benchmarks/bench_revenue.py [--trips 300000] [--trucks 1000] [--brokers 100] [--queries 20]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import aggregates
+from config.migrations import migrate
+from messages import LoadStatus
+from services import revenue
+
+STATUSES = [LoadStatus.DELIVERED, LoadStatus.IN_TRANSIT, LoadStatus.SCHEDULED, LoadStatus.CANCELLED]
+INSERT = ('INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, dropoff_location, pickup_date, '
+          "delivery_date, status, created_at, updated_at) VALUES (?, ?, 'RC', ?, 'Location A', 'Location B', ?, ?, ?, "
+          "'2025-01-01 00:00:00', '2025-01-01 00:00:00')")
+
+
+def generate(trips, trucks, brokers, rng):
+    pickup = np.datetime64('2023-01-01T00:00') + rng.integers(0, 3 * 365 * 24 * 60, trips).astype('timedelta64[m]')
+    return list(zip(rng.integers(1, trucks + 1, trips).tolist(),
+                    (f'Broker {i}' for i in rng.integers(0, brokers, trips).tolist()),
+                    np.round(rng.uniform(800, 4000, trips), 2).tolist(),
+                    pickup.astype(str).tolist(), (pickup + np.timedelta64(2, 'D')).astype(str).tolist(),
+                    np.array(STATUSES)[rng.choice(4, trips, p=[0.7, 0.1, 0.15, 0.05])].tolist()))
+
+
+def insert(path, rows, rollup):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    if not rollup:
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trips_revenue_%'").fetchall():
+            conn.execute(f'DROP TRIGGER {name}')
+    start = time.perf_counter()
+    for first in range(0, len(rows), 10000):
+        conn.executemany(INSERT, rows[first:first + 10000])
+        conn.commit()
+    return conn, time.perf_counter() - start
+
+
+def from_trips(conn, start, end, bucket, group_by):
+    """
+    The same report with the days summed from trips, what the endpoint would cost without the rollup
+    """
+    columns = [revenue.GROUPS[name] for name in group_by]
+    keys = ', '.join(['day', *columns])
+    statuses = list(revenue.DEFAULT_STATUSES)
+    rows = conn.execute(f"SELECT substr(pickup_date, 1, 10) AS day{''.join(f', {column}' for column in columns)}, "
+                        f"COUNT(*), SUM(rate) FROM trips WHERE pickup_date >= ? AND pickup_date < ? "
+                        f"AND status IN ({', '.join('?' * len(statuses))}) GROUP BY {keys}", [start, end, *statuses]).fetchall()
+    daily = pd.DataFrame(rows, columns=['day', *columns, 'trips', 'revenue'])
+    return revenue.report(revenue.buckets(daily, bucket, columns), columns, {})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trips', type=int, default=300000)
+    parser.add_argument('--trucks', type=int, default=1000)
+    parser.add_argument('--brokers', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = generate(args.trips, args.trucks, args.brokers, np.random.default_rng(7))
+    tmp = tempfile.TemporaryDirectory()
+    plain, without = insert(os.path.join(tmp.name, 'plain.db'), rows, rollup=False)
+    conn, with_rollup = insert(os.path.join(tmp.name, 'rollup.db'), rows, rollup=True)
+    plain.close()
+    days = conn.execute('SELECT COUNT(*) FROM revenue_daily').fetchone()[0]
+    print(f'{args.trips} trips -> {days} revenue_daily rows')
+    print(f'{"insert without rollup":<34}{without / args.trips * 1e6:>10.1f}us / trip')
+    print(f'{"insert with rollup triggers":<34}{with_rollup / args.trips * 1e6:>10.1f}us / trip')
+
+    print(f'{"one year of":<34}{"rollup":>10}{"trips":>12}')
+    for bucket, group_by in (('month', []), ('month', ['broker']), ('week', ['truck']), ('day', ['status'])):
+        timings = []
+        for run in (lambda: revenue.revenue(conn, '2024-01-01', '2025-01-01', bucket, group_by),
+                    lambda: from_trips(conn, '2024-01-01', '2025-01-01', bucket, group_by)):
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                run()
+            timings.append((time.perf_counter() - start) / args.queries)
+        label = f'{bucket} by {", ".join(group_by) or "fleet"}'
+        print(f'{label:<34}{timings[0] * 1e3:>8.1f}ms{timings[1] * 1e3:>10.1f}ms   {timings[1] / timings[0]:.0f}x')
+
+    start = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    aggregates.rebuild_revenue(conn)
+    conn.commit()
+    print(f'{"rebuild_revenue":<34}{time.perf_counter() - start:>8.2f}s')
+    assert aggregates.check_revenue(conn) == {}
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
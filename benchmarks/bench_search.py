@@ -0,0 +1,108 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Trip search through trips_fts (FTS5) vs LIKE '%x%' over the same columns.
+
+LIKE '%x%' reads the table until it has a page of matches: quick for a word half the
+table contains, a full scan for a rare one. FTS5 goes straight to the matches but ranks
+all of them before returning a page, so its cost follows how many rows match.
+
+usage: python benchmarks/bench_search.py [--rows 1000000] [--queries 200]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+
+from config.migrations import migrate
+from services.trip import Trip
+from messages import LoadStatus
+
+
+CITIES = ['Greensboro, NC', 'Raleigh, NC', 'Durham, NC', 'Charlotte, NC', 'Atlanta, GA', 'Savannah, GA',
+          'Nashville, TN', 'Memphis, TN', 'Columbus, OH', 'Dallas, TX', 'Houston, TX', 'Phoenix, AZ',
+          'Denver, CO', 'Chicago, IL', 'Detroit, MI', 'Richmond, VA', 'Norfolk, VA', 'Orlando, FL']
+STREETS = ['Main St', 'Hewitt St', 'Glenwood Ave', 'Market St', 'Oak Ridge Rd', 'Industrial Blvd']
+BROKERS = [f'{name} {kind}' for name in ('Tinashe', 'Mary', 'Summit', 'Blue Line', 'Apex', 'Harbor', 'Keystone')
+           for kind in ('Inc', 'Logistics', 'Freight', 'Brokerage')]
+LIKE_SQL = ('SELECT * FROM trips WHERE broker LIKE ?1 OR rate_con_number LIKE ?1 '
+            'OR pickup_location LIKE ?1 OR dropoff_location LIKE ?1 ORDER BY id LIMIT ?2')
+
+
+def address(rng):
+    return f'{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(CITIES)}'
+
+
+def seed(conn, rows):
+    rng = random.Random(7)
+    conn.executemany(
+        'INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, dropoff_location, '
+        'pickup_date, delivery_date, status, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+        ((i % 5000, rng.choice(BROKERS), f'RC{i}', 1000.0 + i % 900, address(rng), address(rng),
+          '2025-06-25T10:00:00', '2025-06-30T18:00:00', LoadStatus.SCHEDULED, '2025-06-01 00:00:00',
+          '2025-06-01 00:00:00') for i in range(rows)))
+    conn.commit()
+
+
+def timed(run, terms):
+    timings = []
+    for term in terms:
+        start = time.perf_counter()
+        run(term)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return sum(timings) / len(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    migrate(conn)
+    start = time.perf_counter()
+    seed(conn, args.rows)
+    print(f'seeded {args.rows} trips (fts kept by triggers) in {time.perf_counter() - start:.1f}s')
+
+    rng = random.Random(11)
+    # rare: a rate con number or a street + city pair, common: a city or broker word
+    # that a large share of the table contains
+    groups = {
+        'rare': [rng.choice([f'RC{rng.randint(0, args.rows - 1)}', f'{rng.randint(1, 9999)} hewitt'])
+                 for _ in range(args.queries)],
+        'common': [rng.choice(['greensboro', 'savann', 'keystone freight', 'summit', 'denver'])
+                   for _ in range(args.queries)],
+    }
+
+    def fts(term):
+        return Trip.search(conn, term, limit=args.limit)
+
+    def like(term):
+        # LIKE has no notion of words, search for the longest one
+        word = max(term.split(), key=len)
+        return conn.execute(LIKE_SQL, (f'%{word}%', args.limit)).fetchall()
+
+    print(f'{args.queries} searches per group, first {args.limit} results')
+    print(f'{"search":<28}{"avg ms":>10}{"p99 ms":>10}')
+    for group, terms in groups.items():
+        for label, run in (('fts5 ranked', fts), ("like '%x%'", like)):
+            avg, p99 = timed(run, terms)
+            print(f'{group + " " + label:<28}{avg:>10.2f}{p99:>10.2f}')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: ConfigManager.update with UPDATE ... RETURNING vs UPDATE + re-read.
+
+usage: python benchmarks/bench_update.py [--rows 10000] [--updates 20000]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+
+from config.config import SUPPORTS_RETURNING
+from config.migrations import migrate
+from services.trip import Trip
+from messages import LoadStatus
+
+
+STATUSES = [LoadStatus.SCHEDULED, LoadStatus.LOADED, LoadStatus.IN_TRANSIT, LoadStatus.DELIVERED]
+
+
+def seed(conn, rows):
+    trip = Trip('Broker', 'RC0', 1500.0, 'Greensboro, NC', 'Raleigh, NC',
+                '2025-06-25T10:00:00', '2025-06-30T18:00:00', 1).__dict__
+    Trip.bulk_create(conn, [dict(trip, rate_con_number=f'RC{i}', truck_id=i % 300) for i in range(rows)], chunk_size=5000)
+
+
+def run(conn, use_returning, rows, updates):
+    Trip.use_returning = use_returning
+    rng = random.Random(7)
+    timings = []
+    for _ in range(updates):
+        start = time.perf_counter()
+        Trip.update(conn, rng.randint(1, rows), status=rng.choice(STATUSES), truck_id=rng.randint(0, 299))
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return sum(timings) / len(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+    if not SUPPORTS_RETURNING:
+        print(f'sqlite {sqlite3.sqlite_version} has no RETURNING, only the fallback path can run')
+        return
+
+    tmp = tempfile.TemporaryDirectory()
+    conn = sqlite3.connect(os.path.join(tmp.name, 'bench.db'))
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    migrate(conn)
+    seed(conn, args.rows)
+
+    print(f'{args.updates} updates over {args.rows} trips, sqlite {sqlite3.sqlite_version}')
+    print(f'{"path":<20}{"avg us":>10}{"p99 us":>10}')
+    for label, use_returning in (('update + get', False), ('returning', True)):
+        avg, p99 = run(conn, use_returning, args.rows, args.updates)
+        print(f'{label:<20}{avg:>10.1f}{p99:>10.1f}')
+    conn.close()
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
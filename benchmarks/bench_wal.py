@@ -0,0 +1,112 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Read throughput while writes are happening, WAL split vs rollback journal.
+
+usage: python benchmarks/bench_wal.py [--rows 20000] [--readers 4] [--seconds 5]
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from config.storage import Storage, WAL, ROLLBACK
+from services.trip import Trip
+from messages import LoadStatus
+
+
+SCHEMA = '''
+CREATE TABLE trips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    truck_id INTEGER NOT NULL,
+    broker TEXT NOT NULL,
+    rate_con_number TEXT NOT NULL,
+    rate REAL NOT NULL,
+    pickup_location TEXT NOT NULL,
+    dropoff_location TEXT NOT NULL,
+    pickup_date TEXT NOT NULL,
+    delivery_date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    driver_id INTEGER
+)
+'''
+
+STATUSES = [LoadStatus.SCHEDULED, LoadStatus.LOADED, LoadStatus.IN_TRANSIT, LoadStatus.DELIVERED]
+
+
+def seed(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.executemany(
+        'INSERT INTO trips (truck_id, broker, rate_con_number, rate, pickup_location, dropoff_location, '
+        'pickup_date, delivery_date, status, created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+        ((i % 500, f'Broker {i % 50}', f'RC{i}', 1000.0 + i % 900, 'Greensboro, NC', 'Raleigh, NC',
+          '2025-06-25T10:00:00', '2025-06-30T18:00:00', STATUSES[i % 4], '2025-06-01 00:00:00', '2025-06-01 00:00:00')
+         for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def run(mode, rows, readers, seconds):
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'bench.db')
+    seed(path, rows)
+    storage = Storage(path, mode=mode, readers=readers + 1, timeout=60)
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def reader(slot):
+        rng = random.Random(slot)
+        while not stop.is_set():
+            with storage.reader.connection() as conn:
+                Trip.get(conn, rng.randint(1, rows))
+                Trip.filter(conn, truck_id=rng.randint(0, 499))
+            reads[slot] += 1
+
+    def writer():
+        rng = random.Random(-1)
+        while not stop.is_set():
+            with storage.writer.connection() as conn:
+                Trip.update(conn, rng.randint(1, rows), status=rng.choice(STATUSES))
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    waits = storage.reader.stats()['waits']
+    storage.close()
+    tmp.cleanup()
+    return sum(reads) / seconds, writes[0] / seconds, waits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.rows} trips, {args.readers} reader threads, 1 writer thread, {args.seconds}s per mode')
+    print(f'{"mode":<10}{"reads/s":>12}{"writes/s":>12}{"pool waits":>12}')
+    for mode in (ROLLBACK, WAL):
+        read_rate, write_rate, waits = run(mode, args.rows, args.readers, args.seconds)
+        print(f'{mode:<10}{read_rate:>12.0f}{write_rate:>12.0f}{waits:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Summary tables behind the dashboard and the reports, kept current by triggers.
+
+usage: python -m config.aggregates [check|rebuild] [path to db, default mtl.db]
+"""
+
+"""
+Goals for this module:
+- Answer the dashboard totals from a handful of rows instead of COUNT(*) scans per request.
+- The counters live in table_counts and trip_status_counts, the triggers that keep them
+  current are created by migration 4 (config/migrations.py), so every write path
+  (ConfigManager, bulk inserts, raw sql) is counted in the same transaction as the write.
+- revenue_daily (migration 12) is trips and revenue per pickup day, truck, broker and status,
+  kept by triggers the same way, services/revenue.py sums it into weeks and months.
+- check() compares the counters with real counts, rebuild() recomputes them after drift
+  e.g. rows changed with the triggers dropped or a database restored from an old copy.
+"""
+
+from logger import activity_logger
+
+
+COUNTED_TABLES = ('trips', 'trucks', 'drivers')
+
+REVENUE_KEY = ('day', 'truck_id', 'broker', 'status')
+REVENUE_FROM_TRIPS = ('SELECT substr(pickup_date, 1, 10) AS day, truck_id, broker, status, COUNT(*), SUM(rate) '
+                      'FROM trips GROUP BY day, truck_id, broker, status')
+
+
+def _actual(conn):
+    totals = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in COUNTED_TABLES}
+    by_status = dict(conn.execute('SELECT status, COUNT(*) FROM trips GROUP BY status').fetchall())
+    return totals, by_status
+
+
+def _has_revenue(conn):
+    # migration 4 rebuilds the counters before revenue_daily exists
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'revenue_daily'").fetchone() is not None
+
+
+def rebuild_revenue(conn):
+    """
+    Recompute revenue_daily from trips, in the caller's transaction.
+    returns the number of rows
+    """
+    conn.execute('DELETE FROM revenue_daily')
+    conn.execute(f"INSERT INTO revenue_daily ({', '.join(REVENUE_KEY)}, trips, revenue) {REVENUE_FROM_TRIPS}")
+    return conn.execute('SELECT COUNT(*) FROM revenue_daily').fetchone()[0]
+
+
+def rebuild(conn):
+    """
+    Recompute every counter and the revenue rollup from the tables.
+    Runs inside the caller's transaction, the migration and the cli commit it.
+    """
+    totals, by_status = _actual(conn)
+    conn.execute('DELETE FROM table_counts')
+    conn.executemany('INSERT INTO table_counts (name, count) VALUES (?, ?)', totals.items())
+    conn.execute('DELETE FROM trip_status_counts')
+    conn.executemany('INSERT INTO trip_status_counts (status, count) VALUES (?, ?)', by_status.items())
+    rebuilt = {'totals': totals, 'trips_by_status': by_status}
+    if _has_revenue(conn):
+        rebuilt['revenue_days'] = rebuild_revenue(conn)
+    return rebuilt
+
+
+def summary(conn):
+    """
+    returns {'totals': {table: count}, 'trips_by_status': {status: count}} from the counters
+    """
+    totals = dict(conn.execute('SELECT name, count FROM table_counts').fetchall())
+    by_status = dict(conn.execute('SELECT status, count FROM trip_status_counts WHERE count > 0').fetchall())
+    return {'totals': {table: totals.get(table, 0) for table in COUNTED_TABLES}, 'trips_by_status': by_status}
+
+
+def check(conn):
+    """
+    returns the counters that disagree with the tables as {name: (counter, actual)}
+    """
+    totals, by_status = _actual(conn)
+    counted = summary(conn)
+    drift = {table: (counted['totals'][table], count)
+             for table, count in totals.items() if counted['totals'][table] != count}
+    for status in set(by_status) | set(counted['trips_by_status']):
+        counter, actual = counted['trips_by_status'].get(status, 0), by_status.get(status, 0)
+        if counter != actual:
+            drift[f'trips.status={status}'] = (counter, actual)
+    if _has_revenue(conn):
+        drift.update(check_revenue(conn))
+    return drift
+
+
+def check_revenue(conn):
+    """
+    returns the revenue_daily rows that disagree with trips as
+    {'revenue_daily day/truck/broker/status': ((trips, revenue), (trips, revenue))}
+    """
+    def rows(sql):
+        return {tuple(row[:4]): (row[4], round(row[5], 2)) for row in conn.execute(sql).fetchall()}
+    rollup = rows(f"SELECT {', '.join(REVENUE_KEY)}, trips, revenue FROM revenue_daily")
+    actual = rows(REVENUE_FROM_TRIPS)
+    return {f"revenue_daily {'/'.join(map(str, key))}": (rollup.get(key, (0, 0.0)), actual.get(key, (0, 0.0)))
+            for key in set(rollup) | set(actual) if rollup.get(key) != actual.get(key)}
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else 'mtl.db')
+    drift = check(conn)
+    for name, (counter, actual) in sorted(drift.items()):
+        print(f'{name}: counter {counter}, actual {actual}')
+    if command == 'rebuild':
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild(conn)
+        conn.commit()
+        activity_logger.info(f"Rebuilt dashboard counters and revenue rollup, {len(drift)} had drifted")
+        print('rebuilt')
+    elif not drift:
+        print('counters match')
+    conn.close()
@@ -0,0 +1,75 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Async access to the database for async route handlers.
+"""
+
+"""
+Goals for this module:
+- Let `async def` handlers read and write without blocking the event loop.
+- Run the sqlite calls on executors sized to the storage pools, so requests waiting on the
+  database queue here instead of tying up Starlette's general threadpool.
+- Reuse ConfigManager as is: every async call is the sync method run on a pooled connection.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncDB:
+    """
+    Async front of a config.storage.Storage
+
+    read(fn, ...) / write(fn, ...) run fn(conn, ...) on a reader / the writer connection
+    in a worker thread and return its result. get/filter/create/update are the
+    ConfigManager methods on top of those.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._readers = ThreadPoolExecutor(max_workers=storage.reader.size, thread_name_prefix='db-read')
+        self._writers = ThreadPoolExecutor(max_workers=storage.writer.size, thread_name_prefix='db-write')
+
+    @staticmethod
+    def _call(pool, fn, args, kwargs):
+        conn = pool.acquire()
+        try:
+            return fn(conn, *args, **kwargs)
+        finally:
+            pool.release(conn)
+
+    async def _run(self, executor, pool, fn, args, kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(self._call, pool, fn, args, kwargs))
+
+    async def read(self, fn, *args, **kwargs):
+        """
+        fn(conn, *args, **kwargs) on a read connection
+        """
+        return await self._run(self._readers, self.storage.reader, fn, args, kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        """
+        fn(conn, *args, **kwargs) on the writer connection
+        """
+        return await self._run(self._writers, self.storage.writer, fn, args, kwargs)
+
+    async def get(self, model, id, fields=None):
+        return await self.read(model.get, id, fields=fields)
+
+    async def filter(self, model, /, **kwargs):
+        return await self.read(model.filter, **kwargs)
+
+    async def create(self, obj):
+        """
+        obj is a ConfigManager instance, e.g. Trip.from_item(item)
+        """
+        return await self.write(obj.create, obj.__dict__)
+
+    async def update(self, model, id, /, **kwargs):
+        return await self.write(model.update, id, **kwargs)
+
+    def close(self):
+        self._readers.shutdown(wait=True)
+        self._writers.shutdown(wait=True)
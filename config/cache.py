@@ -0,0 +1,227 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: In-process cache for single rows read by id, with invalidation shared across workers.
+"""
+
+"""
+Goals for this module:
+- Serve the hot GET by id reads (driver apps, dispatch board) from memory.
+- Bound the cache by entry count (LRU) and by age (TTL) so a missed invalidation heals itself.
+- Drop entries whenever ConfigManager writes the row, and never put back a row that was read
+  before such a drop: a reader takes the key's generation before its SELECT and the put is
+  skipped when a drop bumped it meanwhile (a read from an older WAL snapshot would otherwise
+  be served for the whole TTL).
+- Tell the other uvicorn workers on the same host to drop them too, through unix datagram
+  sockets in a shared directory (one socket per worker process).
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from logger import activity_logger, error_logger
+
+
+# beyond this many ids one message tells the other workers to drop the whole table
+MAX_IDS_PER_MESSAGE = 1000
+# generations kept for dropped keys, when one is forgotten every read in flight is refused
+MAX_GENERATIONS = 100000
+
+
+class EntityCache:
+    """
+    LRU + TTL map of (table, id) -> row dict
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.channel = None
+        self._rows = OrderedDict()
+        # (table, id) or table -> bumped by every drop of it, epoch when one is forgotten
+        self._generations = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, table, id):
+        """
+        returns a copy of the cached row or None
+        """
+        key = (table, id)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, row = entry
+            if expires <= self.clock():
+                del self._rows[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._rows.move_to_end(key)
+            self.hits += 1
+            return dict(row)
+
+    def generation(self, table, id):
+        """
+        Take before reading a row from the database and pass to put
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(table, 0), self._generations.get((table, id), 0)
+
+    def _bump(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._generations.move_to_end(key)
+        while len(self._generations) > MAX_GENERATIONS:
+            self._generations.popitem(last=False)
+            self._epoch += 1
+
+    def put(self, table, id, row: dict, generation=None):
+        """
+        generation from generation(): the row is not kept when it was dropped since
+        """
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(table, 0),
+                                                         self._generations.get((table, id), 0)):
+                self.stale_puts += 1
+                return
+            self._rows[(table, id)] = (self.clock() + self.ttl, dict(row))
+            self._rows.move_to_end((table, id))
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def drop(self, table, ids=None):
+        """
+        Remove rows of table from this process only, every row when ids is None
+        """
+        with self._lock:
+            if ids is None:
+                keys = [key for key in self._rows if key[0] == table]
+                self._bump(table)
+            else:
+                keys = [(table, id) for id in ids]
+                for key in keys:
+                    self._bump(key)
+            for key in keys:
+                if self._rows.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def invalidate(self, table, ids):
+        """
+        Remove rows of table here and in the other workers
+        """
+        ids = list(ids)
+        self.drop(table, ids)
+        if self.channel is not None:
+            self.channel.publish(table, ids if len(ids) <= MAX_IDS_PER_MESSAGE else None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._rows),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+                'stale_puts': self.stale_puts,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'channel': self.channel.directory if self.channel else None,
+            }
+
+
+class InvalidationChannel:
+    """
+    Unix datagram socket per worker in `directory`.
+    publish() sends (table, ids) to every other socket there, a background
+    thread applies the messages other workers send to this worker's cache.
+    """
+
+    def __init__(self, directory, cache: EntityCache, name: str | None = None):
+        self.directory = directory
+        self.cache = cache
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{name or os.getpid()}.sock')
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        # recv wakes up now and then so close() can stop the thread
+        self._socket.settimeout(0.5)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._closed = False
+        self.sent = 0
+        self.received = 0
+        cache.channel = self
+        self._thread = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+        self._thread.start()
+        activity_logger.info(f"Cache invalidation channel at {self.path}")
+
+    def _peers(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith('.sock') and os.path.join(self.directory, name) != self.path]
+
+    def publish(self, table, ids):
+        """
+        ids None means every row of table
+        """
+        message = json.dumps({'table': table, 'ids': ids}).encode()
+        for peer in self._peers():
+            try:
+                self._sender.sendto(message, peer)
+                self.sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # the worker that owned it is gone
+                try:
+                    os.remove(peer)
+                except OSError:
+                    pass
+            except OSError as e:
+                # full receive buffer, the TTL covers what this worker misses
+                error_logger.error(f"Cache invalidation to {peer} failed: {e}")
+
+    def _listen(self):
+        while not self._closed:
+            try:
+                data = self._socket.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                message = json.loads(data)
+                self.cache.drop(message['table'], message['ids'])
+                self.received += 1
+            except (ValueError, KeyError, TypeError) as e:
+                error_logger.error(f"Bad cache invalidation message: {e}")
+
+    def close(self):
+        self._closed = True
+        self.cache.channel = None
+        self._socket.close()
+        self._sender.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -11,9 +11,18 @@ Goals for this module:
 - handle reading and wrting to database
 """
 
+import sqlite3
 import messages as msg
+from config import query
 from datetime import datetime
-from logger import activity_logger, stdout_logger
+from logger import activity_logger, error_logger, stdout_logger
+
+
+# UPDATE / INSERT ... RETURNING needs sqlite 3.35 or newer
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# SQLITE_MAX_VARIABLE_NUMBER of sqlite 3.32 and newer
+MAX_BOUND_PARAMETERS = 32766
+
 
 class ConfigManager:
     """
@@ -22,6 +31,17 @@ class ConfigManager:
     It will also handle data validation and integrity.
     """
     table_name = None
+    use_returning = SUPPORTS_RETURNING
+    # config.cache.EntityCache for get by id, None reads straight from the database
+    cache = None
+
+    @classmethod
+    def invalidate(cls, ids):
+        """
+        Drop cached rows after a write, call it for every id a write touches
+        """
+        if cls.cache is not None:
+            cls.cache.invalidate(cls.table_name, ids)
     
     def create(self, conn, props: dict):
         """
@@ -32,62 +52,146 @@ class ConfigManager:
         if 'id' in props:
             props.pop('id')
         cursor = conn.cursor()
-        # Example for inserting into a generic table, adjust as needed
-        placeholders = ', '.join('?' * len(props))
-        columns = ', '.join(props.keys())
         if self.table_name:
-            sql = f'INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})'
-            cursor.execute(sql, tuple(props.values()))
+            try:
+                sql, columns = query.insert_sql(conn, self.table_name, props.keys())
+            except query.InvalidColumn as e:
+                return msg.InvalidQuery({'error': str(e), 'columns': e.columns})
+            cursor.execute(sql, tuple(props[column] for column in columns))
             conn.commit()
 
         self.id = cursor.lastrowid
         if self.id is None:
             return msg.ResourceCreateError({'error': 'Failed to create item'})
+        self.invalidate([self.id])
         self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         return msg.ResourceCreated(self.__dict__)
 
     @classmethod
-    def get(cls,conn, id):
+    def bulk_create(cls, conn, rows: list, chunk_size: int = 500):
+        """
+        Insert many rows in one transaction, with INSERT ... RETURNING id where sqlite has it
+        (use_returning), otherwise executemany
+        rows are dicts with the same keys (e.g. obj.__dict__ of validated objects)
+        chunk_size is how many rows go to each statement
+        returns the new ids in the same order as rows, or error (nothing inserted)
+        """
+        if not rows:
+            return msg.ResourceCreateError({'error': 'No rows to create'})
+        columns = [key for key in rows[0].keys() if key != 'id']
+        for index, row in enumerate(rows):
+            if set(row.keys()) - {'id'} != set(columns):
+                return msg.ResourceCreateError({'error': 'Rows have different columns', 'index': index})
+
+        try:
+            sql, columns = query.insert_sql(conn, cls.table_name, columns)
+        except query.InvalidColumn as e:
+            return msg.InvalidQuery({'error': str(e), 'columns': e.columns})
+        if cls.use_returning:
+            # kept under sqlite's limit of bound parameters
+            chunk_size = max(1, min(chunk_size, MAX_BOUND_PARAMETERS // len(columns)))
+        cursor = conn.cursor()
+        ids = []
+        try:
+            start = 0
+            while start < len(rows):
+                if cls.use_returning:
+                    # one multi row INSERT ... RETURNING id per chunk (executemany drops returned rows),
+                    # a shorter last chunk goes in power of two pieces so few statements are ever built
+                    left = len(rows) - start
+                    size = chunk_size if left >= chunk_size else 1 << (left.bit_length() - 1)
+                    chunk = rows[start:start + size]
+                    chunk_sql, _ = query.insert_sql(conn, cls.table_name, columns, rows=size, returning=True)
+                    returned = cursor.execute(chunk_sql, [row[column] for row in chunk for column in columns]).fetchall()
+                    # RETURNING order is not promised, the ids are given out in VALUES order
+                    ids.extend(sorted(row[0] for row in returned))
+                else:
+                    # the fallback before sqlite 3.35: the write lock is held until commit so
+                    # AUTOINCREMENT ids in a chunk are consecutive and end at last_insert_rowid()
+                    chunk = rows[start:start + chunk_size]
+                    cursor.executemany(sql, [tuple(row[column] for column in columns) for row in chunk])
+                    last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+                    ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+                start += len(chunk)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            error_logger.error(f"Bulk create on {cls.table_name} failed: {e}")
+            return msg.ResourceCreateError({'error': str(e)})
+        cls.invalidate(ids)
+        activity_logger.info(f"Created {len(ids)} rows in {cls.table_name}")
+        return msg.ResourceCreated({'ids': ids})
+
+    @classmethod
+    def get(cls,conn, id, fields=None):
         """
         Read a row from the database table
         returns a single row or None
+        fields ('id,status' or a list) selects only those columns
+        with cls.cache set whole rows are cached, fields are then picked from the cached row
         """
+        fields = query.parse_fields(fields)
         cursor = conn.cursor()
-        cursor.execute(f"SELECT * FROM {cls.table_name} WHERE id = ?", (id,))
-        item = cursor.fetchone()
-        if item is None:
-            return msg.ResourceNotFound({'id': id})
-        return msg.ResourceFound(dict(item))
+        try:
+            sql = query.get_sql(conn, cls.table_name, fields)
+        except query.InvalidColumn as e:
+            return msg.InvalidQuery({'error': str(e), 'columns': e.columns})
+        if cls.cache is None:
+            item = cursor.execute(sql, (id,)).fetchone()
+            if item is None:
+                return msg.ResourceNotFound({'id': id})
+            return msg.ResourceFound(dict(item))
+
+        row = cls.cache.get(cls.table_name, id)
+        if row is None:
+            # a write committed between the SELECT and the put drops the row first, the
+            # generation taken before the SELECT then tells put not to keep the old one
+            generation = cls.cache.generation(cls.table_name, id)
+            item = cursor.execute(query.get_sql(conn, cls.table_name), (id,)).fetchone()
+            if item is None:
+                return msg.ResourceNotFound({'id': id})
+            row = dict(item)
+            cls.cache.put(cls.table_name, id, row, generation)
+        return msg.ResourceFound({field: row[field] for field in fields} if fields else row)
 
     @classmethod
-    def all(cls, conn):
+    def all(cls, conn, limit: int | None = None, after: int | None = None):
         """
         Read all rows from the database table
         returns a list of rows or empty list
+        pass limit (and after) to page through the table by id
         """
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT * FROM {cls.table_name}")
-        items = cursor.fetchall()
-        if not items:
-            return msg.ResourceNotFound({'items': []})
-        return msg.ResourceFound([dict(item) for item in items])
+        return cls.filter(conn, limit=limit, after=after)
 
         
     @classmethod
     def update(cls, conn, id, **kwargs):
         """
-        Update a row in the database table
+        Update a row in the database table, updated_at is set to now when the table has it
         returns the updated row or error
         """
         update_args = {key: value for key, value in kwargs.items() if value is not None }
         if not update_args:
             return msg.ResourceUpdateError({'error': 'No properties to update'})
         cursor = conn.cursor()
-        columns = ', '.join([f"{key}=?" for key in update_args.keys()])
-        sql = f"UPDATE {cls.table_name} SET {columns} WHERE id=?"
-        values = list(update_args.values()) + [id]
+        try:
+            # every write moves updated_at, the dashboard sorts recently delivered trips by it
+            if 'updated_at' not in update_args and 'updated_at' in query.table_columns(conn, cls.table_name):
+                update_args['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            sql, values = query.update_sql(conn, cls.table_name, update_args, id, returning=cls.use_returning)
+        except query.InvalidColumn as e:
+            return msg.InvalidQuery({'error': str(e), 'columns': e.columns})
+        if cls.use_returning:
+            # one statement: the updated row comes back from the UPDATE itself
+            rows = cursor.execute(sql, values).fetchall()
+            conn.commit()
+            cls.invalidate([id])
+            if not rows:
+                return msg.ResourceUpdateError({'error': 'No row updated', 'id': id})
+            return msg.ResourceUpdated(dict(rows[0]))
         cursor.execute(sql, values)
         conn.commit()
+        cls.invalidate([id])
         if cursor.rowcount == 0:
             return msg.ResourceUpdateError({'error': 'No row updated', 'id': id})
         resource = cls.get(conn, id).raw()
@@ -95,25 +199,62 @@ class ConfigManager:
             return msg.ResourceUpdated(resource['found'])
     
     @classmethod
-    def filter(cls, conn, **kwargs):
+    def _select(cls, conn, after=None, limit=None, order_by=None, fields=None, **kwargs):
+        """
+        Build the SELECT used by filter and iter_filter, see config/query.py
+        Pages are keyset based: ordered by id and starting after the last id seen,
+        so every page costs the same no matter how deep into the table it is.
+        """
+        return query.select_sql(conn, cls.table_name, kwargs, after=after, limit=limit, order_by=order_by, fields=fields)
+
+    @classmethod
+    def filter(cls, conn, limit: int | None = None, after: int | None = None, order_by=None, fields=None, **kwargs):
         """
         Query DB and Return rows 
+        filters are column=value or column__lookup=value
+            e.g. status__in=[...], pickup_date__gte=..., rate__between=(low, high),
+            pickup_location__startswith=..., see config/query.py LOOKUPS
+        order_by='-pickup_date' sorts in sql, limit then gives the top rows
+        fields ('id,status' or a list) selects only those columns (plus id)
+        with limit the rows come back one page at a time along with
+        the cursor (`next`) to pass as `after` for the next page
 
         """
         cursor = conn.cursor()
-
-        query_dict = {key: value for key, value in kwargs.items() if value is not None}
-        if not query_dict:
-            cursor.execute(f"SELECT * FROM {cls.table_name}")
-            items = cursor.fetchall()
-        else:
-            conditions = ' AND '.join([f"{key}=?" for key in query_dict.keys() ])
-            sql = f"SELECT * FROM {cls.table_name} WHERE {conditions}"
-            cursor.execute(sql, tuple(query_dict.values()))
-            items = cursor.fetchall()
+        try:
+            sql, values = cls._select(conn, after=after, limit=limit, order_by=order_by, fields=fields, **kwargs)
+        except query.InvalidColumn as e:
+            return msg.InvalidQuery({'error': str(e), 'columns': e.columns})
+        cursor.execute(sql, values)
+        items = cursor.fetchall()
         if not items:
             return msg.ResourceNotFound({'items': []})
-        return msg.ResourceFound([dict(item) for item in items])
+        rows = [dict(item) for item in items]
+        if limit is not None:
+            # only id ordered pages can be continued with after
+            next_after = rows[-1]['id'] if len(rows) == limit and not order_by else None
+            return msg.ResourcePage(rows, next_after)
+        return msg.ResourceFound(rows)
+
+    @classmethod
+    def iter_filter(cls, conn, after: int | None = None, batch_size: int = 500, order_by=None, fields=None, **kwargs):
+        """
+        Same query as filter but yields one row dict at a time
+        only batch_size rows are held in memory whatever the size of the table
+        """
+        cursor = conn.cursor()
+        if order_by:
+            sql, values = cls._select(conn, order_by=order_by, fields=fields, **kwargs)
+        else:
+            # a page with no limit still comes back ordered by id
+            sql, values = cls._select(conn, after=after if after is not None else 0, fields=fields, **kwargs)
+        cursor.execute(sql, values)
+        while True:
+            items = cursor.fetchmany(batch_size)
+            if not items:
+                break
+            for item in items:
+                yield dict(item)
 
     def delete():
         """
@@ -5,89 +5,87 @@ description: Using SQLite for lightweight, as we go might migrate to a more robu
 Database configuration and initialization.
 """
 
+import os
 import sqlite3
 
+from config.storage import Storage, WAL, ROLLBACK
+from config.aio import AsyncDB
+from config.cache import EntityCache, InvalidationChannel
+from config.config import ConfigManager
+from config.migrations import migrate
+from config.query import STATEMENT_CACHE_SIZE
+
+
+DB_PATH = 'mtl.db'
+
+# 'wal': read-only reader pool + one serialized writer, readers never wait on writes
+# 'rollback': classic journal with one shared pool
+STORAGE_MODE = WAL
+
+# Pool sizing, tune with the numbers from GET /api/db/stats
+POOL_SIZE = 8         # reader connections (all connections in rollback mode)
+POOL_TIMEOUT = 30.0   # seconds to wait for a free connection
+
+# WAL tunables
+WAL_SYNCHRONOUS = 'NORMAL'        # NORMAL is durable at checkpoints and safe from corruption, FULL fsyncs every commit
+WAL_AUTOCHECKPOINT = 1000         # pages in the WAL before the writer checkpoints on commit, 0 turns it off
+WAL_CHECKPOINT_INTERVAL = None    # seconds between background PASSIVE checkpoints, None turns it off
+
+# Cache for GET by id, see config/cache.py
+ENTITY_CACHE_SIZE = 10000     # rows kept across all tables, 0 turns the cache off
+ENTITY_CACHE_TTL = 30.0       # seconds a cached row is served before it is read again
+# Directory the uvicorn workers of one host share to pass invalidations to each other,
+# unset keeps invalidation inside each worker (the TTL bounds how stale the others get)
+CACHE_CHANNEL = os.environ.get('MTL_CACHE_CHANNEL')
+
+# Applied to every new connection
+PRAGMAS = {
+    'foreign_keys': 'ON',
+}
+
 
 def get_db_connection(testing: bool = False):
     if testing:
         connection = sqlite3.connect(':memory:')
     else:
-        connection = sqlite3.connect('mtl.db')
+        connection = sqlite3.connect(DB_PATH)
     connection.row_factory = sqlite3.Row
-    connection.execute('PRAGMA foreign_keys = ON')
+    for name, value in PRAGMAS.items():
+        connection.execute(f'PRAGMA {name} = {value}')
     return connection
 
+
+def get_read_db():
+    """
+    FastAPI dependency handing a pooled read connection to a request
+    and returning it to the pool once the response is done.
+    """
+    yield from storage.read_db()
+
+
+def get_write_db():
+    """
+    FastAPI dependency handing the writer connection to a request.
+    Only one request holds it at a time.
+    """
+    yield from storage.write_db()
+
+
+# Bring the schema up to date, see config/migrations.py
 connection = get_db_connection()
-cursor = connection.cursor()
-
-# Create trips table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS trips (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    truck_id INTEGER NOT NULL,
-    broker TEXT NOT NULL,
-    rate_con_number TEXT NOT NULL,
-    rate REAL NOT NULL,
-    pickup_location TEXT NOT NULL,
-    dropoff_location TEXT NOT NULL,
-    pickup_date TEXT NOT NULL,
-    delivery_date TEXT NOT NULL,
-    status TEXT NOT NULL,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL,
-    driver_id INTEGER,
-    FOREIGN KEY (driver_id) REFERENCES drivers(id)
-)
-''')
-
-
-# Create Trucks table 
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS trucks (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    license_plate TEXT,
-    model TEXT NOT NULL,
-    year INTEGER NOT NULL,
-    towing_capacity INTEGER NOT NULL,
-    location TEXT,
-    status TEXT NOT NULL,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL 
-)
-'''
-)
-
-######
-
-#  User Profiles 
-
-######
-
-# create profile table 
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS profiles (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    fname TEXT NOT NULL,
-    lname TEXT NOT NULL,
-    email TEXT NOT NULL,
-    password TEXT NOT NULL,
-    phone TEXT NOT NULL,
-    profile_picture TEXT
-)
-''')
-
-
-
-# Create drivers table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS drivers (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    license_number TEXT NOT NULL,
-    pay_rate REAL NOT NULL,
-    status TEXT,
-    profile_id INTEGER NOT NULL,
-    created_at TEXT NOT NULL,
-    updated_at TEXT NOT NULL
-)
-''')
\ No newline at end of file
+migrate(connection)
+connection.close()
+
+storage = Storage(DB_PATH, mode=STORAGE_MODE, readers=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=PRAGMAS,
+                  synchronous=WAL_SYNCHRONOUS, autocheckpoint=WAL_AUTOCHECKPOINT,
+                  checkpoint_interval=WAL_CHECKPOINT_INTERVAL, cached_statements=STATEMENT_CACHE_SIZE)
+
+# async handlers go through this, see config/aio.py
+async_db = AsyncDB(storage)
+
+entity_cache = None
+if ENTITY_CACHE_SIZE:
+    entity_cache = EntityCache(max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL)
+    ConfigManager.cache = entity_cache
+    if CACHE_CHANNEL:
+        InvalidationChannel(CACHE_CHANNEL, entity_cache)
@@ -0,0 +1,83 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Run EXPLAIN QUERY PLAN over the queries ConfigManager builds and show which ones still scan.
+
+usage: python -m config.explain [path to db, default mtl.db]
+"""
+
+from itertools import combinations
+
+
+def explain(conn, sql, params=()):
+    """
+    returns the plan detail lines for a query e.g.
+    ['SEARCH trips USING INDEX idx_trips_status (status=?)']
+    """
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def is_scan(plan):
+    """
+    A plan scans when any step walks a whole table or index instead of searching it
+    """
+    return any(detail.startswith('SCAN') for detail in plan)
+
+
+def filter_queries(conn, model, columns, max_combination: int = 2):
+    """
+    The SELECTs model.filter generates for every combination of columns
+    (up to max_combination at a time) plus the keyset paged form of each.
+    """
+    queries = []
+    for size in range(1, max_combination + 1):
+        for combo in combinations(columns, size):
+            kwargs = {column: '0' for column in combo}
+            queries.append(model._select(conn, **kwargs))
+            queries.append(model._select(conn, after=0, limit=100, **kwargs))
+    return queries
+
+
+def report(conn, queries):
+    """
+    returns a list of {'sql', 'scan', 'plan'} for each query, scans first
+    """
+    rows = []
+    for sql, params in queries:
+        plan = explain(conn, sql, params)
+        rows.append({'sql': sql, 'scan': is_scan(plan), 'plan': plan})
+    rows.sort(key=lambda row: not row['scan'])
+    return rows
+
+
+# columns the API lets clients filter on
+TRIP_FILTERS = ['broker', 'rate', 'rate_con_number', 'status', 'driver_id', 'truck_id',
+                'pickup_date__gte', 'delivery_date__lte', 'rate__gte',
+                'pickup_location__startswith', 'dropoff_location__startswith']
+TRUCK_FILTERS = ['license_plate', 'model', 'year', 'towing_capacity', 'status', 'location']
+
+
+def main(path='mtl.db'):
+    import sqlite3
+    from services.trip import Trip
+    from services.truck import Truck
+
+    conn = sqlite3.connect(path)
+    queries = [(f'SELECT * FROM {model.table_name} WHERE id = ?', (0,)) for model in (Trip, Truck)]
+    queries += filter_queries(conn, Trip, TRIP_FILTERS)
+    queries += filter_queries(conn, Truck, TRUCK_FILTERS, max_combination=1)
+    rows = report(conn, queries)
+    conn.close()
+
+    scans = sum(row['scan'] for row in rows)
+    for row in rows:
+        print(f"{'SCAN  ' if row['scan'] else 'index '} {row['sql']}")
+        for detail in row['plan']:
+            print(f'        {detail}')
+    print(f'{scans} of {len(rows)} queries scan')
+    return scans
+
+
+if __name__ == '__main__':
+    import sys
+    main(*sys.argv[1:2])
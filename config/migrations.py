@@ -0,0 +1,422 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Versioned schema migrations for the sqlite database.
+"""
+
+"""
+Goals for this module:
+- Keep every schema change in one ordered list instead of CREATE TABLE IF NOT EXISTS on import.
+- Record which version a database file is at so each change runs exactly once.
+- Run each migration in its own transaction so a failure leaves the previous version intact.
+
+Adding a change: append (next version, description, [steps]) to MIGRATIONS.
+A step is either a sql string or a function taking the connection (for backfills).
+Never edit a migration that has shipped, add a new one.
+"""
+
+from datetime import datetime
+
+from config import aggregates
+from logger import activity_logger, error_logger
+
+
+def _revenue_key(row):
+    return (f"day = substr({row}.pickup_date, 1, 10) AND truck_id = {row}.truck_id "
+            f"AND broker = {row}.broker AND status = {row}.status")
+
+
+def _revenue_add(row):
+    # a trip counts on the day of its pickup_date
+    return f'''INSERT OR IGNORE INTO revenue_daily (day, truck_id, broker, status, trips, revenue)
+                VALUES (substr({row}.pickup_date, 1, 10), {row}.truck_id, {row}.broker, {row}.status, 0, 0);
+            UPDATE revenue_daily SET trips = trips + 1, revenue = revenue + {row}.rate WHERE {_revenue_key(row)};'''
+
+
+def _revenue_remove(row):
+    # a key without trips is dropped so the rollup only holds days that had some
+    return f'''UPDATE revenue_daily SET trips = trips - 1, revenue = revenue - {row}.rate WHERE {_revenue_key(row)};
+            DELETE FROM revenue_daily WHERE {_revenue_key(row)} AND trips <= 0;'''
+
+
+def _driver_pay_rate(conn):
+    # drivers tables made before migrations (name, phone) have no pay_rate
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(drivers)').fetchall()]
+    if 'pay_rate' not in columns:
+        conn.execute('ALTER TABLE drivers ADD COLUMN pay_rate REAL NOT NULL DEFAULT 0')
+
+
+MIGRATIONS = [
+    (1, 'base tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            truck_id INTEGER NOT NULL,
+            broker TEXT NOT NULL,
+            rate_con_number TEXT NOT NULL,
+            rate REAL NOT NULL,
+            pickup_location TEXT NOT NULL,
+            dropoff_location TEXT NOT NULL,
+            pickup_date TEXT NOT NULL,
+            delivery_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            driver_id INTEGER,
+            FOREIGN KEY (driver_id) REFERENCES drivers(id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS trucks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT,
+            model TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            towing_capacity INTEGER NOT NULL,
+            location TEXT,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fname TEXT NOT NULL,
+            lname TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            profile_picture TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS drivers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_number TEXT NOT NULL,
+            pay_rate REAL NOT NULL,
+            status TEXT,
+            profile_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''',
+    ]),
+    (2, 'indexes for trip and truck filters', [
+        'CREATE INDEX IF NOT EXISTS idx_trips_status ON trips(status)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_truck_pickup ON trips(truck_id, pickup_date)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_driver_pickup ON trips(driver_id, pickup_date)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_broker ON trips(broker)',
+        'CREATE INDEX IF NOT EXISTS idx_trucks_status ON trucks(status)',
+        'ANALYZE',
+    ]),
+    (3, 'indexes for date, location and rate filters on trips', [
+        'CREATE INDEX IF NOT EXISTS idx_trips_pickup_date ON trips(pickup_date)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_delivery_date ON trips(delivery_date)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_pickup_location ON trips(pickup_location)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_dropoff_location ON trips(dropoff_location)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_rate ON trips(rate)',
+        'ANALYZE',
+    ]),
+    (4, 'trigger maintained counters for the dashboard', [
+        'CREATE TABLE IF NOT EXISTS table_counts (name TEXT PRIMARY KEY, count INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS trip_status_counts (status TEXT PRIMARY KEY, count INTEGER NOT NULL)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_count_insert AFTER INSERT ON trips BEGIN
+            UPDATE table_counts SET count = count + 1 WHERE name = 'trips';
+            INSERT OR IGNORE INTO trip_status_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE trip_status_counts SET count = count + 1 WHERE status = NEW.status;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_count_delete AFTER DELETE ON trips BEGIN
+            UPDATE table_counts SET count = count - 1 WHERE name = 'trips';
+            UPDATE trip_status_counts SET count = count - 1 WHERE status = OLD.status;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_count_status AFTER UPDATE OF status ON trips
+        WHEN OLD.status IS NOT NEW.status BEGIN
+            UPDATE trip_status_counts SET count = count - 1 WHERE status = OLD.status;
+            INSERT OR IGNORE INTO trip_status_counts (status, count) VALUES (NEW.status, 0);
+            UPDATE trip_status_counts SET count = count + 1 WHERE status = NEW.status;
+        END
+        ''',
+        *[f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_count_{event} AFTER {event.upper()} ON {table} BEGIN
+            UPDATE table_counts SET count = count {sign} 1 WHERE name = '{table}';
+        END
+        ''' for table in ('trucks', 'drivers') for event, sign in (('insert', '+'), ('delete', '-'))],
+        aggregates.rebuild,
+    ]),
+    (5, 'indexes for the dashboard sections', [
+        'CREATE INDEX IF NOT EXISTS idx_trips_status_delivery ON trips(status, delivery_date)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_status_updated ON trips(status, updated_at)',
+        'CREATE INDEX IF NOT EXISTS idx_trips_updated_at ON trips(updated_at)',
+        # status lookups use the leading column of idx_trips_status_delivery now
+        'DROP INDEX IF EXISTS idx_trips_status',
+        'ANALYZE',
+    ]),
+    (6, 'full text search over trip broker, rate con number and locations', [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS trips_fts USING fts5(
+            broker, rate_con_number, pickup_location, dropoff_location,
+            content='trips', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_fts_insert AFTER INSERT ON trips BEGIN
+            INSERT INTO trips_fts (rowid, broker, rate_con_number, pickup_location, dropoff_location)
+            VALUES (NEW.id, NEW.broker, NEW.rate_con_number, NEW.pickup_location, NEW.dropoff_location);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_fts_delete AFTER DELETE ON trips BEGIN
+            INSERT INTO trips_fts (trips_fts, rowid, broker, rate_con_number, pickup_location, dropoff_location)
+            VALUES ('delete', OLD.id, OLD.broker, OLD.rate_con_number, OLD.pickup_location, OLD.dropoff_location);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_fts_update
+        AFTER UPDATE OF broker, rate_con_number, pickup_location, dropoff_location ON trips BEGIN
+            INSERT INTO trips_fts (trips_fts, rowid, broker, rate_con_number, pickup_location, dropoff_location)
+            VALUES ('delete', OLD.id, OLD.broker, OLD.rate_con_number, OLD.pickup_location, OLD.dropoff_location);
+            INSERT INTO trips_fts (rowid, broker, rate_con_number, pickup_location, dropoff_location)
+            VALUES (NEW.id, NEW.broker, NEW.rate_con_number, NEW.pickup_location, NEW.dropoff_location);
+        END
+        ''',
+        "INSERT INTO trips_fts (trips_fts) VALUES ('rebuild')",
+    ]),
+    (7, 'append only trip history written by triggers', [
+        '''
+        CREATE TABLE IF NOT EXISTS trip_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id INTEGER NOT NULL,
+            truck_id INTEGER,
+            driver_id INTEGER,
+            ts TEXT NOT NULL,
+            event TEXT NOT NULL,
+            field TEXT,
+            old_value TEXT,
+            new_value TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_trip_events_trip_ts ON trip_events(trip_id, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_trip_events_truck_ts ON trip_events(truck_id, ts)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trip_events_no_update BEFORE UPDATE ON trip_events BEGIN
+            SELECT RAISE(ABORT, 'trip_events is append only');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trip_events_no_delete BEFORE DELETE ON trip_events BEGIN
+            SELECT RAISE(ABORT, 'trip_events is append only');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trips_event_created AFTER INSERT ON trips BEGIN
+            INSERT INTO trip_events (trip_id, truck_id, driver_id, ts, event, new_value)
+            VALUES (NEW.id, NEW.truck_id, NEW.driver_id, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'),
+                    'created', NEW.status);
+        END
+        ''',
+        *[f'''
+        CREATE TRIGGER IF NOT EXISTS trips_event_{column} AFTER UPDATE OF {column} ON trips
+        WHEN OLD.{column} IS NOT NEW.{column} BEGIN
+            INSERT INTO trip_events (trip_id, truck_id, driver_id, ts, event, field, old_value, new_value)
+            VALUES (NEW.id, NEW.truck_id, NEW.driver_id, strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'),
+                    '{event}', '{column}', OLD.{column}, NEW.{column});
+        END
+        ''' for column, event in (('status', 'status'), ('truck_id', 'truck'), ('driver_id', 'driver'),
+                                  ('broker', 'updated'), ('rate_con_number', 'updated'), ('rate', 'updated'),
+                                  ('pickup_location', 'updated'), ('dropoff_location', 'updated'),
+                                  ('pickup_date', 'updated'), ('delivery_date', 'updated'))],
+        # trips that existed before the log get their created event
+        '''
+        INSERT INTO trip_events (trip_id, truck_id, driver_id, ts, event, new_value)
+        SELECT id, truck_id, driver_id, created_at, 'created', status FROM trips ORDER BY id
+        ''',
+    ]),
+    (8, 'geocoded locations', [
+        # keyed by the normalized address, lat / lon stay NULL for an address that could not be placed
+        '''
+        CREATE TABLE IF NOT EXISTS geocodes (
+            address TEXT PRIMARY KEY,
+            lat REAL,
+            lon REAL,
+            precision TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'latest truck positions written by the location store', [
+        # ts is the epoch second of the ping, rows are only replaced by a newer one
+        '''
+        CREATE TABLE IF NOT EXISTS truck_locations (
+            truck_id INTEGER PRIMARY KEY,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            ts INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    (10, 'append only raw truck pings written by the ping buffer', [
+        # ts is when the device took the ping, received_at when the api got it (epoch seconds)
+        '''
+        CREATE TABLE IF NOT EXISTS truck_pings (
+            id INTEGER PRIMARY KEY,
+            truck_id INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            ts INTEGER NOT NULL,
+            received_at INTEGER NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_truck_pings_truck_ts ON truck_pings(truck_id, ts)',
+        # old pings may be deleted to keep the table small, never changed
+        '''
+        CREATE TRIGGER IF NOT EXISTS truck_pings_no_update BEFORE UPDATE ON truck_pings BEGIN
+            SELECT RAISE(ABORT, 'truck_pings is append only');
+        END
+        ''',
+    ]),
+    (11, 'driver pay models and payroll snapshots', [
+        _driver_pay_rate,
+        "ALTER TABLE drivers ADD COLUMN pay_model TEXT NOT NULL DEFAULT 'per_mile' "
+        "CHECK (pay_model IN ('per_mile', 'percentage', 'flat'))",
+        # one run per pay period, last_driver_id is how far it got so a stopped run carries on from there
+        '''
+        CREATE TABLE IF NOT EXISTS payroll_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            period_start TEXT NOT NULL,
+            period_end TEXT NOT NULL,
+            status TEXT NOT NULL,
+            last_driver_id INTEGER NOT NULL DEFAULT 0,
+            drivers INTEGER NOT NULL DEFAULT 0,
+            trips INTEGER NOT NULL DEFAULT 0,
+            gross REAL NOT NULL DEFAULT 0,
+            driver_pay REAL NOT NULL DEFAULT 0,
+            company_margin REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            completed_at TEXT,
+            UNIQUE (period_start, period_end)
+        )
+        ''',
+        # pay model and rate are copied so the snapshot does not change with the driver
+        '''
+        CREATE TABLE IF NOT EXISTS payroll_lines (
+            run_id INTEGER NOT NULL REFERENCES payroll_runs(id),
+            driver_id INTEGER NOT NULL,
+            pay_model TEXT NOT NULL,
+            pay_rate REAL NOT NULL,
+            trips INTEGER NOT NULL,
+            loaded_miles REAL NOT NULL,
+            unmeasured_trips INTEGER NOT NULL,
+            gross REAL NOT NULL,
+            driver_pay REAL NOT NULL,
+            company_margin REAL NOT NULL,
+            PRIMARY KEY (run_id, driver_id)
+        ) WITHOUT ROWID
+        ''',
+        # payroll reads each driver's delivered trips of a period
+        'CREATE INDEX IF NOT EXISTS idx_trips_driver_delivery ON trips(driver_id, status, delivery_date)',
+    ]),
+    (12, 'daily revenue rollup', [
+        # one row per pickup day, truck, broker and status, weeks and months are summed from it
+        # (services/revenue.py), avg rate is revenue / trips
+        '''
+        CREATE TABLE IF NOT EXISTS revenue_daily (
+            day TEXT NOT NULL,
+            truck_id INTEGER NOT NULL,
+            broker TEXT NOT NULL,
+            status TEXT NOT NULL,
+            trips INTEGER NOT NULL,
+            revenue REAL NOT NULL,
+            PRIMARY KEY (day, truck_id, broker, status)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trips_revenue_insert AFTER INSERT ON trips BEGIN
+            {_revenue_add('NEW')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trips_revenue_delete AFTER DELETE ON trips BEGIN
+            {_revenue_remove('OLD')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trips_revenue_update AFTER UPDATE OF pickup_date, truck_id, broker, status, rate ON trips
+        WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in ('pickup_date', 'truck_id', 'broker', 'status', 'rate'))}
+        BEGIN
+            {_revenue_remove('OLD')}
+            {_revenue_add('NEW')}
+        END
+        ''',
+        aggregates.rebuild_revenue,
+    ]),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    """
+    Highest applied version, 0 for a database that has never been migrated
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+    row = conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, target: int | None = None):
+    """
+    Apply every migration above the current version up to target (default latest).
+    returns the list of versions applied
+    """
+    target = latest_version() if target is None else target
+    version = current_version(conn)
+    applied = []
+    for number, description, steps in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        conn.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)',
+                         (number, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            error_logger.error(f"Migration {number} ({description}) failed: {e}")
+            raise
+        if getattr(conn, 'table_columns', None):
+            conn.table_columns.clear()
+        activity_logger.info(f"Applied migration {number}: {description}")
+        applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else 'mtl.db')
+    print(f'schema version {current_version(conn)}')
+    for number in migrate(conn):
+        print(f'applied {number}')
+    print(f'schema version {current_version(conn)}')
+    conn.close()
@@ -0,0 +1,234 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Bounded pool of sqlite connections shared by the API handlers.
+"""
+
+"""
+Goals for this module:
+- Stop opening (and leaking) a new sqlite connection on every request.
+- Bound the number of open connections and make callers wait for a free one.
+- Check connections are still usable before handing them out.
+- Keep numbers (in use, waits, checkout latency) so the pool can be sized.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from logger import error_logger
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection that can carry per-connection caches
+    (e.g. table columns for config.query)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table_columns = {}
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection became free within the pool timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    Hands out a bounded number of sqlite connections.
+
+    acquire()/release() can happen on different threads, which is what the
+    FastAPI dependency needs (setup and teardown run in the threadpool).
+    connection() is the per-thread form: nested checkouts on the same thread
+    reuse the connection that thread already holds instead of taking a second one.
+    """
+
+    def __init__(self, database, size: int = 5, timeout: float = 30.0, pragmas: dict | None = None,
+                 uri: bool = False, busy_timeout: float = 5.0, cached_statements: int = 128,
+                 health_check: bool = True):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        self.uri = uri
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.health_check = health_check
+
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._opened = 0
+        self._in_use = 0
+        self._closed = False
+
+        # stats
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._checkout_total = 0.0
+        self._checkout_max = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, uri=self.uri, timeout=self.busy_timeout,
+                               check_same_thread=False, cached_statements=self.cached_statements,
+                               factory=Connection)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error as e:
+            error_logger.error(f"Discarding broken pooled connection: {e}")
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+            self._discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def acquire(self):
+        """
+        Check a connection out of the pool, waiting up to `timeout` seconds
+        when every connection is in use.
+        """
+        if self._closed:
+            raise PoolTimeout('Connection pool is closed')
+        start = time.perf_counter()
+        waited = False
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._opened < self.size
+                    if can_open:
+                        self._opened += 1
+                if can_open:
+                    try:
+                        conn = self._connect()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._opened -= 1
+                        raise
+                    break
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                try:
+                    conn = self._idle.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    with self._lock:
+                        self._waits += 1
+                        self._timeouts += 1
+                    raise PoolTimeout(f'No database connection free after {self.timeout}s')
+
+            if self.health_check and not self._healthy(conn):
+                self._discard(conn)
+                conn = None
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._waits += int(waited)
+            self._checkout_total += elapsed
+            self._checkout_max = max(self._checkout_max, elapsed)
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection to the pool. Work left uncommitted is rolled back
+        so the next borrower starts clean.
+        """
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Per-thread checkout. Nested use on the same thread gets the same connection.
+        """
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self.acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self.release(conn)
+
+    def dependency(self):
+        """
+        FastAPI dependency: `conn = Depends(pool.dependency)`
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'avg_checkout_ms': round(self._checkout_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'max_checkout_ms': round(self._checkout_max * 1000, 3),
+            }
+
+    def close(self):
+        """
+        Close idle connections; connections still checked out are closed on release.
+        """
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
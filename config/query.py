@@ -0,0 +1,330 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Builds the SQL ConfigManager runs and caches the statement text.
+"""
+
+"""
+Goals for this module:
+- One place that turns (table, operation, columns) into SQL.
+- Canonical column order so the same set of query params always gives the same statement text,
+  which lets sqlite3 reuse its prepared statement instead of parsing a new one.
+- Only column names that exist in the table ever reach the SQL text.
+- Hit / miss numbers for the statement cache.
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+
+
+# Distinct statements kept, sqlite3's cached_statements on pooled connections is sized to match
+STATEMENT_CACHE_SIZE = 256
+
+
+class InvalidColumn(ValueError):
+    """
+    Raised when a query names a column the table does not have
+    """
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = sorted(columns)
+        super().__init__(f"Unknown column(s) for {table}: {', '.join(self.columns)}")
+
+
+class StatementCache:
+    """
+    LRU of statement text keyed by (operation, table, columns ...)
+    """
+
+    def __init__(self, max_size: int = STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        """
+        returns the cached statement for key, calling build() to make it on a miss
+        """
+        with self._lock:
+            sql = self._statements.get(key)
+            if sql is not None:
+                self._statements.move_to_end(key)
+                self.hits += 1
+                return sql
+            self.misses += 1
+        sql = build()
+        with self._lock:
+            self._statements[key] = sql
+            if len(self._statements) > self.max_size:
+                self._statements.popitem(last=False)
+                self.evictions += 1
+        return sql
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._statements),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+statement_cache = StatementCache()
+
+
+def table_columns(conn, table):
+    """
+    Column names of table. Pooled connections (config.pool.Connection) keep the
+    answer so the PRAGMA only runs once per connection and table.
+    """
+    cache = getattr(conn, 'table_columns', None)
+    if cache is not None and table in cache:
+        return cache[table]
+    columns = frozenset(row[1] for row in conn.execute(f'PRAGMA table_info({table})'))
+    if cache is not None and columns:
+        cache[table] = columns
+    return columns
+
+
+def check_columns(conn, table, names):
+    """
+    Raise InvalidColumn unless every name is a column of table
+    """
+    unknown = set(names) - table_columns(conn, table)
+    if unknown:
+        raise InvalidColumn(table, unknown)
+
+
+# lookups a filter key can end with, e.g. pickup_date__gte or status__in
+LOOKUPS = {
+    'eq': '{column}=?',
+    'gt': '{column}>?',
+    'gte': '{column}>=?',
+    'lt': '{column}<?',
+    'lte': '{column}<=?',
+    # for code only, the routes take a range as __gte / __lte
+    'between': '{column} BETWEEN ? AND ?',
+    'in': '{column} IN ({placeholders})',
+    # a range on the prefix instead of LIKE so the column index is used
+    'startswith': '{column}>=? AND {column}<?',
+}
+
+# IN lists longer than this are bound as one json array, so the statement text stays the same
+# whatever the number of values (ids found near a location can be hundreds, one statement per
+# count would push everything else out of the statement cache and could pass the bound
+# parameter limit)
+IN_PLACEHOLDERS_MAX = 16
+# internal lookups parse_filters switches to, not accepted in a filter key
+INTERNAL_LOOKUPS = {
+    'in_json': '{column} IN (SELECT value FROM json_each(?))',
+}
+
+
+class InvalidLookup(InvalidColumn):
+    """
+    Raised when a filter uses an unknown lookup or a value it cannot take
+    """
+    def __init__(self, table, key, reason):
+        self.table = table
+        self.columns = [key]
+        ValueError.__init__(self, f"Invalid filter {key} for {table}: {reason}")
+
+
+def prefix_bounds(prefix: str):
+    """
+    (low, high) so that low <= text < high is every text starting with prefix, high is None
+    when nothing sorts above the prefix but text starting with it (it is all U+10FFFF).
+    Trailing U+10FFFF cannot be bumped, so they are dropped and the character before is, and
+    the surrogates (which sqlite cannot store) are stepped over.
+    """
+    stem = prefix.rstrip(chr(0x10FFFF))
+    if not stem:
+        return prefix, None
+    following = ord(stem[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        following = 0xE000
+    return prefix, stem[:-1] + chr(following)
+
+
+def parse_filters(table, filters: dict):
+    """
+    Split filter keys into (column, lookup) and normalise their values
+    returns a sorted list of (column, lookup, values)
+    """
+    parsed = []
+    for key, value in filters.items():
+        if value is None:
+            continue
+        column, _, lookup = key.partition('__')
+        lookup = lookup or 'eq'
+        if lookup not in LOOKUPS:
+            raise InvalidLookup(table, key, f"unknown lookup {lookup}, use one of {', '.join(LOOKUPS)}")
+        if lookup == 'in':
+            values = tuple(value) if isinstance(value, (list, tuple, set, frozenset)) else (value,)
+            if not values:
+                raise InvalidLookup(table, key, 'needs at least one value')
+            if len(values) == 1:
+                lookup = 'eq'
+            elif len(values) > IN_PLACEHOLDERS_MAX:
+                lookup, values = 'in_json', (json.dumps(list(values)),)
+        elif lookup == 'between':
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise InvalidLookup(table, key, 'needs two values (low, high)')
+            values = tuple(value)
+        elif lookup == 'startswith':
+            if not isinstance(value, str) or not value:
+                raise InvalidLookup(table, key, 'needs a non empty string')
+            low, high = prefix_bounds(value)
+            lookup, values = ('startswith', (low, high)) if high is not None else ('gte', (low,))
+        else:
+            values = (value,)
+        parsed.append((column, lookup, values))
+    parsed.sort(key=lambda item: (item[0], item[1]))
+    return parsed
+
+
+def parse_order_by(table, order_by):
+    """
+    'pickup_date' / '-pickup_date' or a comma separated list of them
+    returns a tuple of (column, descending)
+    """
+    if not order_by:
+        return ()
+    if isinstance(order_by, str):
+        order_by = order_by.split(',')
+    order = []
+    for item in order_by:
+        item = item.strip()
+        descending = item.startswith('-')
+        order.append((item.lstrip('-'), descending))
+    return tuple(order)
+
+
+def parse_fields(fields):
+    """
+    'id,status' or a list of names -> sorted tuple of column names, () means every column
+    """
+    if not fields:
+        return ()
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return tuple(sorted({field.strip() for field in fields if field.strip()}))
+
+
+def projection(fields: tuple):
+    return ', '.join(fields) if fields else '*'
+
+
+def select_sql(conn, table, filters: dict, after=None, limit=None, order_by=None, fields=None):
+    """
+    SELECT with filters, optional keyset page (id > after ORDER BY id LIMIT n)
+    filters are column=value or column__lookup=value, see LOOKUPS
+    order_by sorts by other columns (id breaks ties), it cannot be combined with after
+    because the keyset cursor is the id
+    fields limits the columns selected, id is always included since it is the page cursor
+    returns (sql, params)
+    """
+    parsed = parse_filters(table, filters)
+    order = parse_order_by(table, order_by)
+    if order and after is not None:
+        raise InvalidLookup(table, 'order_by', 'cannot page with after, pages are keyed on id')
+    fields = parse_fields(fields)
+    if fields and 'id' not in fields:
+        fields = tuple(sorted(fields + ('id',)))
+    check_columns(conn, table, {column for column, _, _ in parsed} | {column for column, _ in order} | set(fields))
+    shape = tuple((column, lookup, len(values) if lookup == 'in' else 0) for column, lookup, values in parsed)
+    paged = after is not None, limit is not None
+
+    def build():
+        conditions = [(LOOKUPS.get(lookup) or INTERNAL_LOOKUPS[lookup]).format(column=column, placeholders=', '.join('?' * size))
+                      for column, lookup, size in shape]
+        if paged[0]:
+            conditions.append("id>?")
+        sql = f"SELECT {projection(fields)} FROM {table}"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        if order:
+            terms = [f"{column} DESC" if descending else column for column, descending in order]
+            sql += f" ORDER BY {', '.join(terms)}, id"
+        elif any(paged):
+            sql += " ORDER BY id"
+        if paged[1]:
+            sql += " LIMIT ?"
+        return sql
+
+    sql = statement_cache.get(('select', table, shape, paged, order, fields), build)
+    params = [value for _, _, values in parsed for value in values]
+    if after is not None:
+        params.append(after)
+    if limit is not None:
+        params.append(limit)
+    return sql, tuple(params)
+
+
+def get_sql(conn, table, fields=None):
+    """
+    SELECT one row by id, only the given fields when there are any
+    """
+    fields = parse_fields(fields)
+    if fields:
+        check_columns(conn, table, fields)
+    return statement_cache.get(('get', table, fields), lambda: f"SELECT {projection(fields)} FROM {table} WHERE id = ?")
+
+
+def fts_query(text: str):
+    """
+    Turn what a user typed into an FTS5 MATCH expression.
+    Every word becomes a quoted prefix term so punctuation in the input
+    (commas in addresses, dashes in rate con numbers) can never be a syntax error.
+    'greens nc' -> '"greens"* "nc"*'  (all words must match)
+    returns None when there is nothing to search for
+    """
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def update_sql(conn, table, values: dict, id, returning: bool = False):
+    """
+    UPDATE table SET ... WHERE id=? [RETURNING *]
+    returns (sql, params)
+    """
+    columns = tuple(sorted(values))
+    check_columns(conn, table, columns)
+
+    def build():
+        sql = f"UPDATE {table} SET {', '.join(f'{column}=?' for column in columns)} WHERE id=?"
+        return f"{sql} RETURNING *" if returning else sql
+
+    sql = statement_cache.get(('update', table, columns, returning), build)
+    return sql, tuple([values[column] for column in columns] + [id])
+
+
+def insert_sql(conn, table, columns, rows: int = 1, returning: bool = False):
+    """
+    INSERT INTO table (...) VALUES (?, ...)[, (?, ...) for each of rows] [RETURNING id]
+    returns (sql, columns in the order the values of each row must be passed)
+    """
+    columns = tuple(sorted(columns))
+    check_columns(conn, table, columns)
+
+    def build():
+        values = f"({', '.join('?' * len(columns))})"
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([values] * rows)}"
+        return f"{sql} RETURNING id" if returning else sql
+
+    return statement_cache.get(('insert', table, columns, rows, returning), build), columns
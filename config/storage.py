@@ -0,0 +1,131 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Read/write split over the connection pools, WAL by default.
+"""
+
+"""
+Goals for this module:
+- Put the database in WAL mode so a commit never blocks readers.
+- Send every read through a read-only set of connections.
+- Send every write through one dedicated writer connection so writes are serialized in the app
+  instead of fighting over the sqlite write lock.
+- Keep the old rollback journal available (one shared pool) for setups that cannot use WAL
+  e.g. database on a network share.
+"""
+
+import sqlite3
+import threading
+
+from config.pool import ConnectionPool
+from logger import activity_logger, error_logger
+
+
+WAL = 'wal'
+ROLLBACK = 'rollback'
+
+
+class Storage:
+    """
+    Owns the reader and writer pools for one database file.
+
+    wal mode:
+        reader -> `readers` read-only connections
+        writer -> a pool of exactly one connection, checkouts queue up behind it
+    rollback mode:
+        reader and writer are the same pool of `readers` connections
+    """
+
+    def __init__(self, database, mode: str = WAL, readers: int = 8, timeout: float = 30.0,
+                 pragmas: dict | None = None, synchronous: str = 'NORMAL',
+                 autocheckpoint: int = 1000, checkpoint_interval: float | None = None,
+                 cached_statements: int = 128):
+        if mode not in (WAL, ROLLBACK):
+            raise ValueError(f'Unknown storage mode: {mode}')
+        self.database = database
+        self.mode = mode
+        self.synchronous = synchronous
+        self.autocheckpoint = autocheckpoint
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpoints = 0
+        self._stop = threading.Event()
+        self._checkpointer = None
+        pragmas = dict(pragmas or {})
+
+        if mode == WAL:
+            self._set_journal_mode('WAL')
+            writer_pragmas = dict(pragmas, synchronous=synchronous, wal_autocheckpoint=autocheckpoint)
+            self.writer = ConnectionPool(database, size=1, timeout=timeout, pragmas=writer_pragmas,
+                                         cached_statements=cached_statements)
+            self.reader = ConnectionPool(f'file:{database}?mode=ro', uri=True, size=readers, timeout=timeout,
+                                         pragmas=pragmas, cached_statements=cached_statements)
+            if checkpoint_interval:
+                self._checkpointer = threading.Thread(target=self._checkpoint_loop, name='wal-checkpoint', daemon=True)
+                self._checkpointer.start()
+        else:
+            self._set_journal_mode('DELETE')
+            pool = ConnectionPool(database, size=readers, timeout=timeout, pragmas=pragmas,
+                                  cached_statements=cached_statements)
+            self.writer = self.reader = pool
+
+    def _set_journal_mode(self, journal_mode):
+        conn = sqlite3.connect(self.database)
+        try:
+            current = conn.execute(f'PRAGMA journal_mode = {journal_mode}').fetchone()[0]
+            activity_logger.info(f"Database {self.database} journal mode: {current}")
+        finally:
+            conn.close()
+
+    def read_db(self):
+        """
+        FastAPI dependency for handlers that only read
+        """
+        yield from self.reader.dependency()
+
+    def write_db(self):
+        """
+        FastAPI dependency for handlers that write, waits for the single writer
+        """
+        yield from self.writer.dependency()
+
+    def checkpoint(self, mode: str = 'PASSIVE'):
+        """
+        Copy WAL frames back into the database file.
+        PASSIVE never waits on readers or the writer, TRUNCATE also resets the WAL file size.
+        Runs on its own connection so it stays off the writer's queue.
+        """
+        if self.mode != WAL:
+            return None
+        conn = sqlite3.connect(self.database, timeout=self.writer.busy_timeout)
+        try:
+            busy, log_frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        finally:
+            conn.close()
+        self._checkpoints += 1
+        return {'busy': busy, 'log_frames': log_frames, 'checkpointed': checkpointed}
+
+    def _checkpoint_loop(self):
+        while not self._stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                error_logger.error(f"WAL checkpoint failed: {e}")
+
+    def stats(self):
+        stats = {
+            'mode': self.mode,
+            'reader': self.reader.stats(),
+        }
+        if self.mode == WAL:
+            stats['writer'] = self.writer.stats()
+            stats['synchronous'] = self.synchronous
+            stats['autocheckpoint'] = self.autocheckpoint
+            stats['checkpoint_interval'] = self.checkpoint_interval
+            stats['checkpoints'] = self._checkpoints
+        return stats
+
+    def close(self):
+        self._stop.set()
+        self.reader.close()
+        if self.writer is not self.reader:
+            self.writer.close()
@@ -0,0 +1,404 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for moving trips along their statuses from where their truck is.
+"""
+
+import threading
+
+import numpy as np
+
+import messages as msg
+from location.location import geocoder, haversine_miles, Precision, EARTH_RADIUS_MILES
+from services.trip import Trip
+from logger import activity_logger
+
+
+"""
+Goals for this module:
+- Put a circle (geofence) around the geocoded pickup and dropoff of every active trip that has
+  a truck, sized by how well the location could be placed (GEOFENCE_RADIUS_MILES).
+- Match every ping of a truck against the fences of its own trips through a sorted array of
+  (grid cell, truck) keys, one binary search per ping (O(log n)) whatever the number of trips.
+- Advance the trip when the truck has stayed inside long enough, so nobody has to tap a button:
+  PICKUP_DWELL_SECONDS at the pickup -> Loaded, leaving the pickup -> In Transit,
+  DROPOFF_DWELL_SECONDS at the dropoff -> Delivered. The moves go through
+  Trip.bulk_update_status so STATUS_TRANSITIONS still decides what is allowed.
+- Stay current the same way the availability index does, by reading trip_events.
+"""
+
+
+# fence radius by how precisely the location was placed, nothing coarser than a city gets a fence
+GEOFENCE_RADIUS_MILES = {Precision.EXACT: 0.5, Precision.ZIP: 2.0, Precision.CITY: 3.0}
+# grid cell of the fence index, 0.05 degrees is about 3.5 miles north / south
+GEOFENCE_CELL_DEGREES = 0.05
+# seconds a truck has to stay at the pickup / dropoff before the trip moves on
+PICKUP_DWELL_SECONDS = 600
+DROPOFF_DWELL_SECONDS = 600
+# a truck only counts as gone once it is this many radii away, so gps jitter on the edge is ignored
+GEOFENCE_EXIT_FACTOR = 1.5
+# statuses a trip has fences in
+ACTIVE_STATUSES = (msg.LoadStatus.SCHEDULED, msg.LoadStatus.PENDING, msg.LoadStatus.LOADED,
+                   msg.LoadStatus.IN_TRANSIT, msg.LoadStatus.LOADED_OUT)
+
+PICKUP = 'pickup'
+DROPOFF = 'dropoff'
+# truck ids take the low bits of an index key (more when a truck id needs them), the grid cell the rest
+TRUCK_BITS = 24
+# trips with new or moved fences whose keys are inserted into the index, more than this rebuild it
+GEOFENCE_INSERT_MAX = 256
+
+
+class GeofenceIndex:
+    """
+    Fences of the active trips and which of them every truck is in, see the module goals.
+
+    _trips holds trip_id -> {'truck', 'status', 'pickup', 'dropoff'} (a fence is (lat, lon, radius)
+    or None). A trip whose fences are added or moved (a status change alone does not) has the keys
+    of its new fences inserted into the sorted index on the next observe and its old fences marked
+    dead. The index is only rebuilt from _trips when many trips changed at once or dead fences are
+    half of them. Trips that left the active statuses are skipped on lookup until then.
+    """
+
+    def __init__(self, cell_degrees: float = GEOFENCE_CELL_DEGREES, pickup_dwell: int = PICKUP_DWELL_SECONDS,
+                 dropoff_dwell: int = DROPOFF_DWELL_SECONDS, geocoder=geocoder):
+        self.cell_degrees = cell_degrees
+        self.pickup_dwell = pickup_dwell
+        self.dropoff_dwell = dropoff_dwell
+        self.geocoder = geocoder
+        self._columns = int(np.ceil(360 / cell_degrees))
+        # a fence box can reach one row past the pole
+        self._cell_bits = ((int(np.ceil(180 / cell_degrees)) + 2) * self._columns).bit_length()
+        self._truck_bits = TRUCK_BITS
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._last_event = 0
+        self._trips = {}
+        self._inside = {}       # truck_id -> {(trip_id, kind): epoch second it came in}
+        self._last_ping = {}    # truck_id -> epoch second of the last ping looked at
+        self._stale = True
+        self._changed = set()   # trip ids whose fences were added or moved since the index was built
+        self._trip_fences = {}  # trip_id -> fence indexes of the trip in the index
+        self._dead = 0
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_fence = np.empty(0, dtype=np.int64)
+        self._fence_trip = np.empty(0, dtype=np.int64)
+        self._fence_kind = []
+        self._fence_lat = np.empty(0)
+        self._fence_lon = np.empty(0)
+        self._fence_radius = np.empty(0)
+        self._fence_live = np.empty(0, dtype=bool)
+        self.pings = 0
+        self.transitions = 0
+        self.rebuilds = 0
+        self.inserts = 0
+
+    def _cell(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_degrees).astype(np.int64)
+        columns = np.floor((np.asarray(lons) + 180) / self.cell_degrees).astype(np.int64) % self._columns
+        return rows * self._columns + columns
+
+    def _fences(self, conn, rows):
+        """
+        rows (id, truck_id, status, pickup_location, dropoff_location) -> _trips entries
+        """
+        places = self.geocoder.geocode_many([row[3] for row in rows] + [row[4] for row in rows], conn)
+
+        def fence(location):
+            place = places[location]
+            radius = GEOFENCE_RADIUS_MILES.get(place.precision)
+            return (place.lat, place.lon, radius) if radius else None
+
+        for trip_id, truck_id, status, pickup, dropoff in rows:
+            if truck_id is None or status not in ACTIVE_STATUSES:
+                # its keys stay in the index until the next rebuild, lookups skip them
+                self._trips.pop(trip_id, None)
+                continue
+            trip = {'truck': truck_id, 'status': status, 'pickup': fence(pickup), 'dropoff': fence(dropoff)}
+            old = self._trips.get(trip_id)
+            if old is None or (old['truck'], old['pickup'], old['dropoff']) != (truck_id, trip['pickup'], trip['dropoff']):
+                self._changed.add(trip_id)
+            self._trips[trip_id] = trip
+
+    def load(self, conn):
+        """
+        Fences for every active trip with a truck
+        """
+        with self._lock:
+            self._last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM trip_events').fetchone()[0]
+            rows = conn.execute('SELECT id, truck_id, status, pickup_location, dropoff_location FROM trips '
+                                f"WHERE truck_id IS NOT NULL AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+                                ACTIVE_STATUSES).fetchall()
+            self._trips = {}
+            self._fences(conn, rows)
+            self.loaded = True
+        activity_logger.info(f"Geofences loaded for {len(self._trips)} trips")
+
+    def reload(self, conn, trip_ids):
+        """
+        Read these trips again (status, truck and locations), caller holds the lock
+        """
+        trip_ids = list(trip_ids)
+        for start in range(0, len(trip_ids), 500):
+            chunk = trip_ids[start:start + 500]
+            rows = conn.execute('SELECT id, truck_id, status, pickup_location, dropoff_location FROM trips '
+                                f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            for missing in set(chunk) - {row[0] for row in rows}:
+                self._trips.pop(missing, None)
+            self._fences(conn, rows)
+
+    def refresh(self, conn):
+        """
+        Catch up on trip_events written since the last look, load on first use
+        """
+        if not self.loaded:
+            self.load(conn)
+        with self._lock:
+            events = conn.execute('SELECT id, trip_id FROM trip_events WHERE id > ? ORDER BY id',
+                                  (self._last_event,)).fetchall()
+            if events:
+                self._last_event = events[-1][0]
+                self.reload(conn, {row[1] for row in events})
+
+    def _truck_bits_for(self, trucks):
+        """
+        TRUCK_BITS or as many as the largest truck id needs, a truck id that cannot fit next to
+        the cell in an int64 (or is negative) is a ValueError rather than a key that reads as
+        another truck in another cell
+        """
+        if trucks and min(trucks) < 0:
+            raise ValueError(f"Truck id {min(trucks)} cannot be put in the geofence index")
+        truck_bits = max(TRUCK_BITS, max(trucks, default=0).bit_length())
+        if truck_bits + self._cell_bits > 63:
+            raise ValueError(f"Truck id {max(trucks)} does not fit a geofence index key")
+        return truck_bits
+
+    def _trip_fence_rows(self, trip_ids):
+        return [(trip_id, kind, self._trips[trip_id]['truck'], *self._trips[trip_id][kind])
+                for trip_id in trip_ids if trip_id in self._trips
+                for kind in (PICKUP, DROPOFF) if self._trips[trip_id][kind] is not None]
+
+    def _fence_keys(self, fences, first, truck_bits):
+        """
+        (keys, fence indexes) of one key (cell << truck bits | truck) per grid cell the box of
+        each fence touches, the fences are numbered from first
+        """
+        keys, owners = [], []
+        for index, (_, _, truck, lat, lon, radius) in enumerate(fences, first):
+            # fences are a few miles across, so one to four cells each
+            span = np.degrees(radius / EARTH_RADIUS_MILES)
+            span_lon = span / max(np.cos(np.radians(min(abs(lat) + span, 89.9))), 1e-6)
+            rows = range(int((lat - span + 90) // self.cell_degrees), int((lat + span + 90) // self.cell_degrees) + 1)
+            columns = range(int((lon - span_lon + 180) // self.cell_degrees),
+                            int((lon + span_lon + 180) // self.cell_degrees) + 1)
+            for row in rows:
+                for column in columns:
+                    keys.append(((row * self._columns + column % self._columns) << truck_bits) | truck)
+                    owners.append(index)
+        return np.array(keys, dtype=np.int64), np.array(owners, dtype=np.int64)
+
+    def _add_fences(self, fences):
+        """
+        Append fences to the fence arrays, returns the index of the first
+        """
+        first = len(self._fence_trip)
+        self._fence_trip = np.concatenate([self._fence_trip, np.array([f[0] for f in fences], dtype=np.int64)])
+        self._fence_kind = self._fence_kind + [fence[1] for fence in fences]
+        self._fence_lat = np.concatenate([self._fence_lat, np.array([f[3] for f in fences], dtype=float)])
+        self._fence_lon = np.concatenate([self._fence_lon, np.array([f[4] for f in fences], dtype=float)])
+        self._fence_radius = np.concatenate([self._fence_radius, np.array([f[5] for f in fences], dtype=float)])
+        self._fence_live = np.concatenate([self._fence_live, np.ones(len(fences), dtype=bool)])
+        for index, fence in enumerate(fences, first):
+            self._trip_fences.setdefault(fence[0], []).append(index)
+        return first
+
+    def _build(self):
+        """
+        Every fence of _trips from scratch, keys sorted
+        """
+        fences = self._trip_fence_rows(self._trips)
+        truck_bits = self._truck_bits_for([fence[2] for fence in fences])
+        self._fence_trip = np.empty(0, dtype=np.int64)
+        self._fence_kind = []
+        self._fence_lat, self._fence_lon, self._fence_radius = np.empty(0), np.empty(0), np.empty(0)
+        self._fence_live = np.empty(0, dtype=bool)
+        self._trip_fences = {}
+        keys, owners = self._fence_keys(fences, self._add_fences(fences), truck_bits)
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._key_fence = keys[order], owners[order]
+        self._truck_bits = truck_bits
+        self._dead = 0
+        self._changed.clear()
+        self._stale = False
+        self.rebuilds += 1
+
+    def _insert(self):
+        """
+        Kill the fences of the changed trips and insert the keys of their new ones into the
+        sorted index: a searchsorted and one np.insert (a memmove) instead of building and
+        sorting every key again in python. Falls back to _build when that is cheaper or a
+        truck id needs wider keys.
+        """
+        changed = self._changed
+        dead = sum(len(self._trip_fences.get(trip_id, ())) for trip_id in changed)
+        fences = self._trip_fence_rows(changed)
+        if (len(changed) > GEOFENCE_INSERT_MAX or (self._dead + dead) * 2 > len(self._fence_trip)
+                or self._truck_bits_for([fence[2] for fence in fences]) > self._truck_bits):
+            self._build()
+            return
+        for trip_id in changed:
+            self._fence_live[self._trip_fences.pop(trip_id, [])] = False
+        self._dead += dead
+        keys, owners = self._fence_keys(fences, self._add_fences(fences), self._truck_bits)
+        order = np.argsort(keys, kind='stable')
+        keys, owners = keys[order], owners[order]
+        slots = np.searchsorted(self._keys, keys, 'right')
+        self._keys = np.insert(self._keys, slots, keys)
+        self._key_fence = np.insert(self._key_fence, slots, owners)
+        changed.clear()
+        self.inserts += 1
+
+    def _matches(self, trucks, lats, lons):
+        """
+        (ping index, fence index) of every ping inside a fence of its truck's trips
+        """
+        # a truck id wider than the index has no fences, its key must not spill into the cell bits
+        fits = (trucks >= 0) & ((trucks >> self._truck_bits) == 0)
+        keys = np.where(fits, (self._cell(lats, lons) << self._truck_bits) | trucks, -1)
+        lo = np.searchsorted(self._keys, keys, 'left')
+        hi = np.searchsorted(self._keys, keys, 'right')
+        counts = hi - lo
+        if not counts.any():
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        pings = np.repeat(np.arange(len(keys)), counts)
+        slots = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        fences = self._key_fence[slots]
+        # fences of trips that moved since, their new ones have keys of their own
+        live = self._fence_live[fences]
+        pings, fences = pings[live], fences[live]
+        inside = haversine_miles(lats[pings], lons[pings], self._fence_lat[fences],
+                                 self._fence_lon[fences]) <= self._fence_radius[fences]
+        return pings[inside], fences[inside]
+
+    def _move(self, moves, trip_id, trip, status, ts):
+        moves.append({'trip_id': trip_id, 'truck_id': trip['truck'], 'from': trip['status'], 'to': status, 'ts': ts})
+        trip['status'] = status
+        if status not in ACTIVE_STATUSES:
+            # done, apply() reads it back if the database does not agree
+            self._trips.pop(trip_id, None)
+
+    def observe(self, conn, truck_ids, lats, lons, timestamps):
+        """
+        Look at a batch of pings (timestamps in epoch seconds) and return the status moves they
+        call for, oldest first, as [{'trip_id', 'truck_id', 'from', 'to', 'ts'}]. The moves are
+        only made in memory, apply() writes them.
+        """
+        self.refresh(conn)
+        trucks = np.asarray(truck_ids, dtype=np.int64)
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        stamps = np.asarray(timestamps, dtype=np.int64)
+        moves = []
+        with self._lock:
+            if self._stale:
+                self._build()
+            elif self._changed:
+                self._insert()
+            self.pings += len(trucks)
+            pings, fences = self._matches(trucks, lats, lons)
+            hits = {}
+            for ping, fence in zip(pings.tolist(), fences.tolist()):
+                hits.setdefault(ping, []).append(fence)
+            # only pings that touch a fence or come from a truck inside one can change anything
+            looked_at = set(hits)
+            looked_at.update(index for index, truck in enumerate(trucks.tolist()) if truck in self._inside)
+            for index in sorted(looked_at, key=lambda index: stamps[index]):
+                truck, ts = int(trucks[index]), int(stamps[index])
+                if ts < self._last_ping.get(truck, 0):
+                    continue
+                self._last_ping[truck] = ts
+                self._ping(moves, truck, float(lats[index]), float(lons[index]), ts, hits.get(index, ()))
+            self.transitions += len(moves)
+        return moves
+
+    def _ping(self, moves, truck, lat, lon, ts, fences):
+        """
+        One ping of a truck that is in fences (indexes) or was in some before, caller holds the lock
+        """
+        inside = self._inside.setdefault(truck, {})
+        now_in = set()
+        for fence in fences:
+            trip_id, kind = int(self._fence_trip[fence]), self._fence_kind[fence]
+            trip = self._trips.get(trip_id)
+            if trip is None or trip['truck'] != truck or trip['status'] not in ACTIVE_STATUSES:
+                continue
+            now_in.add((trip_id, kind))
+            since = inside.setdefault((trip_id, kind), ts)
+            status = trip['status']
+            if kind == PICKUP:
+                if status in (msg.LoadStatus.SCHEDULED, msg.LoadStatus.PENDING) and ts - since >= self.pickup_dwell:
+                    self._move(moves, trip_id, trip, msg.LoadStatus.LOADED, ts)
+            else:
+                if status == msg.LoadStatus.LOADED:
+                    # made it to the dropoff without a ping outside the pickup
+                    self._move(moves, trip_id, trip, msg.LoadStatus.IN_TRANSIT, ts)
+                    status = trip['status']
+                if status in (msg.LoadStatus.IN_TRANSIT, msg.LoadStatus.LOADED_OUT) and ts - since >= self.dropoff_dwell:
+                    self._move(moves, trip_id, trip, msg.LoadStatus.DELIVERED, ts)
+
+        for trip_id, kind in [key for key in inside if key not in now_in]:
+            trip = self._trips.get(trip_id)
+            fence = trip[kind] if trip is not None and trip['truck'] == truck else None
+            if fence is not None and haversine_miles(lat, lon, fence[0], fence[1]) <= fence[2] * GEOFENCE_EXIT_FACTOR:
+                continue
+            del inside[(trip_id, kind)]
+            if fence is not None and kind == PICKUP and trip['status'] == msg.LoadStatus.LOADED:
+                self._move(moves, trip_id, trip, msg.LoadStatus.IN_TRANSIT, ts)
+        if not inside:
+            del self._inside[truck]
+
+    def apply(self, conn, moves):
+        """
+        Write the moves from observe() with Trip.bulk_update_status, needs the writer.
+        Trips the database refused are read again so memory follows what is stored.
+        """
+        applied, rejected = [], []
+        group, status = [], None
+        for move in moves + [None]:
+            if move is None or move['to'] != status or move['trip_id'] in group:
+                if group:
+                    res = Trip.bulk_update_status(conn, group, status).raw()['updated']
+                    applied += [{'trip_id': trip_id, 'status': status} for trip_id in res['applied']]
+                    rejected += res['rejected']
+                group, status = [], move and move['to']
+            if move is not None:
+                group.append(move['trip_id'])
+        if rejected:
+            with self._lock:
+                self.reload(conn, {row['id'] for row in rejected})
+        if applied:
+            activity_logger.info(f"Geofences moved {len(applied)} trips: {applied}")
+        return msg.ResourceUpdated({'applied': applied, 'rejected': rejected})
+
+    def trip(self, trip_id: int):
+        """
+        Fences of one trip and whether its truck is in them, None when it has none
+        """
+        with self._lock:
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                return None
+            inside = self._inside.get(trip['truck'], {})
+            return {'trip_id': trip_id, 'truck_id': trip['truck'], 'status': trip['status'],
+                    **{kind: None if trip[kind] is None else
+                       {'lat': trip[kind][0], 'lon': trip[kind][1], 'radius': trip[kind][2],
+                        'inside_since': inside.get((trip_id, kind))} for kind in (PICKUP, DROPOFF)}}
+
+    def stats(self):
+        with self._lock:
+            return {'trips': len(self._trips), 'fences': len(self._fence_trip), 'index_keys': len(self._keys),
+                    'trucks_inside': len(self._inside), 'pings': self.pings, 'transitions': self.transitions,
+                    'rebuilds': self.rebuilds, 'inserts': self.inserts, 'dead_fences': self._dead,
+                    'last_event': self._last_event}
+
+
+geofences = GeofenceIndex()
@@ -0,0 +1,917 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for turning free text trip locations into coordinates without a network call.
+"""
+
+import csv
+import gzip
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from logger import activity_logger, error_logger
+
+
+"""
+Goals for this module:
+- Normalize addresses like "3562 Hewitt St Greensboro, NC" or "170 Glenwood Ave, Raleigh, NC 27601"
+  (case, punctuation, spacing, state names, St / Ft / Mt) so the same place gives the same key.
+- Resolve them offline against the bundled gazetteer in location/data (us zip centroids, city
+  and state centroids are averaged from it): zip first, then city + state, then state.
+  Locations already written as "lat, lon" are used as they are.
+- Remember every answer, in process (LRU) and in the geocodes table (migration 8), so miles,
+  deadhead and nearest truck never geocode the same text twice. Answers found on the request
+  path wait in memory and are written through the writer in batches every
+  GEOCODE_FLUSH_INTERVAL seconds, so they outlive a restart without a commit per request.
+- Geocode every location of the trips table in one batch: python -m location.location geocode-trips mtl.db
+- Keep where every truck is in memory (TruckLocationStore): the latest position per truck and
+  a ring buffer of recent pings in numpy arrays, written to truck_locations every
+  LOCATION_FLUSH_INTERVAL seconds instead of one UPDATE per ping.
+- Answer "which trucks are near this point" from a grid of GRID_CELL_DEGREES cells over the
+  latest positions, moved along as pings come in, so a query only measures the trucks in the
+  cells its radius touches instead of the whole fleet.
+- Take raw pings from the ELD devices in batches (PingBuffer): they wait in memory and are
+  written to the append only truck_pings table with one executemany per flush, when
+  PING_FLUSH_SIZE are waiting or every PING_FLUSH_INTERVAL seconds. A full buffer refuses
+  the batch (BufferFull) so the devices back off instead of the api running out of memory.
+"""
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), 'data', 'us_zip_centroids.csv.gz')
+# normalized addresses kept in memory
+GEOCODE_CACHE_SIZE = 100000
+# new answers waiting to be written to the geocodes table, past this the oldest are not saved
+GEOCODE_PENDING_SIZE = 10000
+# seconds between writes of new answers to the geocodes table
+GEOCODE_FLUSH_INTERVAL = 5.0
+# recent pings of the whole fleet kept in the ring buffer
+LOCATION_HISTORY_SIZE = 200000
+# seconds between writes of the changed truck positions to truck_locations
+LOCATION_FLUSH_INTERVAL = 30.0
+# size of a spatial grid cell, 0.5 degrees is about 35 miles north / south
+GRID_CELL_DEGREES = 0.5
+# raw pings held in memory before they are written to truck_pings, more are refused
+PING_BUFFER_SIZE = 200000
+# waiting pings that start a flush without waiting for the interval
+PING_FLUSH_SIZE = 10000
+# seconds between flushes of whatever is waiting
+PING_FLUSH_INTERVAL = 1.0
+# seconds the ingest rate is averaged over
+PING_RATE_WINDOW = 60
+# a ping time must be after this (epoch seconds, 2000-01-01 UTC) and no more than PING_CLOCK_SKEW
+# seconds ahead of the server, so a millisecond epoch is refused instead of becoming a truck's newest ping
+PING_EARLIEST = 946684800
+PING_CLOCK_SKEW = 300
+
+STATES = {
+    'ALABAMA': 'AL', 'ALASKA': 'AK', 'ARIZONA': 'AZ', 'ARKANSAS': 'AR', 'CALIFORNIA': 'CA', 'COLORADO': 'CO',
+    'CONNECTICUT': 'CT', 'DELAWARE': 'DE', 'DISTRICT OF COLUMBIA': 'DC', 'FLORIDA': 'FL', 'GEORGIA': 'GA',
+    'HAWAII': 'HI', 'IDAHO': 'ID', 'ILLINOIS': 'IL', 'INDIANA': 'IN', 'IOWA': 'IA', 'KANSAS': 'KS',
+    'KENTUCKY': 'KY', 'LOUISIANA': 'LA', 'MAINE': 'ME', 'MARYLAND': 'MD', 'MASSACHUSETTS': 'MA',
+    'MICHIGAN': 'MI', 'MINNESOTA': 'MN', 'MISSISSIPPI': 'MS', 'MISSOURI': 'MO', 'MONTANA': 'MT',
+    'NEBRASKA': 'NE', 'NEVADA': 'NV', 'NEW HAMPSHIRE': 'NH', 'NEW JERSEY': 'NJ', 'NEW MEXICO': 'NM',
+    'NEW YORK': 'NY', 'NORTH CAROLINA': 'NC', 'NORTH DAKOTA': 'ND', 'OHIO': 'OH', 'OKLAHOMA': 'OK',
+    'OREGON': 'OR', 'PENNSYLVANIA': 'PA', 'PUERTO RICO': 'PR', 'RHODE ISLAND': 'RI', 'SOUTH CAROLINA': 'SC',
+    'SOUTH DAKOTA': 'SD', 'TENNESSEE': 'TN', 'TEXAS': 'TX', 'UTAH': 'UT', 'VERMONT': 'VT', 'VIRGINIA': 'VA',
+    'WASHINGTON': 'WA', 'WEST VIRGINIA': 'WV', 'WISCONSIN': 'WI', 'WYOMING': 'WY',
+    'AMERICAN SAMOA': 'AS', 'GUAM': 'GU', 'MARSHALL ISLANDS': 'MH', 'NORTHERN MARIANA ISLANDS': 'MP',
+    'PALAU': 'PW', 'VIRGIN ISLANDS': 'VI',
+}
+STATE_CODES = set(STATES.values())
+# how the start of a city name is often shortened
+CITY_PREFIXES = {'SAINT': 'ST', 'SAINTE': 'STE', 'FORT': 'FT', 'MOUNT': 'MT', 'PORT': 'PT'}
+
+COORDINATES = re.compile(r'^(-?\d{1,2}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)$')
+ZIP = re.compile(r'\d{5}(?:-\d{4})?$')
+PUNCTUATION = str.maketrans({character: ' ' for character in '!"#$%&\'()*+/:;<=>?@[\\]^_`{|}~'})
+# a dot that is not a decimal point
+DOT = re.compile(r'(?<!\d)\.|\.(?!\d)')
+
+
+class Precision:
+    EXACT = 'exact'     # the location was coordinates
+    ZIP = 'zip'
+    CITY = 'city'
+    STATE = 'state'
+    NONE = 'none'       # could not be placed
+
+
+class Geocode(NamedTuple):
+    lat: float | None
+    lon: float | None
+    precision: str
+
+
+NOT_FOUND = Geocode(None, None, Precision.NONE)
+
+
+def normalize(address) -> str:
+    """
+    "170 Glenwood Ave., Raleigh,NC" -> "170 GLENWOOD AVE, RALEIGH, NC"
+    """
+    if not address:
+        return ''
+    text = str(address).upper().translate(PUNCTUATION)
+    if '.' in text:
+        text = DOT.sub(' ', text)
+    parts = (' '.join(part.split()) for part in text.split(','))
+    return ', '.join(part for part in parts if part)
+
+
+def parse(address: str):
+    """
+    Split a normalized address into (zip, state, words before the state)
+    """
+    words = address.replace(',', ' ').split()
+    zip_code = None
+    if words and ZIP.match(words[-1]):
+        zip_code = words.pop()[:5]
+    state = None
+    if words and words[-1] in STATE_CODES:
+        state = words.pop()
+    else:
+        for size in (3, 2, 1):
+            if len(words) >= size:
+                state = STATES.get(' '.join(words[-size:]))
+                if state is not None:
+                    del words[-size:]
+                    break
+    return zip_code, state, words
+
+
+class Gazetteer:
+    """
+    zip -> centroid, (state, city) -> centroid, state -> centroid from the bundled csv
+    """
+
+    def __init__(self, path: str = GAZETTEER_PATH):
+        self.path = path
+        self.zips = {}
+        self.cities = {}
+        self.states = {}
+        # (state, last word of the city) -> [(words, city, centroid)] longest first
+        self._by_last_word = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self):
+        with self._lock:
+            if self.loaded:
+                return
+            cities, states = {}, {}
+            with gzip.open(self.path, 'rt', newline='') as f:
+                for row in csv.DictReader(f):
+                    point = (float(row['lat']), float(row['lon']))
+                    self.zips[row['zip']] = point
+                    # single building / po box zips would pull a city centroid towards downtown
+                    if row['kind'] == 'UNIQUE':
+                        continue
+                    for totals, key in ((cities, (row['state'], row['city'])), (states, row['state'])):
+                        total = totals.setdefault(key, [0.0, 0.0, 0])
+                        total[0] += point[0]
+                        total[1] += point[1]
+                        total[2] += 1
+            self.cities = {key: (lat / count, lon / count) for key, (lat, lon, count) in cities.items()}
+            self.states = {key: (lat / count, lon / count) for key, (lat, lon, count) in states.items()}
+            for (state, city), point in list(self.cities.items()):
+                first, _, rest = city.partition(' ')
+                if rest and first in CITY_PREFIXES:
+                    self.cities.setdefault((state, f'{CITY_PREFIXES[first]} {rest}'), point)
+            for (state, city), point in self.cities.items():
+                words = city.split()
+                self._by_last_word.setdefault((state, words[-1]), []).append((len(words), city, point))
+            for candidates in self._by_last_word.values():
+                candidates.sort(key=lambda candidate: -candidate[0])
+            self.loaded = True
+        activity_logger.info(f"Gazetteer loaded {len(self.zips)} zips, {len(self.cities)} cities")
+
+    def city(self, state: str, words: list):
+        """
+        The longest run of words at the end that names a city of state
+        """
+        if not words:
+            return None
+        for size, city, point in self._by_last_word.get((state, words[-1]), ()):
+            if size <= len(words) and (size == 1 or ' '.join(words[-size:]) == city):
+                return point
+        return None
+
+    def lookup(self, address: str) -> Geocode:
+        """
+        normalized address -> Geocode, most precise match first
+        """
+        if not self.loaded:
+            self.load()
+        match = COORDINATES.match(address)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return Geocode(lat, lon, Precision.EXACT)
+        zip_code, state, words = parse(address)
+        if zip_code in self.zips:
+            return Geocode(*self.zips[zip_code], Precision.ZIP)
+        if state is None:
+            return NOT_FOUND
+        point = self.city(state, words)
+        if point is not None:
+            return Geocode(*point, Precision.CITY)
+        if state in self.states:
+            return Geocode(*self.states[state], Precision.STATE)
+        return NOT_FOUND
+
+
+class Geocoder:
+    """
+    Gazetteer lookups memoized in an LRU and in the geocodes table.
+    New answers wait in _pending (normalized address -> Geocode) until flush() writes them.
+    """
+
+    def __init__(self, gazetteer: Gazetteer | None = None, cache_size: int = GEOCODE_CACHE_SIZE,
+                 pending_size: int = GEOCODE_PENDING_SIZE):
+        self.gazetteer = gazetteer or Gazetteer()
+        self.cache_size = cache_size
+        self.pending_size = pending_size
+        self._cache = OrderedDict()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self.hits = 0
+        self.table_hits = 0
+        self.lookups = 0
+        self.saved = 0
+        self.unsaved = 0
+
+    def _remember(self, found: dict):
+        with self._lock:
+            for address, geocode in found.items():
+                self._cache[address] = geocode
+                self._cache.move_to_end(address)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cached(self, addresses):
+        found = {}
+        with self._lock:
+            for address in addresses:
+                geocode = self._cache.get(address)
+                if geocode is not None:
+                    self._cache.move_to_end(address)
+                    found[address] = geocode
+            self.hits += len(found)
+        return found
+
+    def _stored(self, conn, addresses: list):
+        found = {}
+        for start in range(0, len(addresses), 500):
+            chunk = addresses[start:start + 500]
+            rows = conn.execute(f"SELECT address, lat, lon, precision FROM geocodes "
+                                f"WHERE address IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            for address, lat, lon, precision in rows:
+                found[address] = Geocode(lat, lon, precision)
+        self.table_hits += len(found)
+        return found
+
+    def geocode_many(self, addresses, conn=None):
+        """
+        {location text: Geocode} for every distinct location
+        With a connection, answers are also read from the geocodes table.
+        """
+        keys = {location: normalize(location) for location in set(addresses)}
+        wanted = set(keys.values())
+        found = self._cached(wanted)
+        missing = [address for address in wanted if address not in found]
+        if missing and conn is not None:
+            stored = self._stored(conn, missing)
+            found.update(stored)
+            missing = [address for address in missing if address not in stored]
+        looked_up = {address: self.gazetteer.lookup(address) for address in missing}
+        self.lookups += len(looked_up)
+        found.update(looked_up)
+        self._remember({address: found[address] for address in wanted if address in found})
+        self._queue(looked_up)
+        return {location: found[key] for location, key in keys.items()}
+
+    def _queue(self, looked_up: dict):
+        with self._lock:
+            for address, geocode in looked_up.items():
+                if address:
+                    self._pending[address] = geocode
+            while len(self._pending) > self.pending_size:
+                self._pending.popitem(last=False)
+                self.unsaved += 1
+
+    def geocode(self, address, conn=None) -> Geocode:
+        return self.geocode_many([address], conn)[address]
+
+    def save(self, conn, geocodes: dict):
+        """
+        Write {location text: Geocode} to the geocodes table, needs the write connection
+        existing rows are kept
+        """
+        rows = {normalize(location): geocode for location, geocode in geocodes.items()}
+        self._write(conn, rows)
+        with self._lock:
+            for address in rows:
+                self._pending.pop(address, None)
+
+    def _write(self, conn, rows: dict):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn.executemany('INSERT INTO geocodes (address, lat, lon, precision, updated_at) VALUES (?, ?, ?, ?, ?) '
+                         'ON CONFLICT(address) DO NOTHING',
+                         [(address, *geocode, now) for address, geocode in rows.items() if address])
+
+    def flush(self, conn):
+        """
+        Write the answers waiting in memory to the geocodes table, needs the writer
+        returns the number written
+        """
+        with self._lock:
+            rows, self._pending = self._pending, OrderedDict()
+        if not rows:
+            return 0
+        try:
+            self._write(conn, rows)
+            conn.commit()
+        except Exception:
+            # back in front of anything queued meanwhile, the next flush retries them
+            with self._lock:
+                rows.update(self._pending)
+                self._pending = rows
+            raise
+        self.saved += len(rows)
+        return len(rows)
+
+    def start(self, pool, interval: float = GEOCODE_FLUSH_INTERVAL):
+        """
+        Flush every interval seconds on a background thread through pool (the writer pool)
+        """
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    with pool.connection() as conn:
+                        self.flush(conn)
+                except Exception as e:
+                    error_logger.error(f"Geocode flush failed: {e}")
+        self._stop.clear()
+        self._flusher = threading.Thread(target=loop, name='geocodes-flush', daemon=True)
+        self._flusher.start()
+
+    def stop(self, pool=None):
+        """
+        Stop the flush thread, with a pool also write what is still pending
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if pool is not None:
+            with pool.connection() as conn:
+                self.flush(conn)
+
+    def resolve(self, conn, locations: pd.Series):
+        """
+        Resolver for services/analytics.py: DataFrame of lat / lon indexed like locations
+        """
+        found = self.geocode_many(locations.tolist(), conn)
+        return pd.DataFrame({'lat': [found[location].lat for location in locations],
+                             'lon': [found[location].lon for location in locations]},
+                            index=locations.index, dtype=float)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache), 'max_size': self.cache_size, 'hits': self.hits,
+                    'table_hits': self.table_hits, 'gazetteer_lookups': self.lookups,
+                    'pending': len(self._pending), 'saved': self.saved, 'unsaved': self.unsaved}
+
+
+def geocode_trips(conn, geocoder=None, batch_size: int = 50000):
+    """
+    Geocode every distinct pickup / dropoff location of trips and store the new ones
+    returns {precision: count}
+    """
+    geocoder = geocoder or globals()['geocoder']
+    rows = conn.execute('SELECT pickup_location FROM trips WHERE pickup_location IS NOT NULL UNION '
+                        'SELECT dropoff_location FROM trips WHERE dropoff_location IS NOT NULL').fetchall()
+    locations = [row[0] for row in rows]
+    counts = {}
+    for start in range(0, len(locations), batch_size):
+        found = geocoder.geocode_many(locations[start:start + batch_size], conn)
+        geocoder.save(conn, found)
+        conn.commit()
+        for geocode in found.values():
+            counts[geocode.precision] = counts.get(geocode.precision, 0) + 1
+    activity_logger.info(f"Geocoded {len(locations)} trip locations: {counts}")
+    return counts
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """
+    Great circle miles between arrays of points (degrees), NaN where a point is unknown
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=float)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+
+def to_epoch(value, now: float | None = None) -> int:
+    """
+    epoch seconds or an iso datetime (local time like the rest of the app) -> int epoch seconds
+    between PING_EARLIEST and now (time.time() by default) + PING_CLOCK_SKEW
+    raises ValueError for anything else
+    """
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        try:
+            seconds = float(value)
+        except OverflowError:
+            raise ValueError(f"ts {value} is not epoch seconds")
+    else:
+        seconds = datetime.fromisoformat(str(value)).timestamp()
+    latest = (time.time() if now is None else now) + PING_CLOCK_SKEW
+    # NaN fails both comparisons
+    if not PING_EARLIEST <= seconds <= latest:
+        raise ValueError(f"ts {value} is not between {to_iso(PING_EARLIEST)} and now, pass epoch seconds not milliseconds")
+    return int(seconds)
+
+
+def to_iso(epoch: int) -> str:
+    return datetime.fromtimestamp(int(epoch)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class LocationPing(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    ts: str | float | None = None   # epoch seconds or iso datetime, default when it arrives
+
+
+class TruckPing(LocationPing):
+    truck_id: int
+
+
+class TruckLocationStore:
+    """
+    Latest position of every truck plus a ring buffer of recent pings, all in numpy arrays.
+
+    The latest arrays are indexed by truck id, so reading or writing one truck is O(1).
+    The ring keeps the last history_size pings of the whole fleet, the oldest is overwritten.
+    Trucks whose latest position changed are flagged and written to truck_locations by flush().
+    Every truck with a position is also in one cell of a lat / lon grid (cell -> set of truck ids),
+    a truck only changes sets when a ping takes it into another cell.
+    """
+
+    def __init__(self, history_size: int = LOCATION_HISTORY_SIZE, capacity: int = 1024, clock=time.time,
+                 cell_degrees: float = GRID_CELL_DEGREES):
+        self.history_size = history_size
+        self.clock = clock
+        self.cell_degrees = cell_degrees
+        self._columns = int(np.ceil(360 / cell_degrees))
+        self._lock = threading.Lock()
+        self._lat = np.full(capacity, np.nan)
+        self._lon = np.full(capacity, np.nan)
+        self._ts = np.zeros(capacity, dtype=np.int64)       # 0 = no position yet
+        self._dirty = np.zeros(capacity, dtype=bool)
+        self._cell = np.full(capacity, -1, dtype=np.int64)  # -1 = in no cell
+        self._grid = {}
+        self._ring_truck = np.zeros(history_size, dtype=np.int64)
+        self._ring_lat = np.zeros(history_size)
+        self._ring_lon = np.zeros(history_size)
+        self._ring_ts = np.zeros(history_size, dtype=np.int64)
+        self._head = 0          # next ring slot to write
+        self._count = 0         # pings in the ring
+        self._flusher = None
+        self._stop = threading.Event()
+        self.pings = 0
+        self.stale = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _grow(self, truck_id: int):
+        size = max(truck_id + 1, len(self._ts) * 2)
+        extra = size - len(self._ts)
+        self._lat = np.concatenate([self._lat, np.full(extra, np.nan)])
+        self._lon = np.concatenate([self._lon, np.full(extra, np.nan)])
+        self._ts = np.concatenate([self._ts, np.zeros(extra, dtype=np.int64)])
+        self._dirty = np.concatenate([self._dirty, np.zeros(extra, dtype=bool)])
+        self._cell = np.concatenate([self._cell, np.full(extra, -1, dtype=np.int64)])
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_degrees).astype(np.int64)
+        columns = np.floor((np.asarray(lons) + 180) / self.cell_degrees).astype(np.int64) % self._columns
+        return rows * self._columns + columns
+
+    def _move(self, trucks, cells):
+        """
+        Put trucks in their new cells, only the ones that changed cell touch the sets
+        """
+        changed = self._cell[trucks] != cells
+        for truck_id, old, new in zip(trucks[changed].tolist(), self._cell[trucks][changed].tolist(),
+                                      cells[changed].tolist()):
+            if old >= 0:
+                members = self._grid[old]
+                members.discard(truck_id)
+                if not members:
+                    del self._grid[old]
+            self._grid.setdefault(new, set()).add(truck_id)
+        self._cell[trucks] = cells
+
+    def update_many(self, truck_ids, lats, lons, timestamps=None):
+        """
+        Record pings (arrays of the same length, timestamps in epoch seconds, default now).
+        A ping older than the truck's latest position only goes to the history.
+        returns the number of trucks whose latest position moved
+        """
+        trucks = np.asarray(truck_ids, dtype=np.int64)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if timestamps is None:
+            stamps = np.full(len(trucks), int(self.clock()), dtype=np.int64)
+        else:
+            stamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(trucks):
+            return 0
+        with self._lock:
+            if trucks.max() >= len(self._ts):
+                self._grow(int(trucks.max()))
+            self._append(trucks, lats, lons, stamps)
+            # newest ping of each truck in the batch, then only where it beats what we have
+            order = np.lexsort((stamps, trucks))
+            last = np.ones(len(order), dtype=bool)
+            last[:-1] = trucks[order][1:] != trucks[order][:-1]
+            newest = order[last]
+            newer = newest[stamps[newest] >= self._ts[trucks[newest]]]
+            moved = trucks[newer]
+            self._lat[moved], self._lon[moved], self._ts[moved] = lats[newer], lons[newer], stamps[newer]
+            self._dirty[moved] = True
+            self._move(moved, self._cells(lats[newer], lons[newer]))
+            self.pings += len(trucks)
+            self.stale += len(newest) - len(newer)
+        return len(moved)
+
+    def update(self, truck_id: int, lat: float, lon: float, ts=None):
+        return self.update_many([truck_id], [lat], [lon], None if ts is None else [ts]) == 1
+
+    def _append(self, trucks, lats, lons, stamps):
+        if len(trucks) > self.history_size:
+            trucks, lats, lons, stamps = (values[-self.history_size:] for values in (trucks, lats, lons, stamps))
+        slots = (self._head + np.arange(len(trucks))) % self.history_size
+        self._ring_truck[slots], self._ring_lat[slots] = trucks, lats
+        self._ring_lon[slots], self._ring_ts[slots] = lons, stamps
+        self._head = int((self._head + len(trucks)) % self.history_size)
+        self._count = min(self._count + len(trucks), self.history_size)
+
+    def _row(self, truck_id: int, now: float):
+        return {'truck_id': truck_id, 'lat': float(self._lat[truck_id]), 'lon': float(self._lon[truck_id]),
+                'ts': to_iso(self._ts[truck_id]), 'age_seconds': int(now - self._ts[truck_id])}
+
+    def position(self, truck_id: int):
+        """
+        Latest position of one truck or None
+        """
+        with self._lock:
+            if truck_id < 0 or truck_id >= len(self._ts) or not self._ts[truck_id]:
+                return None
+            return self._row(truck_id, self.clock())
+
+    def positions(self, truck_ids=None):
+        """
+        Latest positions of the given trucks (default every truck with one), by truck id
+        """
+        with self._lock:
+            if truck_ids is None:
+                ids = np.flatnonzero(self._ts)
+            else:
+                ids = np.asarray(sorted(set(truck_ids)), dtype=np.int64)
+                ids = ids[(ids >= 0) & (ids < len(self._ts))]
+                ids = ids[self._ts[ids] > 0]
+            now = self.clock()
+            return [self._row(int(truck_id), now) for truck_id in ids]
+
+    def history(self, truck_id: int, limit: int = 100):
+        """
+        Pings of one truck still in the ring, newest first
+        """
+        with self._lock:
+            # ring slots from newest to oldest
+            slots = (self._head - 1 - np.arange(self._count)) % self.history_size
+            slots = slots[self._ring_truck[slots] == truck_id][:limit]
+            return [{'lat': float(self._ring_lat[slot]), 'lon': float(self._ring_lon[slot]),
+                     'ts': to_iso(self._ring_ts[slot])} for slot in slots]
+
+    def _candidates(self, lat: float, lon: float, radius: float):
+        """
+        ids of the trucks in the grid cells a circle of radius miles around (lat, lon) touches,
+        caller holds the lock
+        """
+        span = np.degrees(radius / EARTH_RADIUS_MILES)
+        top, bottom = min(lat + span, 90.0), max(lat - span, -90.0)
+        first_row, last_row = (int((edge + 90) // self.cell_degrees) for edge in (bottom, top))
+        # at the box edge nearest a pole a degree of longitude is shortest, so the widest span
+        widest = np.cos(np.radians(max(abs(top), abs(bottom))))
+        if np.sin(np.radians(span)) >= widest:
+            # reaches over a pole, every column
+            columns = range(self._columns)
+        else:
+            lon_span = np.degrees(np.arcsin(np.sin(np.radians(span)) / widest))
+            first_column = int((lon - lon_span + 180) // self.cell_degrees)
+            last_column = int((lon + lon_span + 180) // self.cell_degrees)
+            columns = range(first_column, min(last_column, first_column + self._columns - 1) + 1)
+        if (last_row - first_row + 1) * len(columns) > len(self._grid):
+            # the circle covers more cells than there are trucks in, reading them all is cheaper
+            return np.flatnonzero(self._ts)
+        grid = self._grid
+        found = []
+        for row in range(first_row, last_row + 1):
+            base = row * self._columns
+            for column in columns:
+                members = grid.get(base + column % self._columns)
+                if members:
+                    found.extend(members)
+        return np.array(found, dtype=np.int64)
+
+    def nearest(self, lat: float, lon: float, radius: float, limit: int = None):
+        """
+        (truck ids, miles) of the trucks whose latest position is within radius miles of
+        (lat, lon), nearest first, at most limit of them
+        """
+        with self._lock:
+            ids = self._candidates(lat, lon, radius)
+            miles = haversine_miles(lat, lon, self._lat[ids], self._lon[ids])
+        inside = miles <= radius
+        ids, miles = ids[inside], miles[inside]
+        if limit is not None and limit < len(ids):
+            keep = np.argpartition(miles, limit)[:limit]
+            ids, miles = ids[keep], miles[keep]
+        order = np.lexsort((ids, miles))
+        return ids[order], miles[order]
+
+    def within(self, lat: float, lon: float, radius: float):
+        """
+        ids of the trucks whose latest position is within radius miles of (lat, lon)
+        """
+        return sorted(self.nearest(lat, lon, radius)[0].tolist())
+
+    def load(self, conn):
+        """
+        Start from the positions last written to truck_locations
+        """
+        rows = conn.execute('SELECT truck_id, lat, lon, ts FROM truck_locations').fetchall()
+        if rows:
+            trucks, lats, lons, stamps = (np.array(values) for values in zip(*rows))
+            self.update_many(trucks, lats, lons, stamps)
+            with self._lock:
+                self._dirty[:] = False
+        activity_logger.info(f"Truck locations loaded {len(rows)} positions")
+
+    def flush(self, conn):
+        """
+        Write the positions that changed since the last flush to truck_locations, needs the writer
+        returns the number of rows written
+        """
+        with self._lock:
+            ids = np.flatnonzero(self._dirty)
+            rows = list(zip(ids.tolist(), self._lat[ids].tolist(), self._lon[ids].tolist(), self._ts[ids].tolist()))
+            self._dirty[ids] = False
+        if not rows:
+            return 0
+        try:
+            conn.executemany('INSERT INTO truck_locations (truck_id, lat, lon, ts) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT(truck_id) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, '
+                             'ts = excluded.ts WHERE excluded.ts >= truck_locations.ts', rows)
+            conn.commit()
+        except Exception:
+            # put the flags back so the next flush retries them
+            with self._lock:
+                self._dirty[ids] = True
+            raise
+        self.flushes += 1
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    def start(self, pool, interval: float = LOCATION_FLUSH_INTERVAL):
+        """
+        Flush every interval seconds on a background thread through pool (the writer pool)
+        """
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    with pool.connection() as conn:
+                        self.flush(conn)
+                except Exception as e:
+                    error_logger.error(f"Truck location flush failed: {e}")
+        self._stop.clear()
+        self._flusher = threading.Thread(target=loop, name='truck-locations-flush', daemon=True)
+        self._flusher.start()
+
+    def stop(self, pool=None):
+        """
+        Stop the flush thread, with a pool also write what is still pending
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if pool is not None:
+            with pool.connection() as conn:
+                self.flush(conn)
+
+    def stats(self):
+        with self._lock:
+            return {'trucks': int(np.count_nonzero(self._ts)), 'grid_cells': len(self._grid), 'pings': self.pings, 'stale_pings': self.stale,
+                    'history': self._count, 'history_size': self.history_size,
+                    'pending': int(np.count_nonzero(self._dirty)), 'flushes': self.flushes,
+                    'flushed_rows': self.flushed_rows}
+
+
+class BufferFull(Exception):
+    """
+    The ping buffer has no room for a batch, the caller should send it again later
+    """
+
+
+class PingBuffer:
+    """
+    Write behind buffer of raw pings for truck_pings, in preallocated numpy arrays.
+
+    add() copies a batch in (or refuses all of it when it does not fit), flush() takes
+    everything waiting and writes it with one executemany and one commit. The flush thread
+    started by start() runs every interval seconds, or as soon as flush_size are waiting.
+    """
+
+    def __init__(self, capacity: int = PING_BUFFER_SIZE, flush_size: int = PING_FLUSH_SIZE, clock=time.time,
+                 rate_window: int = PING_RATE_WINDOW):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.clock = clock
+        self.rate_window = rate_window
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()     # one flush at a time, add() does not wait on it
+        self._truck = np.zeros(capacity, dtype=np.int64)
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._ts = np.zeros(capacity, dtype=np.int64)
+        self._received = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+        self._seconds = deque()                 # [epoch second, pings accepted in it]
+        self._latencies = deque(maxlen=1000)    # seconds of the last flushes
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+        self.accepted = 0
+        self.refused = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def add(self, truck_ids, lats, lons, timestamps):
+        """
+        Buffer a batch of pings (timestamps in epoch seconds)
+        raises BufferFull, nothing of the batch is kept then
+        """
+        count = len(truck_ids)
+        now = int(self.clock())
+        with self._lock:
+            if self._size + count > self.capacity:
+                self.refused += count
+                raise BufferFull(f'{self._size} of {self.capacity} pings are waiting to be written')
+            rows = slice(self._size, self._size + count)
+            self._truck[rows], self._lat[rows], self._lon[rows] = truck_ids, lats, lons
+            self._ts[rows], self._received[rows] = timestamps, now
+            self._size += count
+            self.accepted += count
+            if self._seconds and self._seconds[-1][0] == now:
+                self._seconds[-1][1] += count
+            else:
+                self._seconds.append([now, count])
+            waiting = self._size
+        if waiting >= self.flush_size:
+            self._ready.set()
+        return count
+
+    def _take(self):
+        with self._lock:
+            size = self._size
+            taken = (self._truck[:size].copy(), self._lat[:size].copy(), self._lon[:size].copy(),
+                     self._ts[:size].copy(), self._received[:size].copy())
+            self._size = 0
+        return taken
+
+    def _put_back(self, taken):
+        """
+        A failed flush puts its pings back for the next one, as many as still fit
+        """
+        with self._lock:
+            keep = min(len(taken[0]), self.capacity - self._size)
+            rows = slice(self._size, self._size + keep)
+            for array, values in zip((self._truck, self._lat, self._lon, self._ts, self._received), taken):
+                array[rows] = values[:keep]
+            self._size += keep
+            self.dropped += len(taken[0]) - keep
+
+    def flush(self, conn):
+        """
+        Write every waiting ping to truck_pings, needs the writer
+        returns the number of pings written
+        """
+        with self._flush_lock:
+            taken = self._take()
+            if not len(taken[0]):
+                return 0
+            start = time.perf_counter()
+            try:
+                conn.executemany('INSERT INTO truck_pings (truck_id, lat, lon, ts, received_at) VALUES (?, ?, ?, ?, ?)',
+                                 zip(*(values.tolist() for values in taken)))
+                conn.commit()
+            except Exception:
+                self.failed_flushes += 1
+                self._put_back(taken)
+                raise
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+                self.flushes += 1
+                self.written += len(taken[0])
+            return len(taken[0])
+
+    def start(self, pool, interval: float = PING_FLUSH_INTERVAL):
+        """
+        Flush on a background thread through pool (the writer pool)
+        """
+        def loop():
+            while not self._stop.is_set():
+                self._ready.wait(interval)
+                self._ready.clear()
+                try:
+                    with pool.connection() as conn:
+                        self.flush(conn)
+                except Exception as e:
+                    error_logger.error(f"Truck ping flush failed: {e}")
+        self._stop.clear()
+        self._flusher = threading.Thread(target=loop, name='truck-pings-flush', daemon=True)
+        self._flusher.start()
+
+    def stop(self, pool=None):
+        """
+        Stop the flush thread, with a pool also write what is still waiting
+        """
+        self._stop.set()
+        self._ready.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        if pool is not None:
+            with pool.connection() as conn:
+                self.flush(conn)
+
+    def stats(self):
+        """
+        ingest_rate is pings / second accepted over the last rate_window seconds,
+        flush latency is over the last 1000 flushes
+        """
+        with self._lock:
+            now = int(self.clock())
+            while self._seconds and self._seconds[0][0] <= now - self.rate_window:
+                self._seconds.popleft()
+            recent = sum(count for _, count in self._seconds)
+            latencies = np.array(self._latencies) * 1000
+            return {'waiting': self._size, 'capacity': self.capacity, 'accepted': self.accepted,
+                    'refused': self.refused, 'written': self.written, 'dropped': self.dropped,
+                    'flushes': self.flushes, 'failed_flushes': self.failed_flushes,
+                    'ingest_rate': round(recent / self.rate_window, 1),
+                    'flush_ms': {'last': round(float(latencies[-1]), 2), 'avg': round(float(latencies.mean()), 2),
+                                 'p99': round(float(np.percentile(latencies, 99)), 2),
+                                 'max': round(float(latencies.max()), 2)} if len(latencies) else None}
+
+
+geocoder = Geocoder()
+truck_locations = TruckLocationStore()
+ping_buffer = PingBuffer()
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+    command = sys.argv[1] if len(sys.argv) > 1 else 'geocode-trips'
+    if command == 'lookup':
+        for address in sys.argv[2:]:
+            print(f'{normalize(address)!r}: {geocoder.geocode(address)}')
+    else:
+        conn = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else 'mtl.db')
+        start = time.perf_counter()
+        counts = geocode_trips(conn)
+        print(f'{sum(counts.values())} locations in {time.perf_counter() - start:.1f}s: {counts}')
+        conn.close()
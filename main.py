@@ -2,24 +2,57 @@ import sys
 import os
 
 
-from services.trip import Trip, TripItem
-from services.truck import Truck, TruckItem
+from services.trip import Trip, TripItem, TripStatusBatch, TripHistory
+from services.truck import Truck, TruckItem, check_truck_availability, nearby_trucks, ingest_pings
+from services.availability import availability
 from logger import activity_logger, error_logger, stdout_logger
 from services.extract_trip_details import extract_from_pdf, process_pdf_text
 import messages as msg
-from config.db import get_db_connection
+from config.db import get_read_db, get_write_db, storage, async_db, entity_cache
+from config.pool import PoolTimeout
+from config.query import statement_cache, InvalidColumn
+from services import dashboard, analytics, payroll, revenue
+from services.dashboard import dashboard_cache
+from location.location import geocoder, truck_locations, ping_buffer, LocationPing, Precision, to_epoch
+from location.geofence import geofences
 from client import Client
 
 
 
 from typing import Union
-from fastapi import FastAPI, File, UploadFile, Form
+from pydantic import ValidationError
+from fastapi import FastAPI, File, UploadFile, Form, Depends, Request, Query
 from fastapi import Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+import json
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 
 
-app = FastAPI(title="MTL API", description="API for Managing Truck Loads", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the write behind buffers with the app and write out what they hold when it stops
+    - truck positions live in memory and are written to truck_locations in the background
+    - raw pings from the devices wait in memory and are written to truck_pings in batches
+    - places geocoded by requests are written to the geocodes table in batches
+    """
+    with storage.reader.connection() as conn:
+        truck_locations.load(conn)
+    truck_locations.start(storage.writer)
+    ping_buffer.start(storage.writer)
+    geocoder.start(storage.writer)
+    yield
+    for buffer in (ping_buffer, truck_locations, geocoder):
+        try:
+            buffer.stop(storage.writer)
+        except Exception as e:
+            error_logger.error(f"Final flush of {type(buffer).__name__} failed: {e}")
+    activity_logger.info("Write behind buffers flushed")
+
+
+app = FastAPI(title="MTL API", description="API for Managing Truck Loads", version="1.0.0", lifespan=lifespan)
 
 
 # see if we can filter
@@ -28,6 +61,100 @@ app = FastAPI(title="MTL API", description="API for Managing Truck Loads", versi
 session = None
 session = Client()
 
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    """
+    All pooled connections stayed busy for the whole pool timeout
+    """
+    res = msg.ServiceUnavailable({'database': str(exc)})
+    return JSONResponse(status_code=res.apicode, content=res.raw())
+
+
+# miles around a place that count as being at it for /api/trucks/?location=
+LOCATION_RADIUS_MILES = 25.0
+# default and largest radius of /api/trucks/nearby
+NEARBY_RADIUS_MILES = 150.0
+MAX_NEARBY_RADIUS_MILES = 3000.0
+# most pings in one POST /api/trucks/locations/batch
+MAX_PING_BATCH = 10000
+# seconds a device is told to wait before sending a refused batch again
+PING_RETRY_AFTER = 2
+
+
+# largest page a client can ask for with ?limit=
+MAX_PAGE_SIZE = 1000
+
+
+def ndjson_stream(model, batch_size: int = 500, **kwargs):
+    """
+    Stream rows of model as newline delimited json.
+    The generator takes its own read connection for as long as the client
+    is reading, memory stays at one batch of rows.
+    """
+    def rows():
+        conn = storage.reader.acquire()
+        try:
+            batch = []
+            for row in model.iter_filter(conn, batch_size=batch_size, **kwargs):
+                batch.append(json.dumps(row))
+                if len(batch) == batch_size:
+                    yield '\n'.join(batch) + '\n'
+                    batch = []
+            if batch:
+                yield '\n'.join(batch) + '\n'
+        finally:
+            storage.reader.release(conn)
+    return StreamingResponse(rows(), media_type='application/x-ndjson')
+
+
+async def list_rows(model, response, filters: dict, limit=None, after=None, order_by=None, stream=False, fields=None):
+    """
+    Shared body of the list endpoints: return a page / the full list,
+    or check the query and stream it as ndjson
+    """
+    if stream:
+        try:
+            await async_db.read(model._select, after=after, order_by=order_by, fields=fields, **filters)
+        except InvalidColumn as e:
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return msg.InvalidQuery({'error': str(e), 'columns': e.columns}).raw()
+        return ndjson_stream(model, after=after, order_by=order_by, fields=fields, **filters)
+    res = await async_db.filter(model, limit=limit, after=after, order_by=order_by, fields=fields, **filters)
+    if res.apicode == 400:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
+
+
+# rows per executemany call for the bulk endpoints
+BULK_CHUNK_SIZE = 500
+MAX_BULK_CHUNK_SIZE = 5000
+
+
+def bulk_create(conn, model, item_class, items: list, chunk_size: int):
+    """
+    Validate every row of a bulk request and insert the valid ones with model.bulk_create
+    returns rows [{'index', 'id'}] and errors [{'index', 'error'}]
+    """
+    valid = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            obj = model.from_item(item_class(**item))
+        except (ValidationError, ValueError, TypeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        valid.append((index, obj.__dict__))
+    if not valid:
+        return msg.ResourceCreateError({'error': 'No valid rows', 'errors': errors})
+
+    res = model.bulk_create(conn, [props for _, props in valid], chunk_size=chunk_size)
+    if res.apicode != 201:
+        return res
+    ids = res.raw()['created']['ids']
+    created = [{'index': index, 'id': id} for (index, _), id in zip(valid, ids)]
+    return msg.ResourceCreated({'rows': created, 'errors': errors})
+
 @app.get("/")
 def read_root():
     """
@@ -43,58 +170,125 @@ def read_root():
 Work on Trip endpoints
 """
 @app.get('/api/trips/')
-def get_trips(
+async def get_trips(
         broker: Union[str, None] = None,
         rate: Union[float, None] = None,
         rate_con_number: Union[str, None] = None, 
-        status: Union[str, None] = None,
+        status: Union[list[str], None] = Query(None),
         driver_id: Union[int, None] = None,
         truck_id: Union[int, None] = None,
         pick_up_location: Union[str, None] = None,
         drop_off_location: Union[str, None] = None,
-        end_date: Union[str, None] = None):
+        end_date: Union[str, None] = None,
+        pickup_date__gte: Union[str, None] = None,
+        pickup_date__lte: Union[str, None] = None,
+        delivery_date__gte: Union[str, None] = None,
+        delivery_date__lte: Union[str, None] = None,
+        rate__gte: Union[float, None] = None,
+        rate__lte: Union[float, None] = None,
+        order_by: Union[str, None] = None,
+        limit: Union[int, None] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: Union[int, None] = None,
+        stream: bool = False,
+        fields: Union[str, None] = None,
+        response: Response = None):
     """
     Get all trips or filter by passing optional query params
+    - status can be repeated to match any of them (?status=Loaded&status=In%20Transit)
+    - pick_up_location / drop_off_location match the start of the location
+    - end_date is the latest delivery_date
+    - pickup_date / delivery_date / rate ranges with __gte and __lte
+    - order_by=pickup_date or -pickup_date (descending), comma separate for more columns
+    - limit/after page through the results by id, pass back `next` as after
+    - stream=true returns every matching row as ndjson
+    - fields=id,status,pickup_date returns only those columns (id is always included)
     """
-    conn = get_db_connection()
-    trips = Trip.filter(conn, broker=broker, rate=rate, rate_con_number=rate_con_number, status=status, driver_id=driver_id, truck_id=truck_id)
-
-    return trips.raw()
+    filters = dict(broker=broker, rate=rate, rate_con_number=rate_con_number, status__in=status,
+                   driver_id=driver_id, truck_id=truck_id,
+                   pickup_location__startswith=pick_up_location, dropoff_location__startswith=drop_off_location,
+                   pickup_date__gte=pickup_date__gte, pickup_date__lte=pickup_date__lte,
+                   delivery_date__gte=delivery_date__gte, delivery_date__lte=end_date or delivery_date__lte,
+                   rate__gte=rate__gte, rate__lte=rate__lte)
+    return await list_rows(Trip, response, filters, limit=limit, after=after, order_by=order_by, stream=stream, fields=fields)
+
+@app.get('/api/trips/search')
+async def search_trips(q: str, response: Response,
+        limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+        offset: int = Query(0, ge=0)):
+    """
+    Search trips by broker, rate con number or pickup / dropoff location
+    e.g. ?q=greensboro or ?q=tinashe rc12 (every word has to match the start of a word)
+    Best matches first, pass back `next` as offset for the next page.
+    """
+    res = await async_db.read(Trip.search, q, limit=limit, offset=offset)
+    if res.apicode == 400:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
 
 @app.get("/api/trips/{trip_id}", status_code=200)
-def get_trip(trip_id: int, response: Response):
+async def get_trip(trip_id: int, response: Response, fields: Union[str, None] = None):
     """
     Get trip details by trip ID.
+    fields=status,pickup_date returns only those columns
     """
-    conn = get_db_connection()
-    trip = Trip.get(conn, trip_id)
-    if trip.apicode == 404:
-        response.status_code = status.HTTP_404_NOT_FOUND
+    trip = await async_db.get(Trip, trip_id, fields=fields)
+    if trip.apicode in (400, 404):
+        response.status_code = trip.apicode
     return trip.raw()
 
+@app.get("/api/trips/{trip_id}/history")
+async def get_trip_history(trip_id: int, response: Response,
+        after: Union[int, None] = None,
+        limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Every change to a trip oldest first: created, status, truck, driver and detail changes.
+    Pass back `next` as after for the next page.
+    """
+    res = await async_db.read(TripHistory(trip_id).get_history, after=after, limit=limit)
+    if not res.raw()['found'] and after is None:
+        res = msg.ResourceNotFound({'id': trip_id})
+        response.status_code = status.HTTP_404_NOT_FOUND
+    return res.raw()
+
+@app.get("/api/trips/{trip_id}/geofence")
+async def get_trip_geofence(trip_id: int, response: Response):
+    """
+    The pickup / dropoff fences of an active trip and since when its truck is inside them
+    """
+    await async_db.read(geofences.refresh)
+    fences = geofences.trip(trip_id)
+    if fences is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return msg.ResourceNotFound({'id': trip_id, 'error': 'No geofence, the trip is not active or has no truck'}).raw()
+    return msg.ResourceFound(fences).raw()
+
 @app.post("/api/trips/", status_code=201)       
-def create_trip(trip: TripItem, response: Response): 
+async def create_trip(trip: TripItem, response: Response):
     """
     Create a new trip.
     TODO Support forms as well
     """
-    conn = get_db_connection()
-    new_trip = Trip(trip.broker, 
-                    trip.rate_con_number, 
-                    trip.rate, 
-                    trip.pickup_location, 
-                    trip.dropoff_location, 
-                    trip.pickup_date,
-                    trip.delivery_date, 
-                    trip.truck_id, 
-                    trip.status)
-    res = new_trip.create(conn, new_trip.__dict__)
+    new_trip = Trip.from_item(trip)
+    res = await async_db.create(new_trip)
+    if res.apicode == 400:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
+
+@app.post("/api/trips/bulk", status_code=201)
+async def create_trips_bulk(trips: list[dict], response: Response,
+        chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE)):
+    """
+    Create many trips in one transaction, e.g. a broker's weekly batch.
+    Each row is validated on its own, bad rows are reported by index
+    and the rest are inserted.
+    """
+    res = await async_db.write(bulk_create, Trip, TripItem, trips, chunk_size)
     if res.apicode == 400:
         response.status_code = status.HTTP_400_BAD_REQUEST
     return res.raw()
 
 @app.put("/api/trips/{trip_id}/")
-def update_trip_status(trip_id: int, 
+async def update_trip_status(trip_id: int,
         broker: Union[str, None] = None,
         rate: Union[float, None] = None,
         rate_con_number: Union[str, None] = None, 
@@ -107,13 +301,26 @@ def update_trip_status(trip_id: int,
     """
     Update the values of a trip.
     """
-    conn = get_db_connection()
-    res = Trip.update(conn, trip_id, broker=broker, rate=rate, rate_con_number=rate_con_number, status=status, driver_id=driver_id, truck_id=truck_id)
-    conn.close()
+    res = await async_db.update(Trip, trip_id, broker=broker, rate=rate, rate_con_number=rate_con_number, status=status, driver_id=driver_id, truck_id=truck_id)
     return res.raw()
 
 
 
+@app.post("/api/trips/status")
+async def update_trips_status(batch: TripStatusBatch, response: Response):
+    """
+    Move many trips to one status in a single transaction
+    e.g. every load on a truck from Loaded to In Transit.
+    Returns the trips that moved and the ones rejected with the reason.
+    """
+    try:
+        res = await async_db.write(Trip.bulk_update_status, batch.trip_ids, batch.status)
+    except ValueError as e:
+        res = msg.ResourceUpdateError({'error': str(e), 'status': batch.status})
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
+
+
 @app.post("/api/trips/upload")
 def upload_trip_pdf(file: UploadFile = File(...)):
     """
@@ -144,73 +351,206 @@ def upload_trip_pdf(file: UploadFile = File(...)):
 Endpoints for trucks 
 """
 @app.get('/api/trucks/')
-def get_trucks(
+async def get_trucks(
         license_plate: Union[str, None] = None,
         model: Union[str, None] = None,
         year: Union[str, None] = None,
         towing_capacity: Union[str, None] = None,
-        status: Union[str, None] = None, 
-        location: Union[str, None] = None
-
-
+        status: Union[list[str], None] = Query(None), 
+        location: Union[str, None] = None,
+        year__gte: Union[int, None] = None,
+        towing_capacity__gte: Union[int, None] = None,
+        order_by: Union[str, None] = None,
+        limit: Union[int, None] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: Union[int, None] = None,
+        stream: bool = False,
+        fields: Union[str, None] = None,
+        response: Response = None
         ):
     """
     Get all trucks or filter by passing optional query params
+    - status can be repeated to match any of them
+    - year__gte / towing_capacity__gte for minimums
+    - order_by=year or -year (descending)
+    - limit/after page through the results by id, pass back `next` as after
+    - stream=true returns every matching row as ndjson
+    - fields=id,status,location returns only those columns (id is always included)
+    - location=Greensboro, NC returns the trucks whose last reported position is within
+      LOCATION_RADIUS_MILES of it, read from the in memory truck positions
     """
-    conn = get_db_connection()
-    trucks = Truck.filter(conn,  license_plate=license_plate, model=model, year=year, towing_capacity=towing_capacity, status=status, location=location)
+    filters = dict(license_plate=license_plate, model=model, year=year, towing_capacity=towing_capacity,
+                   status__in=status, year__gte=year__gte, towing_capacity__gte=towing_capacity__gte)
+    if location:
+        place = await async_db.read(lambda conn: geocoder.geocode(location, conn))
+        if place.precision == Precision.NONE:
+            # the status filter shadows fastapi's status here
+            res = msg.InvalidQuery({'error': 'Unknown location', 'location': location})
+            response.status_code = res.apicode
+            return res.raw()
+        ids = truck_locations.within(place.lat, place.lon, LOCATION_RADIUS_MILES)
+        if not ids:
+            return msg.ResourceNotFound({'items': []}).raw()
+        filters['id__in'] = ids
+    return await list_rows(Truck, response, filters, limit=limit, after=after, order_by=order_by, stream=stream, fields=fields)
+
+@app.get('/api/trucks/positions')
+def get_truck_positions(truck_id: Union[list[int], None] = Query(None)):
+    """
+    Last reported position of every truck (or of the repeated ?truck_id=), from memory
+    """
+    return msg.ResourceFound(truck_locations.positions(truck_id)).raw()
 
-    return trucks.raw()
+@app.get('/api/trucks/nearby')
+async def get_nearby_trucks(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180),
+        radius: float = Query(NEARBY_RADIUS_MILES, gt=0, le=MAX_NEARBY_RADIUS_MILES),
+        limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Active trucks whose last reported position is within radius miles of lat, lon, nearest first
+    e.g. ?lat=36.07&lon=-79.79&radius=150&limit=10
+    """
+    res = await async_db.read(nearby_trucks, lat, lon, radius, limit)
+    return res.raw()
+
+@app.get('/api/trucks/available')
+async def get_available_trucks(start: str, end: str, response: Response):
+    """
+    Active trucks with no trip (other than Cancelled ones) between start and end
+    e.g. ?start=2025-07-01T08:00:00&end=2025-07-03T18:00:00
+    """
+    try:
+        trucks = await async_db.read(availability.free_trucks, start, end)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return msg.InvalidQuery({'error': str(e), 'start': start, 'end': end}).raw()
+    return msg.ResourceFound({'start': start, 'end': end, 'trucks': trucks}).raw()
+
+@app.get('/api/truck/{truck_id}/availability')
+async def get_truck_availability(truck_id: int, start: str, end: str, response: Response):
+    """
+    Is the truck free between start and end, lists the trips in the way when it is not
+    """
+    res = await async_db.read(lambda conn: check_truck_availability(truck_id, start, end, conn))
+    if res.apicode == 400:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
 
 @app.get("/api/truck/{truck_id}", status_code=200)
-def get_trip(truck_id: int, response: Response):
+async def get_trip(truck_id: int, response: Response, fields: Union[str, None] = None):
     """
     Get trip details by trip ID.
+    fields=status,location returns only those columns
     """
-    conn = get_db_connection()
-    truck = Truck.get(conn, truck_id)
-    if truck.apicode == 404:
-        response.status_code = status.HTTP_404_NOT_FOUND
+    truck = await async_db.get(Truck, truck_id, fields=fields)
+    if truck.apicode in (400, 404):
+        response.status_code = truck.apicode
     return truck.raw()
 
 
+@app.get("/api/truck/{truck_id}/location")
+def get_truck_location(truck_id: int, response: Response, history: int = Query(0, ge=0, le=1000)):
+    """
+    Last reported position of a truck, ?history=20 adds its latest pings (newest first)
+    """
+    position = truck_locations.position(truck_id)
+    if position is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return msg.ResourceNotFound({'truck_id': truck_id, 'position': None}).raw()
+    if history:
+        position['history'] = truck_locations.history(truck_id, history)
+    return msg.ResourceFound(position).raw()
+
+@app.post("/api/truck/{truck_id}/location")
+async def update_truck_location(truck_id: int, ping: LocationPing, response: Response):
+    """
+    Report where a truck is, kept in memory (see location/location.py) not written per ping
+    """
+    truck = await async_db.get(Truck, truck_id, fields='id')
+    if truck.apicode != 200:
+        response.status_code = truck.apicode
+        return truck.raw()
+    try:
+        now = truck_locations.clock()
+        ts = to_epoch(ping.ts, now) if ping.ts is not None else int(now)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return msg.InvalidQuery({'error': str(e), 'ts': ping.ts}).raw()
+    latest = truck_locations.update(truck_id, ping.lat, ping.lon, ts)
+    moves = await async_db.read(geofences.observe, [truck_id], [ping.lat], [ping.lon], [ts])
+    return msg.ResourceUpdated({'truck_id': truck_id, 'latest': latest, 'trips': await advance_trips(moves)}).raw()
+
+
+async def advance_trips(moves: list):
+    """
+    Write the trip status moves the geofences found (see location/geofence.py)
+    returns the trips that moved
+    """
+    if not moves:
+        return []
+    res = await async_db.write(geofences.apply, moves)
+    return res.raw()['updated']['applied']
+
+
+@app.post("/api/trucks/locations/batch", status_code=202)
+async def ingest_truck_locations(pings: list[dict], response: Response):
+    """
+    Pings from the devices, [{"truck_id": 1, "lat": 36.07, "lon": -79.79, "ts": ...}, ...]
+    They are buffered and written to truck_pings in the background (see PingBuffer in
+    location/location.py), bad rows are reported by index. 503 with Retry-After when the
+    buffer is full, send the same batch again then.
+    """
+    if len(pings) > MAX_PING_BATCH:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return msg.InvalidQuery({'error': f'At most {MAX_PING_BATCH} pings per batch', 'pings': len(pings)}).raw()
+    res = await async_db.read(ingest_pings, pings)
+    if res.apicode != 202:
+        response.status_code = res.apicode
+        if res.apicode == 503:
+            response.headers['Retry-After'] = str(PING_RETRY_AFTER)
+        return res.raw()
+    accepted = res.raw()['accepted']
+    accepted['trips'] = await advance_trips(accepted.pop('moves'))
+    return res.raw()
+
+
 @app.post("/api/truck/", status_code=201)       
-def create_trip(truck: TruckItem, response: Response): 
+async def create_trip(truck: TruckItem, response: Response):
     """
     Create a new trip.
     TODO Support forms as well
     """
-    conn = get_db_connection()
-    new_truck = Truck(
-        truck.license_plate,
-        truck.model,
-        truck.year,
-        truck.towing_capacity,
-        truck.status,
-        truck.location
-        )
-    res = new_truck.create(conn, new_truck.__dict__)
+    new_truck = Truck.from_item(truck)
+    res = await async_db.create(new_truck)
+    if res.apicode == 400:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+    return res.raw()
+
+@app.post("/api/truck/bulk", status_code=201)
+async def create_trucks_bulk(trucks: list[dict], response: Response,
+        chunk_size: int = Query(BULK_CHUNK_SIZE, ge=1, le=MAX_BULK_CHUNK_SIZE)):
+    """
+    Create many trucks in one transaction.
+    Each row is validated on its own, bad rows are reported by index
+    and the rest are inserted.
+    """
+    res = await async_db.write(bulk_create, Truck, TruckItem, trucks, chunk_size)
     if res.apicode == 400:
         response.status_code = status.HTTP_400_BAD_REQUEST
     return res.raw()
 
 @app.put("/api/trucks/{truck_id}/")
-def update_trip_status(truck_id: int, 
+async def update_trip_status(truck_id: int,
         license_plate: Union[str, None] = None,
         model: Union[str, None] = None,
         year: Union[str, None] = None,
         towing_capacity: Union[str, None] = None,
         status: Union[str, None] = None, 
         location: Union[str, None] = None
-                       
 ):
         
     """
     Update the values of a trip.
     """
-    conn = get_db_connection()
-    res = Truck.update(conn, truck_id, license_plate=license_plate, model=model, year=year, towing_capacity=towing_capacity, status=status, location=location)
-    conn.close()
+    res = await async_db.update(Truck, truck_id, license_plate=license_plate, model=model, year=year, towing_capacity=towing_capacity, status=status, location=location)
     return res.raw()
 
     
@@ -239,6 +579,49 @@ def update_driver(driver_id: int, name: Union[str, None] = None, license_number:
     pass
 
 
+"""
+Payroll
+"""
+@app.post("/api/payroll/runs")
+async def run_payroll(start: str, end: str, response: Response, recompute: bool = False):
+    """
+    Pay every driver for the trips delivered in [start, end), e.g. ?start=2025-07-01&end=2025-07-16
+    A run that stopped halfway carries on, a complete one is returned as it is unless recompute=true.
+    Chunks of drivers are computed on a reader and committed on the writer, see services/payroll.py
+    """
+    try:
+        run = await async_db.write(payroll.start_run, start, end, recompute)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return msg.InvalidQuery({'error': str(e), 'start': start, 'end': end}).raw()
+    while run['status'] != payroll.COMPLETE:
+        lines, last = await async_db.read(payroll.next_chunk, run)
+        run = await async_db.write(payroll.save_chunk, run, lines, last)
+    return msg.ResourceFound(run).raw()
+
+@app.get("/api/payroll/runs")
+async def get_payroll_runs(limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    The latest payroll runs with their totals, newest pay period first
+    """
+    res = await async_db.read(payroll.runs, limit)
+    return res.raw()
+
+@app.get("/api/payroll/runs/{run_id}")
+async def get_payroll_run(run_id: int, response: Response,
+        driver_id: Union[int, None] = None,
+        after: int = 0,
+        limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    The snapshot of a run: totals and one line per driver (trips, loaded miles, gross,
+    driver pay, company margin). driver_id picks one driver, pass back `next` as after for the next page
+    """
+    res = await async_db.read(payroll.snapshot, run_id, driver_id, after, limit)
+    if res.apicode == 404:
+        response.status_code = status.HTTP_404_NOT_FOUND
+    return res.raw()
+
+
 
 
 
@@ -312,7 +695,7 @@ def update_driver(driver_id: int, name: Union[str, None] = None, license_number:
 
 
 @app.get("/api/dashboard")
-def get_dashboard():
+async def get_dashboard():
     """
     Dashboard endpoint providing summary statistics.
     - Total trips
@@ -323,23 +706,61 @@ def get_dashboard():
     - Recently completed trips
     - Alerts (e.g., delayed trips, maintenance due)
     - Recent activity log
+
+    Built by services/dashboard.py and reused for DASHBOARD_TTL seconds
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    return await dashboard_cache.get('dashboard', lambda: async_db.read(dashboard.build))
+
 
-    total_trips = cursor.execute('SELECT COUNT(*) FROM trips').fetchone()[0]
-    total_drivers = cursor.execute('SELECT COUNT(*) FROM drivers').fetchone()[0]
-    total_trucks = cursor.execute('SELECT COUNT(*) FROM trucks').fetchone()[0]
+@app.get("/api/reports/deadhead")
+async def get_deadhead_report(response: Response, start: Union[str, None] = None, end: Union[str, None] = None,
+                              truck_id: Union[int, None] = None):
+    """
+    Deadhead miles and revenue per mile per truck and for the fleet
+    trips with pickup_date in [start, end), e.g. ?start=2025-07-01&end=2025-08-01&truck_id=3
+    """
+    res = await async_db.read(analytics.report, start, end, truck_id)
+    if res.apicode == 404:
+        response.status_code = status.HTTP_404_NOT_FOUND
+    return res.raw()
 
-    trips_by_status = cursor.execute('SELECT status, COUNT(*) as count FROM trips GROUP BY status').fetchall()
-    status_summary = {row['status']: row['count'] for row in trips_by_status}
 
-    return {
-        "total_trips": total_trips,
-        "total_drivers": total_drivers,
-        "total_trucks": total_trucks,
-        "trips_by_status": status_summary
-    }
+@app.get("/api/reports/revenue")
+async def get_revenue_report(response: Response, start: Union[str, None] = None, end: Union[str, None] = None,
+                             bucket: str = 'month', group_by: Union[list[str], None] = Query(None),
+                             truck_id: Union[int, None] = None, broker: Union[str, None] = None,
+                             status: Union[list[str], None] = Query(None)):
+    """
+    Trips, revenue and average rate per day / week / month of pickup_date in [start, end), whole days
+    e.g. ?start=2025-01-01&end=2026-01-01&bucket=week&group_by=broker&group_by=truck
+    Read from the revenue_daily rollup, see services/revenue.py
+    """
+    res = await async_db.read(revenue.revenue, start, end, bucket, group_by, truck_id, broker, status)
+    if res.apicode == 400:
+        response.status_code = res.apicode
+    return res.raw()
+
+
+@app.get("/api/db/stats")
+def get_db_stats():
+    """
+    Connection pool numbers used to size POOL_SIZE
+    - storage mode (wal / rollback)
+    - in use / idle / open connections for the readers and the writer
+    - how many checkouts had to wait or timed out
+    - checkout latency
+    - statement cache hits / misses
+    - entity cache (GET by id) hits / misses / evictions
+    - dashboard cache hits / builds / requests that waited on a build
+    - geocoder cache hits / geocodes table hits / gazetteer lookups
+    - truck positions in memory, pings waiting for truck_pings, ingest rate and flush latency
+    - trip geofences, pings matched and status moves made
+    """
+    return msg.ResourceFound({'pool': storage.stats(), 'statements': statement_cache.stats(),
+                              'entities': entity_cache.stats() if entity_cache else None,
+                              'dashboard': dashboard_cache.stats(), 'geocoder': geocoder.stats(),
+                              'locations': truck_locations.stats(), 'pings': ping_buffer.stats(),
+                              'geofences': geofences.stats()}).raw()
 
 
 
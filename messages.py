@@ -114,6 +114,22 @@ class ResourceFound(MTLMessage):
         self.desc = "Resource Found"
         self.kvargs = { 'found': resource}
 
+class ResourcePage(MTLMessage):
+    apicode = 200
+
+    def __init__(self, resource: list, next_after=None):
+        self.args = [resource, next_after]
+        self.desc = "Resource Page"
+        self.kvargs = { 'found': resource, 'next': next_after}
+
+class ResourceAccepted(MTLMessage):
+    apicode = 202
+
+    def __init__(self, resource: dict):
+        self.args = [resource]
+        self.desc = "Resource Accepted"
+        self.kvargs = { 'accepted': resource}
+
 class ResourceNotFound(MTLError):
     apicode = 404
 
@@ -138,6 +154,22 @@ class ResourceUpdateError(MTLError):
         self.desc = "Resource Update Error"
         self.kvargs = { 'error': error, 'error_code': self.apicode }
 
+class InvalidQuery(MTLError):
+    apicode = 400
+
+    def __init__(self, error: dict):
+        self.args = [error]
+        self.desc = "Invalid Query"
+        self.kvargs = { 'error': error, 'error_code': self.apicode }
+
+class ServiceUnavailable(MTLError):
+    apicode = 503
+
+    def __init__(self, error: dict):
+        self.args = [error]
+        self.desc = "Service Unavailable"
+        self.kvargs = { 'error': error, 'error_code': self.apicode }
+
 
 class LoadStatus:
     SCHEDULED = "Scheduled"
@@ -148,6 +180,24 @@ class LoadStatus:
     DELIVERED = "Delivered"
     CANCELLED = "Cancelled"
 
+class TruckStatus:
+    """
+    This is a way to ensure the state of a truck is consistent
+    """
+    ACTIVE = "active"
+    MAINTANANCE = "in maintanance"
+    BROKEN = "broken down"
+    RETIRED = "retired"
+    SOLD = "sold"
+
+class PayModel:
+    """
+    How drivers.pay_rate is read
+    """
+    PER_MILE = "per_mile"       # dollars per loaded mile
+    PERCENTAGE = "percentage"   # percent of the trip rate, 25.0 is 25%
+    FLAT = "flat"               # dollars per trip
+
 class LoadStatusError:
     """
     Error message for invalid load status.
@@ -161,7 +211,8 @@ class LoadStatusError:
     def __init__(self, trip_id, status: str):
         self.status = status
         self.trip_id = trip_id
-        self.message = f"Invalid load status: {status}. Allowed statuses are: {', '.join(vars(LoadStatus).values())}"
+        allowed = [value for key, value in vars(LoadStatus).items() if not key.startswith('_')]
+        self.message = f"Invalid load status: {status}. Allowed statuses are: {', '.join(allowed)}"
 
     def to_json(self):
         return json.dumps({
@@ -0,0 +1,181 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for fleet wide deadhead miles and earnings per mile.
+"""
+
+import numpy as np
+import pandas as pd
+
+import messages as msg
+from location.location import geocoder, haversine_miles, EARTH_RADIUS_MILES
+
+
+"""
+Goals for this module:
+- Deadhead miles: for every truck order its trips by pickup_date and take the distance from
+  each drop-off to the next pickup.
+- Loaded miles, revenue per loaded mile and revenue per total (loaded + deadhead) mile.
+- Do all of it for every truck at once with pandas / numpy column operations, no per trip
+  python loops, so a full fleet report over years of trips stays a single pass.
+- Coordinates come from a pluggable resolver (location text -> lat / lon), by default the
+  offline geocoder in location/location.py. Locations it cannot place give NaN miles and are
+  left out of the per mile numbers.
+"""
+
+
+# road miles are longer than the great circle distance, ~1.2 is the usual circuity for us highways
+ROAD_FACTOR = 1.2
+
+# only what the engine reads, every extra text column costs seconds at a million trips
+TRIP_COLUMNS = ['id', 'truck_id', 'rate', 'pickup_location', 'dropoff_location', 'pickup_date']
+
+
+resolver = geocoder.resolve
+
+
+def set_resolver(function):
+    """
+    function(conn, pd.Series of unique location text) -> DataFrame with lat, lon columns, same index
+    conn is the read connection of the report, None outside a request
+    """
+    global resolver
+    resolver = function
+
+
+def load_trips(conn, start: str | None = None, end: str | None = None, truck_id: int | None = None):
+    """
+    Trips with a truck that are not Cancelled, optionally with pickup_date in [start, end) and for one truck
+    """
+    conditions, params = ['truck_id IS NOT NULL', 'status != ?'], [msg.LoadStatus.CANCELLED]
+    if start:
+        conditions.append('pickup_date >= ?')
+        params.append(start)
+    if end:
+        conditions.append('pickup_date < ?')
+        params.append(end)
+    if truck_id is not None:
+        conditions.append('truck_id = ?')
+        params.append(truck_id)
+    return pd.read_sql_query(f"SELECT {', '.join(TRIP_COLUMNS)} FROM trips WHERE {' AND '.join(conditions)}",
+                             conn, params=params)
+
+
+def with_coordinates(trips: pd.DataFrame, conn=None, resolve=None):
+    """
+    Add pickup_lat / pickup_lon / dropoff_lat / dropoff_lon.
+    The resolver only sees each distinct location once.
+    """
+    resolve = resolve or resolver
+    codes, locations = pd.factorize(pd.concat([trips['pickup_location'], trips['dropoff_location']]))
+    coordinates = resolve(conn, pd.Series(locations, dtype=object))
+    lat, lon = coordinates['lat'].to_numpy(dtype=float), coordinates['lon'].to_numpy(dtype=float)
+    # factorize gives -1 for a missing location, that row picks up the NaN put at the end
+    lat, lon = np.append(lat, np.nan), np.append(lon, np.nan)
+    pickup, dropoff = codes[:len(trips)], codes[len(trips):]
+    return trips.assign(pickup_lat=lat[pickup], pickup_lon=lon[pickup],
+                        dropoff_lat=lat[dropoff], dropoff_lon=lon[dropoff])
+
+
+def compute(trips: pd.DataFrame):
+    """
+    trips with coordinates -> the same rows ordered by truck and pickup_date with
+    loaded_miles, deadhead_miles (from the truck's previous drop-off) and revenue per mile
+    """
+    # one int64 key, truck in the high 32 bits and pickup seconds in the low 32, sorts
+    # several times faster than (truck, iso string); an unreadable date sorts first
+    pickup = pd.to_datetime(trips['pickup_date'], format='ISO8601', errors='coerce')
+    seconds = np.clip(pickup.to_numpy().astype('datetime64[s]').astype(np.int64), 0, 2 ** 32 - 1)
+    key = (trips['truck_id'].to_numpy(dtype=np.int64) << 32) | seconds
+    order = np.lexsort((trips['id'].to_numpy(), key))
+    trips = trips.take(order).reset_index(drop=True)
+    pickup_lat, pickup_lon = trips['pickup_lat'].to_numpy(), trips['pickup_lon'].to_numpy()
+    dropoff_lat, dropoff_lon = trips['dropoff_lat'].to_numpy(), trips['dropoff_lon'].to_numpy()
+    loaded = haversine_miles(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon) * ROAD_FACTOR
+    # the previous row is the same truck's previous trip, except on the first trip of each truck
+    deadhead = np.zeros(len(trips))
+    if len(trips) > 1:
+        deadhead[1:] = haversine_miles(dropoff_lat[:-1], dropoff_lon[:-1], pickup_lat[1:], pickup_lon[1:]) * ROAD_FACTOR
+        truck = trips['truck_id'].to_numpy()
+        deadhead[1:][truck[1:] != truck[:-1]] = 0.0
+    total = loaded + deadhead
+    rate = trips['rate'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_loaded_mile = np.where(loaded > 0, rate / loaded, np.nan)
+        per_mile = np.where(total > 0, rate / total, np.nan)
+    return trips.assign(loaded_miles=loaded, deadhead_miles=deadhead,
+                        revenue_per_loaded_mile=per_loaded_mile, revenue_per_mile=per_mile)
+
+
+def _rates(frame):
+    total = frame['loaded_miles'] + frame['deadhead_miles']
+    frame['deadhead_pct'] = (frame['deadhead_miles'] / total * 100).where(total > 0)
+    frame['revenue_per_mile'] = (frame['measured_revenue'] / total).where(total > 0)
+    frame['revenue_per_loaded_mile'] = (frame['measured_revenue'] / frame['loaded_miles']).where(frame['loaded_miles'] > 0)
+    return frame
+
+
+def summarize(trips: pd.DataFrame):
+    """
+    Per truck and fleet totals (one row frames) from compute()
+    Only trips with known miles count towards the per mile numbers.
+    """
+    codes, trucks = pd.factorize(trips['truck_id'], sort=True)
+    rate = trips['rate'].to_numpy(dtype=float)
+    loaded, deadhead = trips['loaded_miles'].to_numpy(), trips['deadhead_miles'].to_numpy()
+    known = ~(np.isnan(loaded) | np.isnan(deadhead))
+
+    def total(weights=None):
+        return np.bincount(codes, weights=weights, minlength=len(trucks))
+
+    per_truck = pd.DataFrame({
+        'truck_id': trucks,
+        'trips': total().astype(np.int64),
+        'revenue': total(rate),
+        'measured_trips': total(known.astype(float)).astype(np.int64),
+        'measured_revenue': total(np.where(known, rate, 0.0)),
+        'loaded_miles': total(np.where(known, loaded, 0.0)),
+        'deadhead_miles': total(np.where(known, deadhead, 0.0)),
+    })
+    fleet = per_truck.drop(columns='truck_id').sum().to_frame().T
+    fleet = fleet.astype({'trips': np.int64, 'measured_trips': np.int64})
+    return _rates(per_truck), _rates(fleet)
+
+
+def _records(frame):
+    # NaN is not valid json
+    return frame.round(2).astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def report(conn, start: str | None = None, end: str | None = None, truck_id: int | None = None):
+    """
+    Deadhead / revenue per mile report for the fleet or one truck
+    """
+    trips = load_trips(conn, start, end, truck_id)
+    if trips.empty:
+        return msg.ResourceNotFound({'trips': 0, 'start': start, 'end': end, 'truck_id': truck_id})
+    per_truck, fleet = summarize(compute(with_coordinates(trips, conn)))
+    return msg.ResourceFound({'start': start, 'end': end, 'fleet': _records(fleet)[0],
+                              'trucks': _records(per_truck)})
+
+
+def trip_deadhead(conn, trip_id: int):
+    """
+    Deadhead miles into one trip from the previous trip of the same truck, None when unknown
+    """
+    trip = conn.execute('SELECT truck_id, pickup_date FROM trips WHERE id = ?', (trip_id,)).fetchone()
+    if trip is None or trip[0] is None:
+        return None
+    # this trip and the one before it in compute's order (pickup_date, then id), so a trip of
+    # the same truck picked up at the same time with a higher id is not taken for the predecessor
+    columns = ', '.join(TRIP_COLUMNS)
+    rows = pd.read_sql_query(f"SELECT {columns} FROM trips WHERE id = ? AND status != ? "
+                             f"UNION ALL SELECT * FROM (SELECT {columns} FROM trips WHERE truck_id = ? AND status != ? "
+                             f"AND (pickup_date, id) < (?, ?) ORDER BY pickup_date DESC, id DESC LIMIT 1)",
+                             conn, params=[trip_id, msg.LoadStatus.CANCELLED,
+                                           trip[0], msg.LoadStatus.CANCELLED, trip[1], trip_id])
+    trips = compute(with_coordinates(rows, conn))
+    row = trips[trips['id'] == trip_id]
+    if row.empty or len(trips) < 2 or pd.isna(row['deadhead_miles'].iloc[0]):
+        return None
+    return float(row['deadhead_miles'].iloc[0])
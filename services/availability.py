@@ -0,0 +1,288 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for answering truck availability from the trip schedules.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import messages as msg
+from logger import activity_logger, error_logger
+
+
+"""
+Goals for this module:
+- Answer "is truck X free between A and B" and "which trucks are free between A and B"
+  from the pickup_date / delivery_date of every trip that is not Cancelled.
+- Keep the schedule in memory as numpy arrays sorted by pickup time, plus a second order
+  sorted by (truck, pickup). A trip can only overlap [A, B) if it starts in
+  [A - longest trip, B), so a query reads a slice whose size depends on how busy that
+  window is, not on how much history there is. Trips longer than LONG_TRIP_SECONDS (or with
+  a bad delivery date far out) are kept in a small list of their own that every query checks,
+  so one of them cannot widen the window of all the others.
+- Stay current without reloading: trip_events (migration 7) logs every create and every
+  change in the writing transaction, so each query first reads the events it has not seen
+  yet (a primary key range, normally empty) and reloads just those trips. That also picks
+  up writes made by other workers.
+- Changed trips go to a small delta next to the arrays and are merged in once it grows.
+"""
+
+
+# changed trips held next to the sorted arrays before they are merged in
+MERGE_AT = 4096
+# seconds between reloads of the truck list (ids and status) for fleet queries
+TRUCK_REFRESH = 5.0
+# status of trucks that can be given a load
+AVAILABLE_TRUCK_STATUS = msg.TruckStatus.ACTIVE
+# trips longer than this are kept out of the sorted arrays, see the module goals
+LONG_TRIP_SECONDS = 14 * 24 * 3600
+
+
+def to_seconds(values):
+    """
+    iso date strings -> int64 seconds, -1 where a value cannot be parsed
+    """
+    values = list(values)
+    try:
+        return np.array(values, dtype='datetime64[s]').astype(np.int64)
+    except ValueError:
+        seconds = np.full(len(values), -1, dtype=np.int64)
+        for index, value in enumerate(values):
+            try:
+                seconds[index] = np.datetime64(value, 's').astype(np.int64)
+            except ValueError:
+                pass
+        return seconds
+
+
+def to_second(value):
+    """
+    one iso date -> int seconds, raises ValueError for a bad date
+    """
+    return int(np.datetime64(value, 's').astype(np.int64))
+
+
+class AvailabilityIndex:
+    """
+    Trip intervals per truck, see the module goals.
+
+    Every query method takes a read connection first so it can catch up on trip_events.
+    """
+
+    def __init__(self, merge_at: int = MERGE_AT, truck_refresh: float = TRUCK_REFRESH, clock=time.monotonic):
+        self.merge_at = merge_at
+        self.truck_refresh = truck_refresh
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._empty()
+        self._delta = {}           # trip_id -> (truck_id, start, end) changed since the merge
+        self._removed = set()      # trip ids in the arrays that are cancelled / changed
+        self._last_event = 0
+        self._active = np.empty(0, dtype=np.int64)
+        self._trucks_loaded_at = None
+        self.merges = 0
+
+    def _empty(self):
+        self._ids = np.empty(0, dtype=np.int64)
+        self._trucks = np.empty(0, dtype=np.int64)
+        self._starts = np.empty(0, dtype=np.int64)
+        self._ends = np.empty(0, dtype=np.int64)
+        self._by_truck = np.empty(0, dtype=np.int64)
+        self._by_truck_trucks = np.empty(0, dtype=np.int64)
+        self._by_truck_starts = np.empty(0, dtype=np.int64)
+        self._max_duration = 0
+        self._long_ids = np.empty(0, dtype=np.int64)
+        self._long_trucks = np.empty(0, dtype=np.int64)
+        self._long_starts = np.empty(0, dtype=np.int64)
+        self._long_ends = np.empty(0, dtype=np.int64)
+
+    def _build(self, ids, trucks, starts, ends):
+        """
+        Sort the intervals by start and index them by (truck, start), the long trips go aside
+        """
+        keep = (starts >= 0) & (ends >= starts)
+        if not keep.all():
+            error_logger.error(f"Availability skipped {int((~keep).sum())} trips with unreadable dates")
+        ids, trucks, starts, ends = ids[keep], trucks[keep], starts[keep], ends[keep]
+        long = ends - starts > LONG_TRIP_SECONDS
+        self._long_ids, self._long_trucks = ids[long], trucks[long]
+        self._long_starts, self._long_ends = starts[long], ends[long]
+        ids, trucks, starts, ends = ids[~long], trucks[~long], starts[~long], ends[~long]
+        order = np.argsort(starts, kind='stable')
+        self._ids, self._trucks, self._starts, self._ends = ids[order], trucks[order], starts[order], ends[order]
+        self._by_truck = np.lexsort((self._starts, self._trucks))
+        self._by_truck_trucks = self._trucks[self._by_truck]
+        self._by_truck_starts = self._starts[self._by_truck]
+        self._max_duration = int((self._ends - self._starts).max()) if len(self._ids) else 0
+
+    def load(self, conn):
+        """
+        Build the index from every trip that is not Cancelled
+        """
+        with self._lock:
+            self._last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM trip_events').fetchone()[0]
+            rows = conn.execute('SELECT id, truck_id, pickup_date, delivery_date FROM trips WHERE status != ?',
+                                (msg.LoadStatus.CANCELLED,)).fetchall()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            trucks = np.array([row[1] for row in rows], dtype=np.int64)
+            self._build(ids, trucks, to_seconds(row[2] for row in rows), to_seconds(row[3] for row in rows))
+            self._delta.clear()
+            self._removed.clear()
+            self._load_trucks(conn)
+            self.loaded = True
+        activity_logger.info(f"Availability index loaded {len(self._ids)} trips")
+
+    def _load_trucks(self, conn):
+        rows = conn.execute('SELECT id FROM trucks WHERE status = ? ORDER BY id', (AVAILABLE_TRUCK_STATUS,)).fetchall()
+        self._active = np.array([row[0] for row in rows], dtype=np.int64)
+        self._trucks_loaded_at = self.clock()
+
+    def _merge(self):
+        ids, trucks, starts, ends = (np.concatenate(pair) for pair in (
+            (self._ids, self._long_ids), (self._trucks, self._long_trucks),
+            (self._starts, self._long_starts), (self._ends, self._long_ends)))
+        keep = ~np.isin(ids, np.fromiter(self._removed, dtype=np.int64, count=len(self._removed)))
+        delta_ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+        delta = np.array(list(self._delta.values()), dtype=np.int64).reshape(-1, 3)
+        self._build(np.concatenate([ids[keep], delta_ids]),
+                    np.concatenate([trucks[keep], delta[:, 0]]),
+                    np.concatenate([starts[keep], delta[:, 1]]),
+                    np.concatenate([ends[keep], delta[:, 2]]))
+        self._delta.clear()
+        self._removed.clear()
+        self.merges += 1
+
+    def apply(self, rows):
+        """
+        Put the current state of some trips into the index
+        rows are (id, truck_id, pickup_date, delivery_date, status)
+        """
+        for trip_id, truck_id, pickup_date, delivery_date, status in rows:
+            self._removed.add(trip_id)
+            self._delta.pop(trip_id, None)
+            if status == msg.LoadStatus.CANCELLED:
+                continue
+            try:
+                start, end = to_second(pickup_date), to_second(delivery_date)
+            except ValueError:
+                error_logger.error(f"Availability skipped trip {trip_id} with unreadable dates")
+                continue
+            if end >= start:
+                # the delta is scanned whole, it does not need the window
+                self._delta[trip_id] = (truck_id, start, end)
+        if len(self._removed) >= self.merge_at:
+            self._merge()
+
+    def refresh(self, conn):
+        """
+        Catch up on trip_events written since the last look, load the index on first use
+        """
+        if not self.loaded:
+            self.load(conn)
+        with self._lock:
+            events = conn.execute('SELECT id, trip_id FROM trip_events WHERE id > ? ORDER BY id',
+                                  (self._last_event,)).fetchall()
+            if events:
+                self._last_event = events[-1][0]
+                trip_ids = list({row[1] for row in events})
+                for start in range(0, len(trip_ids), 500):
+                    chunk = trip_ids[start:start + 500]
+                    self.apply(conn.execute('SELECT id, truck_id, pickup_date, delivery_date, status FROM trips '
+                                            f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk).fetchall())
+            if self.clock() - self._trucks_loaded_at >= self.truck_refresh:
+                self._load_trucks(conn)
+
+    def _window(self, start, end):
+        # trips starting in [start - longest trip, end) are the only ones that can overlap
+        return (np.searchsorted(self._starts, start - self._max_duration, 'left'),
+                np.searchsorted(self._starts, end, 'left'))
+
+    def _delta_overlaps(self, start, end, truck_id=None):
+        return [(trip_id, truck) for trip_id, (truck, trip_start, trip_end) in self._delta.items()
+                if trip_start < end and trip_end > start and (truck_id is None or truck == truck_id)]
+
+    def _long_overlaps(self, start, end, truck_id=None):
+        """
+        (trip ids, trucks) of the long trips overlapping [start, end), caller holds the lock
+        """
+        hits = (self._long_starts < end) & (self._long_ends > start)
+        if truck_id is not None:
+            hits &= self._long_trucks == truck_id
+        if self._removed:
+            hits &= ~np.isin(self._long_ids, np.fromiter(self._removed, dtype=np.int64, count=len(self._removed)))
+        return self._long_ids[hits], self._long_trucks[hits]
+
+    def conflicts(self, conn, truck_id: int, start: str, end: str):
+        """
+        ids of the trips of truck_id overlapping [start, end)
+        """
+        start, end = to_second(start), to_second(end)
+        self.refresh(conn)
+        with self._lock:
+            lo = np.searchsorted(self._by_truck_trucks, truck_id, 'left')
+            hi = np.searchsorted(self._by_truck_trucks, truck_id, 'right')
+            starts = self._by_truck_starts[lo:hi]
+            first = lo + np.searchsorted(starts, start - self._max_duration, 'left')
+            last = lo + np.searchsorted(starts, end, 'left')
+            rows = self._by_truck[first:last]
+            hits = rows[self._ends[rows] > start]
+            found = [int(trip_id) for trip_id in self._ids[hits] if int(trip_id) not in self._removed]
+            found += self._long_overlaps(start, end, truck_id)[0].tolist()
+            found += [trip_id for trip_id, _ in self._delta_overlaps(start, end, truck_id)]
+        return sorted(found)
+
+    def is_free(self, conn, truck_id: int, start: str, end: str):
+        return not self.conflicts(conn, truck_id, start, end)
+
+    def _busy(self, start: int, end: int):
+        """
+        truck ids (with repeats) of the trips overlapping [start, end), caller holds the lock
+        """
+        lo, hi = self._window(start, end)
+        overlap = self._ends[lo:hi] > start
+        trucks = self._trucks[lo:hi][overlap]
+        if self._removed:
+            live = ~np.isin(self._ids[lo:hi][overlap],
+                            np.fromiter(self._removed, dtype=np.int64, count=len(self._removed)))
+            trucks = trucks[live]
+        delta = [truck for _, truck in self._delta_overlaps(start, end)]
+        return np.concatenate([trucks, self._long_overlaps(start, end)[1], np.array(delta, dtype=np.int64)])
+
+    def busy_trucks(self, conn, start: str, end: str):
+        """
+        ids of every truck with a trip overlapping [start, end)
+        """
+        start, end = to_second(start), to_second(end)
+        self.refresh(conn)
+        with self._lock:
+            return np.unique(self._busy(start, end)).tolist()
+
+    def free_trucks(self, conn, start: str, end: str):
+        """
+        ids of the active trucks with no trip overlapping [start, end)
+        """
+        start, end = to_second(start), to_second(end)
+        self.refresh(conn)
+        with self._lock:
+            active = self._active
+            if not len(active):
+                return []
+            # one flag per truck id, cheaper than any set operation at fleet size
+            busy = self._busy(start, end)
+            flags = np.zeros(int(active[-1]) + 1, dtype=bool)
+            flags[busy[busy < len(flags)]] = True
+            return active[~flags[active]].tolist()
+
+    def stats(self):
+        with self._lock:
+            return {'trips': len(self._ids), 'long_trips': len(self._long_ids), 'delta': len(self._delta),
+                    'removed': len(self._removed),
+                    'active_trucks': len(self._active), 'merges': self.merges,
+                    'max_duration_hours': round(self._max_duration / 3600, 1), 'last_event': self._last_event}
+
+
+availability = AvailabilityIndex()
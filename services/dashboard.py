@@ -0,0 +1,161 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for building the dashboard sections.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+import messages as msg
+from config import aggregates
+from services.trip import TripHistory
+
+
+"""
+Goals for this module:
+- Build every dashboard section from queries that walk an index and stop after N rows,
+  so the cost stays the same however much trip history there is:
+    - upcoming trips        idx_trips_pickup_date
+    - recently delivered    idx_trips_status_updated (status, updated_at)
+    - alerts (overdue)      idx_trips_status_delivery (status, delivery_date)
+    - recent activity       trip_events, newest first by id
+    - totals                trigger maintained counters, see config/aggregates.py
+- Keep the built dashboard for a few seconds and let only one request rebuild it
+  when it expires, every other request waiting at that moment gets the same result.
+"""
+
+
+# rows in each list section
+DASHBOARD_LIMIT = 10
+# seconds a built dashboard is served before it is rebuilt
+DASHBOARD_TTL = 5.0
+
+# columns of a trip shown in the dashboard lists
+TRIP_COLUMNS = 'id, truck_id, driver_id, broker, rate_con_number, pickup_location, dropoff_location, ' \
+               'pickup_date, delivery_date, status, updated_at'
+
+CLOSED_STATUSES = (msg.LoadStatus.DELIVERED, msg.LoadStatus.CANCELLED)
+OPEN_STATUSES = tuple(status for name, status in vars(msg.LoadStatus).items()
+                      if not name.startswith('_') and status not in CLOSED_STATUSES)
+
+
+def _rows(conn, sql, params):
+    return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def upcoming_trips(conn, now: str, limit: int = DASHBOARD_LIMIT):
+    """
+    Next trips to be picked up from now on
+    """
+    return _rows(conn, f"SELECT {TRIP_COLUMNS} FROM trips WHERE pickup_date >= ? "
+                       f"AND status NOT IN (?, ?) ORDER BY pickup_date LIMIT ?",
+                 (now, *CLOSED_STATUSES, limit))
+
+
+def recently_delivered(conn, limit: int = DASHBOARD_LIMIT):
+    """
+    Last trips marked Delivered, newest first
+    """
+    # id breaks ties within a second, it is the last column of idx_trips_status_updated too
+    return _rows(conn, f"SELECT {TRIP_COLUMNS} FROM trips WHERE status = ? ORDER BY updated_at DESC, id DESC LIMIT ?",
+                 (msg.LoadStatus.DELIVERED, limit))
+
+
+def overdue_trips(conn, now: str, limit: int = DASHBOARD_LIMIT):
+    """
+    Trips past their delivery_date that are still open, most overdue first
+    returns (count, rows)
+    """
+    placeholders = ', '.join('?' * len(OPEN_STATUSES))
+    count = conn.execute(f"SELECT COUNT(*) FROM trips WHERE status IN ({placeholders}) AND delivery_date < ?",
+                         (*OPEN_STATUSES, now)).fetchone()[0]
+    # the first `limit` of each status straight off the index, then merged,
+    # instead of sorting every overdue trip
+    rows = []
+    for status in OPEN_STATUSES:
+        rows += _rows(conn, f"SELECT {TRIP_COLUMNS} FROM trips WHERE status = ? AND delivery_date < ? "
+                            f"ORDER BY delivery_date LIMIT ?", (status, now, limit))
+    rows.sort(key=lambda row: (row['delivery_date'], row['id']))
+    return count, rows[:limit]
+
+
+def recent_activity(conn, limit: int = DASHBOARD_LIMIT):
+    """
+    Latest trip events (created, status, truck, driver and detail changes)
+    """
+    return _rows(conn, f"SELECT {TripHistory.COLUMNS} FROM trip_events ORDER BY id DESC LIMIT ?", (limit,))
+
+
+def build(conn, now: str | None = None, limit: int = DASHBOARD_LIMIT):
+    """
+    Every dashboard section in one dict
+    now is an iso datetime like the trip dates (default the current time)
+    """
+    now = now or datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    counts = aggregates.summary(conn)
+    overdue_count, overdue = overdue_trips(conn, now, limit)
+    return {
+        "total_trips": counts['totals']['trips'],
+        "total_drivers": counts['totals']['drivers'],
+        "total_trucks": counts['totals']['trucks'],
+        "trips_by_status": counts['trips_by_status'],
+        "upcoming_trips": upcoming_trips(conn, now, limit),
+        "recently_delivered": recently_delivered(conn, limit),
+        "alerts": {"overdue_count": overdue_count, "overdue_trips": overdue},
+        "recent_activity": recent_activity(conn, limit),
+        "generated_at": now,
+    }
+
+
+class SingleFlightCache:
+    """
+    Keeps one value per key for ttl seconds.
+    When it expires the first caller rebuilds it, callers arriving while
+    that build runs await the same build instead of starting their own.
+    """
+
+    def __init__(self, ttl: float = DASHBOARD_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._values = {}
+        self._pending = {}
+        self.hits = 0
+        self.builds = 0
+        self.waits = 0
+
+    async def get(self, key, build):
+        """
+        build is an async callable returning the value
+        """
+        entry = self._values.get(key)
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            return entry[1]
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._build(key, build))
+            self._pending[key] = pending
+        else:
+            self.waits += 1
+        # shield so a client disconnecting does not cancel the build for the others
+        return await asyncio.shield(pending)
+
+    async def _build(self, key, build):
+        try:
+            value = await build()
+            self.builds += 1
+            self._values[key] = (self.clock() + self.ttl, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    def clear(self):
+        self._values.clear()
+
+    def stats(self):
+        return {'ttl': self.ttl, 'hits': self.hits, 'builds': self.builds, 'waits': self.waits}
+
+
+dashboard_cache = SingleFlightCache()
@@ -0,0 +1,228 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for driver earnings and company margin over a pay period.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import messages as msg
+from services import analytics
+from logger import activity_logger
+
+
+"""
+Goals for this module:
+- Pay every driver for the trips they Delivered in a pay period ([start, end) on delivery_date)
+  by their pay model (msg.PayModel): per loaded mile, percentage of the trip rate or flat per
+  trip, and keep what is left of the rate as the company margin.
+- Work on whole columns: trips are read for a chunk of drivers at a time, miles come from the
+  analytics engine (geocoded, ROAD_FACTOR) and the pay of every trip is one np.select, the per
+  driver totals one np.bincount. No per trip python.
+- Save the result as a snapshot (payroll_runs / payroll_lines, migration 11) with the pay model
+  and rate each driver had, so later rate changes do not rewrite past payroll.
+- Commit each chunk together with how far the run got (last_driver_id), so a run that stopped
+  halfway carries on from there instead of starting again.
+"""
+
+
+# drivers whose trips are read, paid and committed together
+PAYROLL_CHUNK_DRIVERS = 2000
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+
+LINE_COLUMNS = ['driver_id', 'pay_model', 'pay_rate', 'trips', 'loaded_miles', 'unmeasured_trips', 'gross',
+                'driver_pay', 'company_margin']
+RUN_COLUMNS = ['id', 'period_start', 'period_end', 'status', 'last_driver_id', 'drivers', 'trips', 'gross',
+               'driver_pay', 'company_margin', 'created_at', 'completed_at']
+
+
+def _run(conn, run_id: int):
+    row = conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM payroll_runs WHERE id = ?", (run_id,)).fetchone()
+    return None if row is None else dict(zip(RUN_COLUMNS, row))
+
+
+def start_run(conn, start: str, end: str, recompute: bool = False):
+    """
+    The run of the pay period [start, end), created when there is none yet, needs the writer.
+    A run that stopped halfway is returned as it is and carries on, recompute=True drops
+    what a run has and starts it again.
+    """
+    datetime.fromisoformat(start), datetime.fromisoformat(end)
+    if start >= end:
+        raise ValueError(f'The pay period has to end after it starts ({start} - {end})')
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    row = conn.execute('SELECT id FROM payroll_runs WHERE period_start = ? AND period_end = ?', (start, end)).fetchone()
+    if row is None:
+        run_id = conn.execute('INSERT INTO payroll_runs (period_start, period_end, status, created_at) VALUES (?, ?, ?, ?)',
+                              (start, end, RUNNING, now)).lastrowid
+    else:
+        run_id = row[0]
+        if recompute:
+            conn.execute('DELETE FROM payroll_lines WHERE run_id = ?', (run_id,))
+            conn.execute('UPDATE payroll_runs SET status = ?, last_driver_id = 0, drivers = 0, trips = 0, gross = 0, '
+                         'driver_pay = 0, company_margin = 0, created_at = ?, completed_at = NULL WHERE id = ?',
+                         (RUNNING, now, run_id))
+    conn.commit()
+    return _run(conn, run_id)
+
+
+def load_drivers(conn, after: int, limit: int = PAYROLL_CHUNK_DRIVERS):
+    """
+    The next limit drivers by id after `after`: id, pay_model, pay_rate
+    """
+    return pd.read_sql_query('SELECT id, pay_model, pay_rate FROM drivers WHERE id > ? ORDER BY id LIMIT ?',
+                             conn, params=[after, limit])
+
+
+def load_trips(conn, driver_ids: list, start: str, end: str):
+    """
+    Delivered trips of driver_ids with delivery_date in [start, end)
+    """
+    # IN instead of BETWEEN first and last driver: each id is one seek on
+    # idx_trips_driver_delivery (driver_id, status, delivery_date) that reads only the period,
+    # a range of drivers reads their whole history or falls back to the status index
+    return pd.read_sql_query(
+        'SELECT id, driver_id, rate, pickup_location, dropoff_location FROM trips '
+        f"WHERE driver_id IN ({', '.join('?' * len(driver_ids))}) AND status = ? AND delivery_date >= ? AND delivery_date < ?",
+        conn, params=[*driver_ids, msg.LoadStatus.DELIVERED, start, end])
+
+
+def compute(drivers: pd.DataFrame, trips: pd.DataFrame, conn=None):
+    """
+    drivers (id, pay_model, pay_rate) and their trips -> one payroll line per driver with trips.
+    Per mile pay only counts trips whose miles are known, the others are unmeasured_trips.
+    """
+    if trips.empty:
+        return pd.DataFrame(columns=LINE_COLUMNS)
+    trips = analytics.with_coordinates(trips, conn)
+    miles = analytics.haversine_miles(trips['pickup_lat'].to_numpy(), trips['pickup_lon'].to_numpy(),
+                                      trips['dropoff_lat'].to_numpy(), trips['dropoff_lon'].to_numpy()) * analytics.ROAD_FACTOR
+    measured = ~np.isnan(miles)
+    miles = np.where(measured, miles, 0.0)
+
+    driver_ids = drivers['id'].to_numpy(dtype=np.int64)
+    # drivers come sorted by id, so searchsorted finds each trip's driver row, a trip of a
+    # driver that is not in drivers has no row and is left out
+    trip_drivers = trips['driver_id'].to_numpy(dtype=np.int64)
+    row = np.minimum(np.searchsorted(driver_ids, trip_drivers), len(driver_ids) - 1)
+    known = driver_ids[row] == trip_drivers
+    row, miles, measured = row[known], miles[known], measured[known]
+    models = drivers['pay_model'].to_numpy(dtype=object)[row]
+    rates = drivers['pay_rate'].to_numpy(dtype=float)[row]
+    rate = trips['rate'].to_numpy(dtype=float)[known]
+    pay = np.select([models == msg.PayModel.PER_MILE, models == msg.PayModel.PERCENTAGE, models == msg.PayModel.FLAT],
+                    [miles * rates, rate * rates / 100, rates], default=0.0)
+
+    def total(weights=None):
+        return np.bincount(row, weights=weights, minlength=len(driver_ids))
+
+    lines = drivers.rename(columns={'id': 'driver_id'}).assign(
+        trips=total().astype(np.int64), loaded_miles=total(miles),
+        unmeasured_trips=total(~measured).astype(np.int64), gross=total(rate), driver_pay=total(pay))
+    lines = lines[lines['trips'] > 0]
+    lines = lines.assign(company_margin=lines['gross'] - lines['driver_pay'])
+    return lines[LINE_COLUMNS].round({'loaded_miles': 2, 'gross': 2, 'driver_pay': 2, 'company_margin': 2})
+
+
+def next_chunk(conn, run: dict, chunk: int = PAYROLL_CHUNK_DRIVERS):
+    """
+    Lines of the next chunk of drivers of a run and the last driver id in it (None when
+    every driver is done), only reads so it can go on a reader
+    """
+    drivers = load_drivers(conn, run['last_driver_id'], chunk)
+    if drivers.empty:
+        return None, None
+    driver_ids = drivers['id'].tolist()
+    trips = load_trips(conn, driver_ids, run['period_start'], run['period_end'])
+    return compute(drivers, trips, conn), driver_ids[-1]
+
+
+def save_chunk(conn, run: dict, lines, last_driver_id):
+    """
+    Write a chunk of lines and move the run on to last_driver_id in one transaction, needs the
+    writer. last_driver_id None marks the run complete. When the stored run is no longer where
+    the chunk was read from (another request moved it) nothing is written, read it again.
+    returns the run as stored
+    """
+    current = _run(conn, run['id'])
+    if current['status'] == COMPLETE or current['last_driver_id'] != run['last_driver_id']:
+        return current
+    if last_driver_id is None:
+        conn.execute('UPDATE payroll_runs SET status = ?, completed_at = ? WHERE id = ?',
+                     (COMPLETE, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), run['id']))
+        conn.commit()
+        activity_logger.info(f"Payroll run {run['id']} ({run['period_start']} - {run['period_end']}) complete")
+        return _run(conn, run['id'])
+    try:
+        conn.executemany(f"INSERT INTO payroll_lines (run_id, {', '.join(LINE_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * (len(LINE_COLUMNS) + 1))})",
+                         zip([run['id']] * len(lines), *(lines[column].tolist() for column in LINE_COLUMNS)))
+        conn.execute('UPDATE payroll_runs SET last_driver_id = ?, drivers = drivers + ?, trips = trips + ?, '
+                     'gross = ROUND(gross + ?, 2), driver_pay = ROUND(driver_pay + ?, 2), '
+                     'company_margin = ROUND(company_margin + ?, 2) WHERE id = ?',
+                     (last_driver_id, len(lines), int(lines['trips'].sum()), float(lines['gross'].sum()),
+                      float(lines['driver_pay'].sum()), float(lines['company_margin'].sum()), run['id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return _run(conn, run['id'])
+
+
+def run_payroll(conn, start: str, end: str, recompute: bool = False, chunk: int = PAYROLL_CHUNK_DRIVERS):
+    """
+    The whole run on one connection (the cli, benchmarks and tests), the api interleaves
+    next_chunk on a reader with save_chunk on the writer instead
+    """
+    run = start_run(conn, start, end, recompute)
+    while run['status'] != COMPLETE:
+        lines, last = next_chunk(conn, run, chunk)
+        run = save_chunk(conn, run, lines, last)
+    return run
+
+
+def runs(conn, limit: int = 50):
+    """
+    The latest payroll runs, newest pay period first
+    """
+    rows = conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM payroll_runs ORDER BY period_start DESC, id DESC LIMIT ?",
+                        (limit,)).fetchall()
+    return msg.ResourceFound([dict(zip(RUN_COLUMNS, row)) for row in rows])
+
+
+def snapshot(conn, run_id: int, driver_id: int | None = None, after: int = 0, limit: int = 500):
+    """
+    A run with its lines by driver id, a page of limit lines after the driver id `after`,
+    pass back `next` as after
+    """
+    run = _run(conn, run_id)
+    if run is None:
+        return msg.ResourceNotFound({'id': run_id})
+    if driver_id is not None:
+        rows = conn.execute(f"SELECT {', '.join(LINE_COLUMNS)} FROM payroll_lines WHERE run_id = ? AND driver_id = ?",
+                            (run_id, driver_id)).fetchall()
+    else:
+        rows = conn.execute(f"SELECT {', '.join(LINE_COLUMNS)} FROM payroll_lines WHERE run_id = ? AND driver_id > ? "
+                            'ORDER BY driver_id LIMIT ?', (run_id, after, limit)).fetchall()
+    lines = [dict(zip(LINE_COLUMNS, row)) for row in rows]
+    next_after = lines[-1]['driver_id'] if driver_id is None and len(lines) == limit else None
+    return msg.ResourcePage({'run': run, 'lines': lines}, next_after)
+
+
+if __name__ == '__main__':
+    import sys
+    import sqlite3
+    import time
+    if len(sys.argv) < 4:
+        print('usage: python -m services.payroll mtl.db 2025-07-01 2025-07-16 [--recompute]')
+        sys.exit(1)
+    conn = sqlite3.connect(sys.argv[1])
+    began = time.perf_counter()
+    print(run_payroll(conn, sys.argv[2], sys.argv[3], recompute='--recompute' in sys.argv))
+    print(f'{time.perf_counter() - began:.1f}s')
+    conn.close()
@@ -0,0 +1,122 @@
+"""
+author: Tinashe Kucherera
+date: 2026-10-18
+description: Module for revenue trends by day, week or month, per truck, broker or status.
+"""
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import messages as msg
+
+
+"""
+Goals for this module:
+- Answer revenue trend queries (trips, revenue, average rate per bucket) from revenue_daily,
+  never from trips. The rollup has one row per pickup day, truck, broker and status and is
+  kept by triggers in the same transaction as every trip write (migration 12,
+  config/aggregates.py rebuilds and checks it). Its rows are narrow and stored in day order,
+  so a year is one range of the primary key and no trip row is read.
+- sqlite only sums by day (+ the group_by columns). GROUP BY day follows the primary key, so
+  it streams without a temp b-tree; a GROUP BY on a week / month expression sorted every row
+  first and took ~3x longer. The days (a few hundred a year) are then folded into weeks
+  (starting Monday) or months with pandas.
+- Average rate is revenue / trips of the bucket, not an average of daily averages.
+"""
+
+
+BUCKETS = ('day', 'week', 'month')
+# group_by name -> revenue_daily column
+GROUPS = {'truck': 'truck_id', 'broker': 'broker', 'status': 'status'}
+
+# cancelled trips are not revenue unless asked for by status
+DEFAULT_STATUSES = tuple(status for name, status in vars(msg.LoadStatus).items()
+                         if not name.startswith('_') and status != msg.LoadStatus.CANCELLED)
+
+
+def _day(value: str | None, end: bool = False):
+    """
+    The rollup only knows days: a start is the day it falls on, an end past midnight
+    (2025-07-31T18:00) is the start of the next day so the day it falls on is counted
+    """
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if end and moment != day:
+        day += timedelta(days=1)
+    return day.strftime('%Y-%m-%d')
+
+
+def _money(value):
+    return round(value or 0.0, 2)
+
+
+def revenue(conn, start: str | None = None, end: str | None = None, bucket: str = 'month',
+            group_by: list | None = None, truck_id: int | None = None, broker: str | None = None,
+            status: list | None = None):
+    """
+    Trips, revenue and average rate per bucket of trips picked up in [start, end), split by
+    the group_by columns (truck, broker, status), optionally for one truck / broker.
+    start and end are taken as whole days, see _day.
+    status defaults to every status but Cancelled.
+    """
+    group_by = list(dict.fromkeys(group_by or []))
+    query = {'start': start, 'end': end, 'bucket': bucket, 'group_by': group_by}
+    if bucket not in BUCKETS:
+        return msg.InvalidQuery({**query, 'bucket': f'{bucket} is not one of {", ".join(BUCKETS)}'})
+    unknown = [name for name in group_by if name not in GROUPS]
+    if unknown:
+        return msg.InvalidQuery({**query, 'group_by': f'{", ".join(unknown)} not one of {", ".join(GROUPS)}'})
+    try:
+        start_day, end_day = _day(start), _day(end, end=True)
+    except ValueError as e:
+        return msg.InvalidQuery({**query, 'error': str(e)})
+
+    statuses = list(status or DEFAULT_STATUSES)
+    conditions, params = [f"status IN ({', '.join('?' * len(statuses))})"], statuses
+    for column, value in (('day >=', start_day), ('day <', end_day), ('truck_id =', truck_id), ('broker =', broker)):
+        if value is not None:
+            conditions.append(f'{column} ?')
+            params.append(value)
+    columns = [GROUPS[name] for name in group_by]
+    keys = ', '.join(['day', *columns])
+    rows = conn.execute(f"SELECT {keys}, SUM(trips), SUM(revenue) FROM revenue_daily "
+                        f"WHERE {' AND '.join(conditions)} GROUP BY {keys}", params).fetchall()
+    daily = pd.DataFrame([tuple(row) for row in rows], columns=['day', *columns, 'trips', 'revenue'])
+    return report(buckets(daily, bucket, columns), columns, query)
+
+
+def buckets(daily: pd.DataFrame, bucket: str, columns: list):
+    """
+    daily sums (day, *columns, trips, revenue) -> the same summed per period, ordered
+    """
+    if daily.empty:
+        return daily.rename(columns={'day': 'period'})
+    if bucket == 'day':
+        periods = daily['day']
+    else:
+        # each distinct day is converted once
+        codes, days = pd.factorize(daily['day'])
+        days = pd.to_datetime(days)
+        if bucket == 'week':
+            starts = days - pd.to_timedelta(days.weekday, unit='D')
+        else:
+            starts = days.to_period('M').start_time
+        periods = pd.Series(starts.strftime('%Y-%m-%d'), dtype=object).to_numpy()[codes]
+    frame = daily.drop(columns='day').assign(period=periods)
+    return frame.groupby(['period', *columns], sort=True, as_index=False)[['trips', 'revenue']].sum()
+
+
+def report(periods: pd.DataFrame, columns: list, query: dict):
+    """
+    Rows per period with trips, revenue and average rate, and the total
+    """
+    trips, total = int(periods['trips'].sum()), float(periods['revenue'].sum())
+    found = [{'period': row[0], **dict(zip(columns, row[1:-2])), 'trips': row[-2],
+              'revenue': _money(row[-1]), 'avg_rate': _money(row[-1] / row[-2])}
+             for row in zip(*(periods[column].tolist() for column in ['period', *columns, 'trips', 'revenue']))]
+    return msg.ResourceFound({**query, 'rows': found,
+                              'total': {'trips': trips, 'revenue': _money(total),
+                                        'avg_rate': _money(total / trips) if trips else None}})
@@ -10,6 +10,8 @@ from datetime import datetime
 import messages as msg
 import sqlite3
 from config.config import ConfigManager
+from config import query
+from services import analytics
 from pydantic import BaseModel
 
 
@@ -42,6 +44,28 @@ class TripItem(BaseModel):
     driver_id: int | None = None
     
 
+class TripStatusBatch(BaseModel):
+    """
+    Move many trips to the same status at once
+    """
+    trip_ids: list[int]
+    status: str
+
+
+# Which status a load can move to from each status
+STATUS_TRANSITIONS = {
+    msg.LoadStatus.SCHEDULED: {msg.LoadStatus.PENDING, msg.LoadStatus.LOADED, msg.LoadStatus.CANCELLED},
+    msg.LoadStatus.PENDING: {msg.LoadStatus.SCHEDULED, msg.LoadStatus.LOADED, msg.LoadStatus.CANCELLED},
+    msg.LoadStatus.LOADED: {msg.LoadStatus.IN_TRANSIT, msg.LoadStatus.LOADED_OUT, msg.LoadStatus.CANCELLED},
+    msg.LoadStatus.IN_TRANSIT: {msg.LoadStatus.LOADED_OUT, msg.LoadStatus.DELIVERED},
+    msg.LoadStatus.LOADED_OUT: {msg.LoadStatus.IN_TRANSIT, msg.LoadStatus.DELIVERED},
+    msg.LoadStatus.DELIVERED: set(),
+    msg.LoadStatus.CANCELLED: {msg.LoadStatus.SCHEDULED},
+}
+
+# sqlite limits the number of ? in one statement
+ID_CHUNK_SIZE = 500
+
 
 class Trip(ConfigManager):
     table_name = 'trips'
@@ -62,6 +86,23 @@ class Trip(ConfigManager):
         self.truck_id = truck_id
         self.validate_status()
 
+    @classmethod
+    def from_item(cls, item: TripItem):
+        """
+        Build a trip from the validated request body
+        """
+        trip = cls(item.broker,
+                   item.rate_con_number,
+                   item.rate,
+                   item.pickup_location,
+                   item.dropoff_location,
+                   item.pickup_date,
+                   item.delivery_date,
+                   item.truck_id,
+                   item.status)
+        trip.driver_id = item.driver_id
+        return trip
+
     def validate_status(self):
         if self.status not in vars(msg.LoadStatus).values():
             raise ValueError(msg.LoadStatusError(self.truck_id, self.status).message)
@@ -76,26 +117,130 @@ class Trip(ConfigManager):
 
         if new_status in vars(msg.LoadStatus).values():
             conn.execute('UPDATE trips SET status = ?, updated_at = ? WHERE id = ?', (new_status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), trip_id))
+            conn.commit()
+            cls.invalidate([trip_id])
             return msg.ResourceUpdated({'trip_id': trip_id, 'new_status': new_status})
         else:
             raise ValueError(msg.LoadStatusError(trip_id, new_status).message)
 
+    @classmethod
+    def bulk_update_status(cls, conn, trip_ids: list, new_status: str):
+        """
+        Move many trips to new_status in one transaction.
+        Every transition is checked against STATUS_TRANSITIONS in memory first,
+        then all allowed ones are applied with a single UPDATE ... WHERE id IN (...)
+        returns the applied ids and the rejected ones with the reason
+        """
+        if new_status not in STATUS_TRANSITIONS:
+            raise ValueError(msg.LoadStatusError(trip_ids, new_status).message)
+        trip_ids = list(dict.fromkeys(trip_ids))
+        sources = [status for status, targets in STATUS_TRANSITIONS.items() if new_status in targets]
+
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = {}
+            for start in range(0, len(trip_ids), ID_CHUNK_SIZE):
+                chunk = trip_ids[start:start + ID_CHUNK_SIZE]
+                rows = conn.execute(f"SELECT id, status FROM trips WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                current.update({row[0]: row[1] for row in rows})
+
+            applied = []
+            rejected = []
+            for trip_id in trip_ids:
+                status = current.get(trip_id)
+                if status is None:
+                    rejected.append({'id': trip_id, 'status': None, 'reason': 'not found'})
+                elif status == new_status:
+                    rejected.append({'id': trip_id, 'status': status, 'reason': f'already {new_status}'})
+                elif new_status not in STATUS_TRANSITIONS.get(status, set()):
+                    rejected.append({'id': trip_id, 'status': status, 'reason': f'cannot go from {status} to {new_status}'})
+                else:
+                    applied.append(trip_id)
+
+            updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for start in range(0, len(applied), ID_CHUNK_SIZE):
+                chunk = applied[start:start + ID_CHUNK_SIZE]
+                # the status guard keeps the update honest if a row changed after it was read
+                conn.execute(f"UPDATE trips SET status = ?, updated_at = ? WHERE id IN ({', '.join('?' * len(chunk))}) "
+                             f"AND status IN ({', '.join('?' * len(sources))})",
+                             [new_status, updated_at, *chunk, *sources])
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        cls.invalidate(applied)
+        return msg.ResourceUpdated({'status': new_status, 'applied': applied, 'rejected': rejected})
+
+
+    @classmethod
+    def search(cls, conn, q: str, limit: int = 20, offset: int = 0):
+        """
+        Full text search over broker, rate con number and pickup / dropoff location
+        (trips_fts, migration 6). Every word has to match the start of a word in one
+        of those columns, best matches (bm25) first.
+        returns a page of trips with `next` as the offset of the next page
+        """
+        match = query.fts_query(q)
+        if match is None:
+            return msg.InvalidQuery({'error': 'Nothing to search for', 'q': q})
+        # rank and page inside fts5 first, only the page is joined back to trips
+        rows = conn.execute('SELECT trips.* FROM (SELECT rowid, rank FROM trips_fts WHERE trips_fts MATCH ? '
+                            'ORDER BY rank LIMIT ? OFFSET ?) AS hits JOIN trips ON trips.id = hits.rowid '
+                            'ORDER BY hits.rank', (match, limit, offset)).fetchall()
+        if not rows:
+            return msg.ResourceNotFound({'items': []})
+        return msg.ResourcePage([dict(row) for row in rows], offset + limit if len(rows) == limit else None)
 
 
 class TripHistory:
-    """Class to manage trip history, truck, driver, and status changes."""
+    """Class to manage trip history, truck, driver, and status changes.
+
+    The history is the trip_events table (migration 7). Triggers on trips append an
+    event for every create and every change of status, truck, driver or trip details
+    inside the same transaction as the write, so nothing here commits on its own
+    and a bulk update is still one commit.
+    """
+    # columns of an event
+    COLUMNS = 'id, trip_id, truck_id, driver_id, ts, event, field, old_value, new_value'
+
     def __init__(self, trip_id: int):
         self.trip_id = trip_id
-        self.history = []  # This would normally be populated from a database
 
-    def add_history_entry(self, entry: dict):
-        entry['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.history.append(entry)
+    def add_history_entry(self, conn, entry: dict):
+        """
+        Append a note to the history e.g. {'field': 'detention', 'new_value': '2h at pickup'}
+        """
+        trip = conn.execute('SELECT truck_id, driver_id FROM trips WHERE id = ?', (self.trip_id,)).fetchone()
+        if trip is None:
+            return msg.ResourceNotFound({'id': self.trip_id})
+        entry = dict(entry, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        conn.execute('INSERT INTO trip_events (trip_id, truck_id, driver_id, ts, event, field, new_value) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (self.trip_id, trip[0], trip[1], entry['timestamp'], 'note', entry.get('field'), entry.get('new_value')))
+        conn.commit()
         return msg.ResourceUpdated({'trip_id': self.trip_id, 'history_entry': entry})
 
-    def get_history(self):
-        return msg.ResourceFound({'trip_id': self.trip_id, 'history': self.history})
-    
+    def get_history(self, conn, after: int | None = None, limit: int = 50):
+        """
+        Events of the trip oldest first, a page at a time.
+        Pass back `next` (the last event id) as after for the next page.
+        """
+        rows = conn.execute(f'SELECT {self.COLUMNS} FROM trip_events WHERE trip_id = ? AND id > ? ORDER BY id LIMIT ?',
+                            (self.trip_id, after or 0, limit)).fetchall()
+        history = [dict(row) for row in rows]
+        return msg.ResourcePage(history, history[-1]['id'] if len(history) == limit else None)
+
+    @classmethod
+    def for_truck(cls, conn, truck_id: int, since: str | None = None, limit: int = 50):
+        """
+        Events of every trip on a truck, newest first, optionally only those after since (ts)
+        """
+        rows = conn.execute(f'SELECT {cls.COLUMNS} FROM trip_events WHERE truck_id = ? AND ts > ? '
+                            f'ORDER BY ts DESC LIMIT ?', (truck_id, since or '', limit)).fetchall()
+        return msg.ResourceFound([dict(row) for row in rows])
+
+
 class TripDetails:
     """Class to update fetch detailed information about a specific trip."""
     def __init__(self, trip_id: int, driver_id):
@@ -113,17 +258,39 @@ class TripDetails:
         self.truck_changes = []
         self.created_at = None
         self.updated_at = None
-        self.details = {}  # This would normally be populated from a database
+        self.details = {}
+
+    def load(self, conn):
+        """
+        Fill the trip details and the status / driver / truck changes from the database
+        """
+        trip = Trip.get(conn, self.trip_id)
+        if trip.apicode != 200:
+            return trip
+        self.details = trip.raw()['found']
+        self.created_at = self.details['created_at']
+        self.updated_at = self.details['updated_at']
+        changes = {'status': self.status_changes, 'driver': self.driver_changes, 'truck': self.truck_changes}
+        for change in changes.values():
+            change.clear()
+        rows = conn.execute("SELECT ts, event, old_value, new_value FROM trip_events "
+                            "WHERE trip_id = ? AND event IN ('status', 'driver', 'truck') ORDER BY id",
+                            (self.trip_id,)).fetchall()
+        for row in rows:
+            changes[row['event']].append({'ts': row['ts'], 'from': row['old_value'], 'to': row['new_value']})
+        return msg.ResourceFound({'details': self.details, 'status_changes': self.status_changes,
+                                  'driver_changes': self.driver_changes, 'truck_changes': self.truck_changes})
 
     def calculate_total_expenses(self):
         return sum(expense['amount'] for expense in self.expenses)
     
-    def calculate_deadhead_miles(self):
+    def calculate_deadhead_miles(self, conn=None):
         """
-        we need the trip route and then the trip for the next trip
-        to calculate the deadhead miles
+        Miles from the truck's previous drop-off to this pickup, see services/analytics.py
+        without a connection (or when a location cannot be resolved) falls back to 10% of the miles
         """
-        self.deadhead_miles = self.miles * 0.1  # Assume 10% of total miles are deadhead
+        deadhead = analytics.trip_deadhead(conn, self.trip_id) if conn is not None else None
+        self.deadhead_miles = deadhead if deadhead is not None else self.miles * 0.1
         return self.deadhead_miles
     
 
@@ -8,8 +8,12 @@ import sys
 import os
 from datetime import datetime
 import messages as msg
+from messages import TruckStatus
 from config.config import ConfigManager
-from pydantic import BaseModel
+from services.availability import availability
+from location.location import truck_locations, ping_buffer, TruckPing, BufferFull, to_epoch
+from location.geofence import geofences
+from pydantic import BaseModel, ValidationError
 
 """
 Goals for this module:
@@ -25,16 +29,6 @@ Goals for this module:
 
 """
 
-class TruckStatus:
-    """
-    This is a way to ensure the state of a truck is consistent
-    """
-    ACTIVE = "active"
-    MAINTANANCE = "in maintanance"
-    BROKEN = "broken down"
-    RETIRED = "retired"
-    SOLD = "sold"
-
 class TruckItem(BaseModel):
     license_plate: str
     model: str
@@ -52,18 +46,110 @@ class Truck(ConfigManager):
         self.model = model
         self.year = year
         self.towing_capacity = towing_capacity
-        self.location = location # Need Location Object,  This for now doesnt need to be updated every second but maybe every hour or so will probrably use in memory db for per minute or less update
+        self.location = location # free text, live positions are kept in location.location.truck_locations (pings, flushed to truck_locations)
         self.status = status # TODO explore multiple statuses 
         self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    @classmethod
+    def from_item(cls, item: TruckItem):
+        """
+        Build a truck from the validated request body
+        """
+        return cls(
+            item.license_plate,
+            item.model,
+            item.year,
+            item.towing_capacity,
+            location=item.location
+            )
     
 
     
 
 
 def check_truck_availability(truck_id: int, start_date: datetime, end_date: datetime, conn):
-    # This is a placeholder function. Actual implementation would involve checking the trips table
-    # for any trips that overlap with the given date range for the specified truck.
-    # For now, we'll assume all trucks are available.
-    return msg.ResourceFound({'truck_id': truck_id, 'available': True})
-# TODO Implement truck availability check based on trip schedules
\ No newline at end of file
+    """
+    Is the truck free between start_date and end_date (datetimes or iso strings)
+    returns available and the trips in the way, see services/availability.py
+    """
+    start, end = str(start_date), str(end_date)
+    try:
+        conflicts = availability.conflicts(conn, truck_id, start, end)
+    except ValueError as e:
+        return msg.InvalidQuery({'error': str(e), 'start': start, 'end': end})
+    return msg.ResourceFound({'truck_id': truck_id, 'available': not conflicts, 'conflicts': conflicts})
+
+
+def nearby_trucks(conn, lat: float, lon: float, radius: float, limit: int = 10, status: str = TruckStatus.ACTIVE,
+                  store=truck_locations):
+    """
+    The limit nearest trucks in status within radius miles of (lat, lon), nearest first.
+    Candidates come from the spatial grid of the location store, their status is read from
+    trucks in batches (nearest first) until limit are found.
+    """
+    ids, miles = store.nearest(lat, lon, radius)
+    found = []
+    batch = limit * 2
+    for start in range(0, len(ids), batch):
+        chunk = ids[start:start + batch].tolist()
+        matching = {row[0] for row in conn.execute(
+            f"SELECT id FROM trucks WHERE status = ? AND id IN ({', '.join('?' * len(chunk))})", [status, *chunk])}
+        found += [(truck_id, distance) for truck_id, distance in zip(chunk, miles[start:start + batch].tolist())
+                  if truck_id in matching]
+        if len(found) >= limit:
+            break
+    trucks = []
+    for truck_id, distance in found[:limit]:
+        position = store.position(truck_id)
+        if position is not None:
+            position['miles'] = round(distance, 2)
+            trucks.append(position)
+    return msg.ResourceFound({'lat': lat, 'lon': lon, 'radius': radius, 'status': status, 'trucks': trucks})
+
+
+def ingest_pings(conn, pings: list, buffer=ping_buffer, store=truck_locations, fences=geofences):
+    """
+    Validate a batch of pings from the devices, buffer the good ones for truck_pings, move
+    the trucks in the location store and match them against the trip geofences.
+    Bad rows and unknown trucks are reported by index. The status moves the geofences call
+    for are returned under moves, GeofenceIndex.apply writes them with the writer.
+    A full buffer refuses the whole batch (ServiceUnavailable) so it can be sent again as is.
+    """
+    valid = []
+    errors = []
+    now = int(store.clock())
+    for index, ping in enumerate(pings):
+        try:
+            ping = TruckPing(**ping)
+            # out of range times (milliseconds, overflowing floats) are bad rows like any other
+            ts = to_epoch(ping.ts, now) if ping.ts is not None else None
+        except (ValidationError, ValueError, TypeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        valid.append((index, ping, ts))
+
+    truck_ids = sorted({ping.truck_id for _, ping, _ in valid})
+    known = set()
+    for start in range(0, len(truck_ids), 500):
+        chunk = truck_ids[start:start + 500]
+        known.update(row[0] for row in conn.execute(
+            f"SELECT id FROM trucks WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+    errors += [{'index': index, 'error': f'Truck {ping.truck_id} not found'}
+               for index, ping, _ in valid if ping.truck_id not in known]
+    valid = [(index, ping, ts) for index, ping, ts in valid if ping.truck_id in known]
+    errors.sort(key=lambda error: error['index'])
+    if not valid:
+        return msg.InvalidQuery({'error': 'No valid pings', 'errors': errors})
+
+    trucks = [ping.truck_id for _, ping, _ in valid]
+    lats = [ping.lat for _, ping, _ in valid]
+    lons = [ping.lon for _, ping, _ in valid]
+    stamps = [now if ts is None else ts for _, _, ts in valid]
+    try:
+        buffer.add(trucks, lats, lons, stamps)
+    except BufferFull as e:
+        return msg.ServiceUnavailable({'pings': str(e)})
+    moved = store.update_many(trucks, lats, lons, stamps)
+    moves = fences.observe(conn, trucks, lats, lons, stamps)
+    return msg.ResourceAccepted({'accepted': len(valid), 'moved': moved, 'errors': errors, 'moves': moves})
@@ -9,12 +9,31 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import unittest
 
-from services.trip import Trip
-from services.truck import Truck
+from services.trip import Trip, TripHistory, TripDetails
+from services.truck import Truck, TruckStatus, check_truck_availability, nearby_trucks, ingest_pings
 from users.users import Profile, Driver
 from messages import *
+from config.config import SUPPORTS_RETURNING
+from config.pool import ConnectionPool, PoolTimeout
+from config.storage import Storage, WAL
+from config.migrations import migrate, current_version, latest_version
+from config.explain import explain, is_scan
+from config.query import prefix_bounds, statement_cache, table_columns
+from config.pool import Connection
+from config.aio import AsyncDB
+from config.cache import EntityCache, InvalidationChannel
+from config import aggregates
+from services import dashboard
+from services.availability import AvailabilityIndex
+from services import analytics
+from services import payroll
+from services import revenue
+from location.location import Geocoder, Precision, normalize, geocode_trips, TruckLocationStore, PingBuffer, BufferFull
+from location.geofence import GeofenceIndex
+import asyncio
 import time
 import sqlite3
+import tempfile
 
 class TestTrip(unittest.TestCase):
 
@@ -138,6 +157,209 @@ class TestTrip(unittest.TestCase):
 
         conn.close()
 
+class TestTripPages(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+        CREATE TABLE trips (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            truck_id INTEGER NOT NULL,
+            broker TEXT NOT NULL,
+            rate_con_number TEXT NOT NULL,
+            rate REAL NOT NULL,
+            pickup_location TEXT NOT NULL,
+            dropoff_location TEXT NOT NULL,
+            pickup_date TEXT NOT NULL,
+            delivery_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            driver_id INTEGER
+        )
+        """)
+        for i in range(5):
+            trip = Trip(
+                truck_id=i % 2,
+                broker="Broker A",
+                rate_con_number=f"RC{i}",
+                rate=1500.0,
+                pickup_location="Location A",
+                dropoff_location="Location B",
+                pickup_date="2024-06-25T10:00:00",
+                delivery_date="2024-06-30T18:00:00"
+            )
+            trip.create(self.conn, trip.__dict__)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_keyset_pages(self):
+        page = Trip.filter(self.conn, limit=2, broker="Broker A").raw()
+        self.assertEqual([t['id'] for t in page['found']], [1, 2])
+        self.assertEqual(page['next'], 2)
+        page = Trip.filter(self.conn, limit=2, after=page['next']).raw()
+        self.assertEqual([t['id'] for t in page['found']], [3, 4])
+        page = Trip.filter(self.conn, limit=2, after=page['next']).raw()
+        self.assertEqual([t['id'] for t in page['found']], [5])
+        self.assertIsNone(page['next'])
+
+    def test_page_with_filter(self):
+        page = Trip.all(self.conn, limit=10).raw()
+        self.assertEqual(len(page['found']), 5)
+        page = Trip.filter(self.conn, limit=10, truck_id=1).raw()
+        self.assertEqual([t['id'] for t in page['found']], [2, 4])
+
+    def test_iter_filter(self):
+        rows = Trip.iter_filter(self.conn, batch_size=2, truck_id=0)
+        self.assertEqual([row['id'] for row in rows], [1, 3, 5])
+        self.assertEqual([row['id'] for row in Trip.iter_filter(self.conn, after=3)], [4, 5])
+
+    def test_bulk_create(self):
+        trips = []
+        for i in range(3):
+            trip = Trip(
+                truck_id=7,
+                broker="Broker B",
+                rate_con_number=f"RCB{i}",
+                rate=900.0,
+                pickup_location="Location A",
+                dropoff_location="Location B",
+                pickup_date="2024-06-25T10:00:00",
+                delivery_date="2024-06-30T18:00:00"
+            )
+            trips.append(trip.__dict__)
+        for use_returning in ((True, False) if SUPPORTS_RETURNING else (False,)):
+            Trip.use_returning = use_returning
+            try:
+                first = self.conn.execute('SELECT MAX(id) FROM trips').fetchone()[0] + 1
+                res = Trip.bulk_create(self.conn, trips, chunk_size=2)
+                self.assertEqual(res.apicode, 201)
+                self.assertEqual(res.raw()['created']['ids'], [first, first + 1, first + 2])
+                rows = Trip.filter(self.conn, truck_id=7, id__gte=first).raw()['found']
+                self.assertEqual([row['rate_con_number'] for row in rows], ['RCB0', 'RCB1', 'RCB2'])
+            finally:
+                del Trip.use_returning
+
+    def test_bulk_create_is_atomic(self):
+        trip = Trip(
+            truck_id=7,
+            broker="Broker B",
+            rate_con_number="RCB0",
+            rate=900.0,
+            pickup_location="Location A",
+            dropoff_location="Location B",
+            pickup_date="2024-06-25T10:00:00",
+            delivery_date="2024-06-30T18:00:00"
+        ).__dict__
+        res = Trip.bulk_create(self.conn, [trip, dict(trip, broker=None)], chunk_size=1)
+        self.assertEqual(res.apicode, 400)
+        self.assertEqual(Trip.filter(self.conn, truck_id=7).apicode, 404)
+
+    def test_bulk_update_status(self):
+        Trip.update_status(2, LoadStatus.LOADED, self.conn)
+        Trip.update_status(3, LoadStatus.DELIVERED, self.conn)
+        res = Trip.bulk_update_status(self.conn, [1, 2, 3, 99], LoadStatus.LOADED)
+        self.assertEqual(res.apicode, 200)
+        body = res.raw()['updated']
+        self.assertEqual(body['applied'], [1])
+        self.assertEqual({r['id']: r['reason'] for r in body['rejected']}, {
+            2: 'already Loaded',
+            3: 'cannot go from Delivered to Loaded',
+            99: 'not found',
+        })
+        statuses = {row['id']: row['status'] for row in Trip.all(self.conn).raw()['found']}
+        self.assertEqual(statuses[1], LoadStatus.LOADED)
+        self.assertEqual(statuses[4], LoadStatus.SCHEDULED)
+
+        res = Trip.bulk_update_status(self.conn, [1, 2], LoadStatus.IN_TRANSIT)
+        self.assertEqual(res.raw()['updated']['applied'], [1, 2])
+
+    def test_bulk_update_status_invalid(self):
+        with self.assertRaises(ValueError):
+            Trip.bulk_update_status(self.conn, [1], 'Lost')
+
+    def test_update_returning_and_fallback(self):
+        for use_returning in ((True, False) if SUPPORTS_RETURNING else (False,)):
+            Trip.use_returning = use_returning
+            try:
+                res = Trip.update(self.conn, 2, broker="Broker R", truck_id=9)
+                self.assertEqual(res.apicode, 200)
+                row = res.raw()['updated']
+                self.assertEqual((row['id'], row['broker'], row['truck_id']), (2, "Broker R", 9))
+                self.assertEqual(row['rate_con_number'], "RC1")
+                self.assertEqual(Trip.update(self.conn, 99, broker="Broker R").apicode, 400)
+            finally:
+                del Trip.use_returning
+
+    def test_statement_cache_canonical(self):
+        Trip.filter(self.conn, broker="Broker A", truck_id=1)
+        before = statement_cache.stats()
+        res = Trip.filter(self.conn, truck_id=1, broker="Broker A")
+        after = statement_cache.stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertEqual([t['id'] for t in res.raw()['found']], [2, 4])
+
+    def test_long_in_lists_share_a_statement(self):
+        ids = lambda res: [t['id'] for t in res.raw()['found']]
+        self.assertEqual(ids(Trip.filter(self.conn, id__in=list(range(2, 40)))), [2, 3, 4, 5])
+        before = statement_cache.stats()
+        self.assertEqual(ids(Trip.filter(self.conn, id__in=list(range(3, 1000)))), [3, 4, 5])
+        after = statement_cache.stats()
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertEqual(ids(Trip.filter(self.conn, status__in=[LoadStatus.SCHEDULED] * 20, truck_id=1)), [2, 4])
+
+    def test_unknown_columns_rejected(self):
+        res = Trip.filter(self.conn, **{'status=status OR 1': 1})
+        self.assertEqual(res.apicode, 400)
+        self.assertEqual(Trip.update(self.conn, 1, colour='red').apicode, 400)
+
+    def test_pooled_connection_caches_columns(self):
+        conn = sqlite3.connect(":memory:", factory=Connection)
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, x TEXT)")
+        self.assertEqual(table_columns(conn, 't'), frozenset({'id', 'x'}))
+        self.assertIn('t', conn.table_columns)
+        conn.close()
+
+    def test_filter_lookups(self):
+        Trip.update(self.conn, 2, rate=900.0, pickup_date="2024-06-20T10:00:00", pickup_location="Greensboro, NC")
+        Trip.update(self.conn, 3, rate=2500.0, status=LoadStatus.LOADED)
+        ids = lambda res: [t['id'] for t in res.raw()['found']]
+        self.assertEqual(ids(Trip.filter(self.conn, rate__gte=1000, rate__lte=2000)), [1, 4, 5])
+        self.assertEqual(ids(Trip.filter(self.conn, rate__between=(800, 1000))), [2])
+        self.assertEqual(ids(Trip.filter(self.conn, pickup_date__lte="2024-06-21")), [2])
+        self.assertEqual(ids(Trip.filter(self.conn, status__in=[LoadStatus.LOADED, LoadStatus.DELIVERED])), [3])
+        self.assertEqual(ids(Trip.filter(self.conn, pickup_location__startswith="Green")), [2])
+        self.assertEqual(Trip.filter(self.conn, pickup_location__startswith="").apicode, 400)
+        self.assertEqual(ids(Trip.filter(self.conn, order_by='-rate,id', limit=2)), [3, 1])
+        self.assertIsNone(Trip.filter(self.conn, order_by='rate', limit=2).raw()['next'])
+        self.assertEqual(Trip.filter(self.conn, rate__near=1).apicode, 400)
+        self.assertEqual(Trip.filter(self.conn, order_by='rate', after=1).apicode, 400)
+
+    def test_prefix_bounds(self):
+        self.assertEqual(prefix_bounds("Green"), ("Green", "Greeo"))
+        self.assertEqual(prefix_bounds("a\U0010FFFF"), ("a\U0010FFFF", "b"))
+        self.assertEqual(prefix_bounds("\U0010FFFF\U0010FFFF"), ("\U0010FFFF\U0010FFFF", None))
+        self.assertEqual(prefix_bounds("a\ud7ff"), ("a\ud7ff", "a\ue000"))
+        Trip.update(self.conn, 2, pickup_location="Zone \U0010FFFF")
+        Trip.update(self.conn, 3, pickup_location="\U0010FFFF North")
+        ids = lambda res: [t['id'] for t in res.raw()['found']]
+        self.assertEqual(ids(Trip.filter(self.conn, pickup_location__startswith="Zone \U0010FFFF")), [2])
+        self.assertEqual(ids(Trip.filter(self.conn, pickup_location__startswith="\U0010FFFF")), [3])
+
+    def test_fields(self):
+        page = Trip.filter(self.conn, limit=2, fields='status,pickup_date').raw()
+        self.assertEqual(set(page['found'][0]), {'id', 'status', 'pickup_date'})
+        self.assertEqual(page['next'], 2)
+        rows = list(Trip.iter_filter(self.conn, fields=['status']))
+        self.assertEqual(rows[0], {'id': 1, 'status': LoadStatus.SCHEDULED})
+        self.assertEqual(Trip.get(self.conn, 3, fields='rate_con_number').raw()['found'], {'rate_con_number': 'RC2'})
+        self.assertEqual(Trip.get(self.conn, 3, fields='password').apicode, 400)
+        self.assertEqual(Trip.filter(self.conn, fields='status,password').apicode, 400)
+
 class TestMessages(unittest.TestCase):
 
     def test_mtl_message(self):
@@ -310,8 +532,932 @@ class TestTruck(unittest.TestCase):
         cursor = self.conn.cursor()
         cursor.execute('SELECT license_plate FROM trucks WHERE id = ?', (truck_id,))
         updated_truck = cursor.fetchone()
-        self.assertEqual(updated_truck['license_plate'], 'MMM-001')    
+        self.assertEqual(updated_truck['license_plate'], 'MMM-001')
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(os.path.join(self.tmp.name, 'pool.db'), size=1, timeout=0.1,
+                                   pragmas={'foreign_keys': 'ON'})
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def test_pragmas_applied(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()[0], 1)
+
+    def test_same_thread_reuses_connection(self):
+        with self.pool.connection() as outer:
+            with self.pool.connection() as inner:
+                self.assertIs(outer, inner)
+            self.assertEqual(self.pool.stats()['in_use'], 1)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_timeout_when_exhausted(self):
+        conn = self.pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        self.pool.release(conn)
+        stats = self.pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+
+    def test_release_rolls_back(self):
+        conn = self.pool.acquire()
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+        self.pool.release(conn)
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+        self.pool.release(conn)
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'wal.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.close()
+        self.storage = Storage(path, mode=WAL, readers=2, timeout=0.1)
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def test_wal_enabled(self):
+        with self.storage.writer.connection() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_readers_are_read_only(self):
+        with self.storage.reader.connection() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('INSERT INTO t VALUES (1)')
+
+    def test_open_write_does_not_block_readers(self):
+        writer = self.storage.writer.acquire()
+        writer.execute('INSERT INTO t VALUES (1)')
+        self.assertTrue(writer.in_transaction)
+        with self.storage.reader.connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+        writer.commit()
+        self.storage.writer.release(writer)
+        with self.storage.reader.connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 1)
+
+    def test_single_writer(self):
+        writer = self.storage.writer.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.storage.writer.acquire()
+        self.storage.writer.release(writer)
+
+class TestAsyncDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'async.db')
+        conn = sqlite3.connect(path)
+        migrate(conn)
+        conn.close()
+        self.storage = Storage(path, mode=WAL, readers=2, timeout=1)
+        self.db = AsyncDB(self.storage)
+
+    def tearDown(self):
+        self.db.close()
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def test_create_get_filter_update(self):
+        async def run():
+            trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                        "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1)
+            created = await self.db.create(trip)
+            self.assertEqual(created.apicode, 201)
+            found, page = await asyncio.gather(self.db.get(Trip, trip.id, fields='broker'),
+                                               self.db.filter(Trip, limit=5, broker="Broker A"))
+            self.assertEqual(found.raw()['found'], {'broker': 'Broker A'})
+            self.assertEqual(page.raw()['found'][0]['id'], trip.id)
+            updated = await self.db.update(Trip, trip.id, status=LoadStatus.LOADED)
+            self.assertEqual(updated.raw()['updated']['status'], LoadStatus.LOADED)
+        asyncio.run(run())
+        self.assertEqual(self.storage.reader.stats()['in_use'], 0)
+        self.assertEqual(self.storage.writer.stats()['in_use'], 0)
+
+    def test_errors_propagate(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(self.db.write(Trip.bulk_update_status, [1], 'Lost'))
+        self.assertEqual(self.storage.writer.stats()['in_use'], 0)
+
+
+class TestEntityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = EntityCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_lru_and_ttl(self):
+        self.cache.put('trips', 1, {'id': 1})
+        self.cache.put('trips', 2, {'id': 2})
+        self.assertEqual(self.cache.get('trips', 1), {'id': 1})
+        self.cache.put('trips', 3, {'id': 3})
+        self.assertIsNone(self.cache.get('trips', 2))
+        self.now = 11
+        self.assertIsNone(self.cache.get('trips', 1))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['expired']), (1, 2, 1, 1))
+
+    def test_get_returns_copy(self):
+        self.cache.put('trips', 1, {'id': 1})
+        self.cache.get('trips', 1)['id'] = 5
+        self.assertEqual(self.cache.get('trips', 1), {'id': 1})
+
+    def test_trip_reads_and_writes(self):
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        migrate(conn)
+        Trip.cache = EntityCache()
+        try:
+            trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                        "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1)
+            trip.create(conn, trip.__dict__)
+            self.assertEqual(Trip.get(conn, trip.id).raw()['found']['status'], LoadStatus.SCHEDULED)
+            self.assertEqual(Trip.get(conn, trip.id, fields='status').raw()['found'], {'status': LoadStatus.SCHEDULED})
+            self.assertEqual(Trip.cache.stats()['hits'], 1)
+            Trip.update_status(trip.id, LoadStatus.LOADED, conn)
+            self.assertEqual(Trip.get(conn, trip.id).raw()['found']['status'], LoadStatus.LOADED)
+            Trip.bulk_update_status(conn, [trip.id], LoadStatus.IN_TRANSIT)
+            self.assertEqual(Trip.get(conn, trip.id).raw()['found']['status'], LoadStatus.IN_TRANSIT)
+            Trip.update(conn, trip.id, broker="Broker B")
+            self.assertEqual(Trip.get(conn, trip.id).raw()['found']['broker'], "Broker B")
+            self.assertEqual(Trip.get(conn, trip.id, fields='password').apicode, 400)
+        finally:
+            Trip.cache = None
+            conn.close()
+
+    def test_update_during_a_miss_is_not_cached(self):
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, 'cache.db')
+        writer = sqlite3.connect(path)
+        writer.row_factory = sqlite3.Row
+        writer.execute('PRAGMA journal_mode = WAL')
+        migrate(writer)
+        reader = sqlite3.connect(path, isolation_level=None)
+        reader.row_factory = sqlite3.Row
+        trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                    "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1)
+        trip.create(writer, trip.__dict__)
+
+        class Interleaved(EntityCache):
+            def generation(self, table, id):
+                generation = super().generation(table, id)
+                # the write commits and invalidates after the reader took the generation,
+                # the reader's snapshot still has the old row
+                Trip.update(writer, id, broker="Broker B")
+                return generation
+
+        Trip.cache = Interleaved()
+        try:
+            reader.execute('BEGIN')
+            reader.execute('SELECT COUNT(*) FROM trips').fetchone()
+            self.assertEqual(Trip.get(reader, trip.id).raw()['found']['broker'], "Broker A")
+            reader.execute('COMMIT')
+            self.assertEqual(Trip.cache.stats()['stale_puts'], 1)
+            self.assertIsNone(Trip.cache.get('trips', trip.id))
+            Trip.cache.__class__ = EntityCache
+            self.assertEqual(Trip.get(reader, trip.id).raw()['found']['broker'], "Broker B")
+            self.assertEqual(Trip.cache.get('trips', trip.id)['broker'], "Broker B")
+        finally:
+            Trip.cache = None
+            reader.close()
+            writer.close()
+            tmp.cleanup()
+
+    def test_drop_refuses_older_puts(self):
+        generation = self.cache.generation('trips', 1)
+        self.cache.drop('trips', [1])
+        self.cache.put('trips', 1, {'id': 1}, generation)
+        self.assertIsNone(self.cache.get('trips', 1))
+        generation = self.cache.generation('trips', 1)
+        self.cache.drop('trips')
+        self.cache.put('trips', 1, {'id': 1}, generation)
+        self.assertIsNone(self.cache.get('trips', 1))
+        self.cache.put('trips', 1, {'id': 1}, self.cache.generation('trips', 1))
+        self.assertEqual(self.cache.get('trips', 1), {'id': 1})
+
+    def test_channel_invalidates_other_workers(self):
+        tmp = tempfile.TemporaryDirectory()
+        worker_a, worker_b = EntityCache(), EntityCache()
+        channel_a = InvalidationChannel(tmp.name, worker_a, name='a')
+        channel_b = InvalidationChannel(tmp.name, worker_b, name='b')
+        try:
+            worker_a.put('trips', 1, {'id': 1})
+            worker_b.put('trips', 1, {'id': 1})
+            worker_a.invalidate('trips', [1])
+            for _ in range(100):
+                if worker_b.stats()['size'] == 0:
+                    break
+                time.sleep(0.01)
+            self.assertIsNone(worker_b.get('trips', 1))
+            self.assertEqual(channel_b.received, 1)
+        finally:
+            channel_a.close()
+            channel_b.close()
+            tmp.cleanup()
+
+
+class TestDashboard(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                    "2025-06-25T10:00:00", "2025-06-30T18:00:00", 1).__dict__
+        rows = [dict(trip, rate_con_number=f"RC{day}", pickup_date=f"2025-06-{day:02d}T10:00:00",
+                     delivery_date=f"2025-06-{day + 1:02d}T10:00:00") for day in range(1, 11)]
+        Trip.bulk_create(self.conn, rows)
+        Trip.bulk_update_status(self.conn, [1, 2], LoadStatus.CANCELLED)
+        Trip.bulk_update_status(self.conn, [3, 4], LoadStatus.LOADED)
+        Trip.bulk_update_status(self.conn, [3, 4], LoadStatus.IN_TRANSIT)
+        Trip.bulk_update_status(self.conn, [3], LoadStatus.DELIVERED)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_sections(self):
+        board = dashboard.build(self.conn, now="2025-06-05T12:00:00", limit=3)
+        self.assertEqual(board['total_trips'], 10)
+        self.assertEqual([t['id'] for t in board['upcoming_trips']], [6, 7, 8])
+        self.assertEqual([t['id'] for t in board['recently_delivered']], [3])
+        # 1, 2 cancelled and 3 delivered are not overdue
+        self.assertEqual(board['alerts']['overdue_count'], 1)
+        self.assertEqual([t['id'] for t in board['alerts']['overdue_trips']], [4])
+        self.assertEqual(len(board['recent_activity']), 3)
+
+    def test_delivered_by_update_is_newest(self):
+        self.conn.execute("UPDATE trips SET updated_at = '2025-01-01 00:00:00'")
+        self.conn.execute("UPDATE trips SET updated_at = '2025-06-01 00:00:00' WHERE id = 3")
+        self.conn.commit()
+        # the generic update (PUT /api/trips/{id}/?status=) moves updated_at as well
+        Trip.update(self.conn, 4, status=LoadStatus.DELIVERED)
+        self.assertEqual([t['id'] for t in dashboard.recently_delivered(self.conn)], [4, 3])
+
+    def test_single_flight(self):
+        cache = dashboard.SingleFlightCache(ttl=60)
+        calls = []
+
+        async def build():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def run():
+            return await asyncio.gather(*(cache.get('board', build) for _ in range(20)))
+
+        self.assertEqual(asyncio.run(run()), [1] * 20)
+        self.assertEqual(asyncio.run(cache.get('board', build)), 1)
+        self.assertEqual(cache.stats(), {'ttl': 60, 'hits': 1, 'builds': 1, 'waits': 19})
+
+
+class TestAvailability(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        Truck.bulk_create(self.conn, [Truck(f"P{i}", "Volvo", 2020, 10000).__dict__ for i in range(3)])
+        trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                    "2025-07-01T08:00:00", "2025-07-03T18:00:00", 1).__dict__
+        Trip.bulk_create(self.conn, [trip, dict(trip, truck_id=2, pickup_date="2025-07-05T08:00:00",
+                                                delivery_date="2025-07-06T08:00:00")])
+        self.index = AvailabilityIndex(merge_at=2)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_truck_and_fleet(self):
+        self.assertEqual(self.index.conflicts(self.conn, 1, "2025-07-02", "2025-07-04"), [1])
+        self.assertTrue(self.index.is_free(self.conn, 1, "2025-07-03T18:00:00", "2025-07-05"))
+        self.assertEqual(self.index.free_trucks(self.conn, "2025-07-02", "2025-07-05T12:00:00"), [3])
+        self.assertEqual(self.index.free_trucks(self.conn, "2025-07-04", "2025-07-05"), [1, 2, 3])
+
+    def test_follows_writes(self):
+        self.index.load(self.conn)
+        Trip.update(self.conn, 1, truck_id=3)
+        self.assertEqual(self.index.free_trucks(self.conn, "2025-07-02", "2025-07-03"), [1, 2])
+        Trip.bulk_update_status(self.conn, [1], LoadStatus.CANCELLED)
+        self.assertEqual(self.index.free_trucks(self.conn, "2025-07-02", "2025-07-03"), [1, 2, 3])
+        trip = Trip("Broker A", "RC3", 1500.0, "Location A", "Location B",
+                    "2025-07-02T08:00:00", "2025-07-02T18:00:00", 2)
+        trip.create(self.conn, trip.__dict__)
+        self.assertEqual(self.index.conflicts(self.conn, 2, "2025-07-02", "2025-07-03"), [trip.id])
+        self.assertGreaterEqual(self.index.merges, 1)
+        self.assertEqual(check_truck_availability(2, "2025-07-02", "2025-07-03", self.conn).apicode, 200)
+
+    def test_bad_dates(self):
+        with self.assertRaises(ValueError):
+            self.index.free_trucks(self.conn, "soon", "2025-07-03")
+
+    def test_long_trip_does_not_widen_the_window(self):
+        self.index.load(self.conn)
+        # a delivery date typed with the wrong year
+        Trip.update(self.conn, 2, delivery_date="2035-07-06T08:00:00")
+        self.assertEqual(self.index.free_trucks(self.conn, "2030-01-01", "2030-01-02"), [1, 3])
+        self.assertEqual(self.index.conflicts(self.conn, 2, "2030-01-01", "2030-01-02"), [2])
+        # merged (merge_at=2) it stays out of the sorted arrays and the window
+        Trip.update(self.conn, 1, broker="Broker B")
+        self.assertEqual(self.index.free_trucks(self.conn, "2030-01-01", "2030-01-02"), [1, 3])
+        self.assertEqual(self.index.stats()['long_trips'], 1)
+        self.assertLess(self.index.stats()['max_duration_hours'], 24 * 14)
+        # fixed, it goes back among the others
+        Trip.update(self.conn, 2, delivery_date="2025-07-06T08:00:00")
+        Trip.update(self.conn, 1, broker="Broker C")
+        self.assertEqual(self.index.free_trucks(self.conn, "2030-01-01", "2030-01-02"), [1, 2, 3])
+        self.assertEqual(self.index.stats()['long_trips'], 0)
+        self.assertEqual(self.index.conflicts(self.conn, 2, "2025-07-05", "2025-07-06"), [2])
+
+
+class TestAnalytics(unittest.TestCase):
+
+    GREENSBORO = "36.0726, -79.7920"
+    RALEIGH = "35.7796, -78.6382"
+    CHARLOTTE = "35.2271, -80.8431"
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        trip = Trip("Broker A", "RC1", 1000.0, self.GREENSBORO, self.RALEIGH,
+                    "2025-07-01T08:00:00", "2025-07-01T18:00:00", 1).__dict__
+        Trip.bulk_create(self.conn, [
+            trip,
+            # truck 1 goes back empty from Raleigh to Greensboro before this one
+            dict(trip, rate=2000.0, pickup_location=self.GREENSBORO, dropoff_location=self.CHARLOTTE,
+                 pickup_date="2025-07-03T08:00:00"),
+            dict(trip, truck_id=2, pickup_location=self.RALEIGH, dropoff_location=self.GREENSBORO),
+            dict(trip, truck_id=2, pickup_location="Location A", pickup_date="2025-07-02T08:00:00"),
+        ])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_deadhead_per_truck(self):
+        trips = analytics.compute(analytics.with_coordinates(analytics.load_trips(self.conn)))
+        leg = analytics.haversine_miles(36.0726, -79.7920, 35.7796, -78.6382)[()] * analytics.ROAD_FACTOR
+        self.assertEqual(trips["id"].tolist(), [1, 2, 3, 4])
+        self.assertEqual(trips["deadhead_miles"].iloc[0], 0.0)
+        self.assertAlmostEqual(trips["deadhead_miles"].iloc[1], leg, places=6)
+        self.assertAlmostEqual(trips["loaded_miles"].iloc[0], leg, places=6)
+        # an unknown location leaves the miles unknown instead of guessing
+        self.assertTrue(trips[["loaded_miles", "deadhead_miles"]].iloc[3].isna().all())
+        self.assertAlmostEqual(analytics.trip_deadhead(self.conn, 2), leg, places=6)
+
+    def test_trip_deadhead_agrees_with_compute_on_ties(self):
+        # another trip of truck 1 picked up at the same time as trip 2, with a higher id
+        trip = Trip("Broker A", "RC5", 1000.0, self.CHARLOTTE, self.RALEIGH, "2025-07-03T08:00:00",
+                    "2025-07-03T18:00:00", 1)
+        trip.create(self.conn, trip.__dict__)
+        trips = analytics.compute(analytics.with_coordinates(analytics.load_trips(self.conn)))
+        deadhead = dict(zip(trips["id"].tolist(), trips["deadhead_miles"].tolist()))
+        for trip_id in (2, trip.id):
+            self.assertAlmostEqual(analytics.trip_deadhead(self.conn, trip_id), deadhead[trip_id], places=6)
+        self.assertIsNone(analytics.trip_deadhead(self.conn, 99))
+
+    def test_report(self):
+        res = analytics.report(self.conn).raw()["found"]
+        trucks = {row["truck_id"]: row for row in res["trucks"]}
+        self.assertEqual(res["fleet"]["trips"], 4)
+        self.assertEqual(res["fleet"]["measured_trips"], 3)
+        self.assertEqual(trucks[2]["measured_revenue"], 1000.0)
+        self.assertGreater(trucks[1]["deadhead_pct"], 0)
+        self.assertIsNone(analytics.report(self.conn, start="2030-01-01").raw().get("found"))
+
+    def test_trip_details_fallback(self):
+        details = TripDetails(4, None)
+        details.miles = 100
+        self.assertEqual(details.calculate_deadhead_miles(), 10.0)
+        self.assertEqual(details.calculate_deadhead_miles(self.conn), 10.0)
+        details = TripDetails(2, None)
+        self.assertAlmostEqual(details.calculate_deadhead_miles(self.conn), analytics.trip_deadhead(self.conn, 2))
+
+
+class TestGeocoder(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        migrate(self.conn)
+        self.geocoder = Geocoder()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_normalize(self):
+        self.assertEqual(normalize(" 170 Glenwood Ave.,  Raleigh,NC "), "170 GLENWOOD AVE, RALEIGH, NC")
+        self.assertEqual(normalize("36.07, -79.79"), "36.07, -79.79")
+        self.assertEqual(normalize(None), "")
+
+    def test_lookup(self):
+        cases = {
+            "3562 Hewitt St Greensboro, NC": Precision.CITY,
+            "1 Main St, St. Louis, MO 63101-1234": Precision.ZIP,
+            "Fort Worth, Texas": Precision.CITY,
+            "Ft. Worth, TX": Precision.CITY,
+            "Somewhere, North Carolina": Precision.STATE,
+            "36.07, -79.79": Precision.EXACT,
+            "Location A": Precision.NONE,
+        }
+        for address, precision in cases.items():
+            self.assertEqual(self.geocoder.geocode(address).precision, precision, address)
+        greensboro = self.geocoder.geocode("Greensboro, NC")
+        self.assertAlmostEqual(greensboro.lat, 36.07, delta=0.1)
+        self.assertAlmostEqual(greensboro.lon, -79.79, delta=0.1)
+        self.assertEqual(self.geocoder.geocode("Fort Worth, Texas"), self.geocoder.geocode("Ft. Worth, TX"))
+
+    def test_memoized(self):
+        found = self.geocoder.geocode_many(["Raleigh, NC", "raleigh,nc", "Location A"], self.conn)
+        self.assertEqual(found["Raleigh, NC"], found["raleigh,nc"])
+        self.assertEqual(self.geocoder.stats()["gazetteer_lookups"], 2)
+        self.geocoder.geocode("RALEIGH, NC", self.conn)
+        self.assertEqual(self.geocoder.stats()["hits"], 1)
+        self.geocoder.save(self.conn, found)
+        other = Geocoder(self.geocoder.gazetteer)
+        self.assertEqual(other.geocode("Raleigh, NC", self.conn), found["Raleigh, NC"])
+        self.assertEqual(other.stats()["table_hits"], 1)
+
+    def test_request_answers_are_written_behind(self):
+        self.geocoder.geocode_many(["Raleigh, NC", "Durham, NC", "Greensboro, NC"])
+        self.geocoder.save(self.conn, {"Greensboro, NC": self.geocoder.geocode("Greensboro, NC")})
+        self.assertEqual(self.geocoder.stats()["pending"], 2)
+        self.assertEqual(self.geocoder.flush(self.conn), 2)
+        self.assertEqual(self.geocoder.flush(self.conn), 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0], 3)
+        # a fresh process finds them in the table
+        other = Geocoder(self.geocoder.gazetteer)
+        other.geocode_many(["Raleigh, NC", "Durham, NC"], self.conn)
+        self.assertEqual((other.stats()["table_hits"], other.stats()["pending"]), (2, 0))
+        # past pending_size the oldest are not saved
+        small = Geocoder(self.geocoder.gazetteer, pending_size=1)
+        small.geocode_many(["Raleigh, NC"])
+        small.geocode_many(["Durham, NC"])
+        self.assertEqual((small.stats()["pending"], small.stats()["unsaved"]), (1, 1))
+
+    def test_geocode_trips(self):
+        trip = Trip("Broker A", "RC1", 1000.0, "3562 Hewitt St Greensboro, NC", "170 Glenwood Ave, Raleigh, NC",
+                    "2025-07-01T08:00:00", "2025-07-01T18:00:00", 1).__dict__
+        Trip.bulk_create(self.conn, [trip, dict(trip, dropoff_location="Location B")])
+        self.assertEqual(geocode_trips(self.conn, self.geocoder), {Precision.CITY: 2, Precision.NONE: 1})
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0], 3)
+        # the report now has miles for the trip it can place
+        res = analytics.report(self.conn).raw()["found"]
+        self.assertEqual(res["fleet"]["measured_trips"], 1)
+        self.assertGreater(res["fleet"]["loaded_miles"], 60)
+
+
+class TestTruckLocationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        migrate(self.conn)
+        self.now = [1000]
+        self.store = TruckLocationStore(history_size=4, capacity=2, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_latest_and_history(self):
+        self.assertTrue(self.store.update(3, 36.07, -79.79, 990))
+        self.assertFalse(self.store.update(3, 35.0, -78.0, 980))
+        self.assertEqual(self.store.position(3)["lat"], 36.07)
+        self.assertEqual(self.store.position(3)["age_seconds"], 10)
+        self.assertIsNone(self.store.position(2))
+        # one batch, two pings of truck 5: the newest one wins
+        self.assertEqual(self.store.update_many([5, 5, 3], [1, 2, 3], [1, 2, 3], [950, 900, 1000]), 2)
+        self.assertEqual(self.store.position(5)["lat"], 1.0)
+        self.assertEqual([row["truck_id"] for row in self.store.positions()], [3, 5])
+        # the ring holds the last 4 pings
+        self.assertEqual([ping["lat"] for ping in self.store.history(3)], [3.0, 35.0])
+        self.assertEqual([ping["lat"] for ping in self.store.history(5)], [2.0, 1.0])
+        self.assertEqual(self.store.within(36.0, -79.8, 25), [])
+        self.store.update(4, 36.0, -79.8)
+        self.assertEqual(self.store.within(36.0, -79.8, 25), [4])
+
+    def test_flush_and_load(self):
+        self.store.update_many([1, 2], [36.0, 35.0], [-79.0, -78.0], [900, 900])
+        self.assertEqual(self.store.flush(self.conn), 2)
+        self.assertEqual(self.store.flush(self.conn), 0)
+        self.store.update(1, 37.0, -80.0, 950)
+        self.assertEqual(self.store.flush(self.conn), 1)
+        loaded = TruckLocationStore()
+        loaded.load(self.conn)
+        self.assertEqual([(row["truck_id"], row["lat"]) for row in loaded.positions()], [(1, 37.0), (2, 35.0)])
+        self.assertEqual(loaded.stats()["pending"], 0)
+
+    def test_nearest_follows_moves(self):
+        # Greensboro, Raleigh, Charlotte
+        self.store.update_many([1, 2, 3], [36.07, 35.78, 35.23], [-79.79, -78.64, -80.84], [900, 900, 900])
+        ids, miles = self.store.nearest(36.07, -79.79, 150)
+        self.assertEqual(ids.tolist(), [1, 2, 3])
+        self.assertAlmostEqual(miles[0], 0.0)
+        self.assertEqual(self.store.nearest(36.07, -79.79, 150, limit=1)[0].tolist(), [1])
+        # truck 1 drives to Atlanta, out of its old cell and out of range
+        self.store.update(1, 33.75, -84.39, 950)
+        self.assertEqual(self.store.nearest(36.07, -79.79, 150)[0].tolist(), [2, 3])
+        self.assertEqual(self.store.nearest(33.75, -84.39, 10)[0].tolist(), [1])
+        self.assertEqual(self.store.stats()["grid_cells"], 3)
+
+    def test_nearby_trucks_only_active(self):
+        for plate, status in (("NC1", TruckStatus.ACTIVE), ("NC2", TruckStatus.MAINTANANCE), ("NC3", TruckStatus.ACTIVE)):
+            truck = Truck(plate, "Volvo", 2020, 10000, status=status)
+            truck.create(self.conn, truck.__dict__)
+        self.store.update_many([1, 2, 3], [36.07, 36.08, 35.78], [-79.79, -79.80, -78.64], [900, 900, 900])
+        found = nearby_trucks(self.conn, 36.07, -79.79, 150, limit=5, store=self.store).raw()["found"]
+        self.assertEqual([truck["truck_id"] for truck in found["trucks"]], [1, 3])
+        self.assertEqual(found["trucks"][0]["miles"], 0.0)
+        found = nearby_trucks(self.conn, 36.07, -79.79, 150, limit=1, store=self.store).raw()["found"]
+        self.assertEqual([truck["truck_id"] for truck in found["trucks"]], [1])
+
+
+class TestPingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        migrate(self.conn)
+        self.now = [1000]
+        self.buffer = PingBuffer(capacity=5, flush_size=4, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_flush_writes_once(self):
+        self.assertEqual(self.buffer.add([1, 2, 1], [36.0, 35.0, 36.1], [-79.0, -78.0, -79.1], [990, 991, 995]), 3)
+        self.assertFalse(self.buffer._ready.is_set())
+        self.buffer.add([3], [34.0], [-77.0], [999])
+        # flush_size reached, the flush thread would wake up now
+        self.assertTrue(self.buffer._ready.is_set())
+        self.assertEqual(self.buffer.flush(self.conn), 4)
+        self.assertEqual(self.buffer.flush(self.conn), 0)
+        rows = self.conn.execute('SELECT truck_id, ts, received_at FROM truck_pings ORDER BY id').fetchall()
+        self.assertEqual(rows, [(1, 990, 1000), (2, 991, 1000), (1, 995, 1000), (3, 999, 1000)])
+        with self.assertRaises(sqlite3.DatabaseError):
+            self.conn.execute('UPDATE truck_pings SET lat = 0')
+        stats = self.buffer.stats()
+        self.assertEqual((stats['accepted'], stats['written'], stats['waiting'], stats['flushes']), (4, 4, 0, 1))
+        self.assertEqual(stats['ingest_rate'], round(4 / 60, 1))
+        self.assertIsNotNone(stats['flush_ms'])
+
+    def test_backpressure(self):
+        self.buffer.add([1, 2, 3, 4], [0, 0, 0, 0], [0, 0, 0, 0], [1, 1, 1, 1])
+        with self.assertRaises(BufferFull):
+            self.buffer.add([5, 6], [0, 0], [0, 0], [1, 1])
+        self.assertEqual(self.buffer.stats()['refused'], 2)
+        self.assertEqual(self.buffer.stats()['waiting'], 4)
+        # a failed write keeps the pings for the next flush
+        self.conn.execute('DROP TABLE truck_pings')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.buffer.flush(self.conn)
+        self.assertEqual(self.buffer.stats()['waiting'], 4)
+        self.assertEqual(self.buffer.stats()['failed_flushes'], 1)
+
+    def test_ingest_pings(self):
+        truck = Truck("NC1", "Volvo", 2020, 10000)
+        truck.create(self.conn, truck.__dict__)
+        self.now[0] = 1751356800
+        store = TruckLocationStore(clock=lambda: self.now[0])
+        pings = [{"truck_id": 1, "lat": 36.07, "lon": -79.79, "ts": 1751356790}, {"truck_id": 1, "lat": 91, "lon": 0},
+                 {"truck_id": 7, "lat": 36.0, "lon": -79.0}, {"truck_id": 1, "lat": 36.08, "lon": -79.8}]
+        res = ingest_pings(self.conn, pings, buffer=self.buffer, store=store, fences=GeofenceIndex())
+        self.assertEqual(res.apicode, 202)
+        self.assertEqual(res.raw()['accepted']['accepted'], 2)
+        self.assertEqual([error['index'] for error in res.raw()['accepted']['errors']], [1, 2])
+        # milliseconds, a float past int64 and a time from before 2000 are bad rows, not a failed batch
+        bad = [{"truck_id": 1, "lat": 36.0, "lon": -79.0, "ts": ts} for ts in (1751356790000, 1e20, 990)]
+        res = ingest_pings(self.conn, bad, buffer=self.buffer, store=store)
+        self.assertEqual(res.apicode, 400)
+        self.assertEqual([error['index'] for error in res.raw()['error']['errors']], [0, 1, 2])
+        self.assertEqual(self.buffer.stats()['waiting'], 2)
+        self.assertEqual(store.position(1)['lat'], 36.08)
+        self.assertEqual(self.buffer.stats()['waiting'], 2)
+        self.assertEqual(ingest_pings(self.conn, pings * 2, buffer=self.buffer, store=store).apicode, 503)
+        self.assertEqual(ingest_pings(self.conn, pings[1:3], buffer=self.buffer, store=store).apicode, 400)
+
+
+class TestGeofences(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        self.fences = GeofenceIndex(pickup_dwell=600, dropoff_dwell=300)
+        for truck_id in (1, 2):
+            trip = Trip("Broker A", f"RC{truck_id}", 1500.0, "3562 Hewitt St Greensboro, NC 27407",
+                        "170 Glenwood Ave, Raleigh, NC 27603", "2025-07-01T08:00:00", "2025-07-02T08:00:00", truck_id)
+            trip.create(self.conn, trip.__dict__)
+        self.fences.refresh(self.conn)
+        fences = self.fences.trip(1)
+        self.pickup = (fences['pickup']['lat'], fences['pickup']['lon'])
+        self.dropoff = (fences['dropoff']['lat'], fences['dropoff']['lon'])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def ping(self, truck_id, point, ts):
+        moves = self.fences.observe(self.conn, [truck_id], [point[0]], [point[1]], [ts])
+        if moves:
+            self.fences.apply(self.conn, moves)
+        return [(move['trip_id'], move['to']) for move in moves]
+
+    def status(self, trip_id):
+        return self.conn.execute('SELECT status FROM trips WHERE id = ?', (trip_id,)).fetchone()[0]
+
+    def test_trip_follows_its_truck(self):
+        self.assertEqual(self.ping(1, self.pickup, 1000), [])
+        self.assertEqual(self.ping(1, self.pickup, 1599), [])
+        self.assertEqual(self.ping(1, self.pickup, 1600), [(1, LoadStatus.LOADED)])
+        # jitter just past the edge is not leaving
+        self.assertEqual(self.ping(1, (self.pickup[0] + 0.04, self.pickup[1]), 1700), [])
+        self.assertEqual(self.ping(1, (35.9, -79.3), 2000), [(1, LoadStatus.IN_TRANSIT)])
+        self.assertEqual(self.ping(1, self.dropoff, 9000), [])
+        # an older ping is ignored
+        self.assertEqual(self.ping(1, self.dropoff, 8000), [])
+        self.assertEqual(self.ping(1, self.dropoff, 9300), [(1, LoadStatus.DELIVERED)])
+        self.assertEqual(self.status(1), LoadStatus.DELIVERED)
+        # the other truck's trip did not move
+        self.assertEqual(self.status(2), LoadStatus.SCHEDULED)
+        self.assertIsNone(self.fences.trip(1))
+        self.assertEqual(self.fences.stats()['transitions'], 3)
+
+    def test_one_batch_and_outside_changes(self):
+        moves = self.fences.observe(self.conn, [2, 2, 2], [self.pickup[0]] * 3, [self.pickup[1]] * 3, [1000, 1300, 1600])
+        self.assertEqual([(move['from'], move['to']) for move in moves], [(LoadStatus.SCHEDULED, LoadStatus.LOADED)])
+        # cancelled by dispatch before the move was written: the database refuses it and memory follows
+        Trip.bulk_update_status(self.conn, [2], LoadStatus.CANCELLED)
+        res = self.fences.apply(self.conn, moves).raw()['updated']
+        self.assertEqual(res['applied'], [])
+        self.assertEqual(res['rejected'][0]['id'], 2)
+        self.assertIsNone(self.fences.trip(2))
+        # a trip given to another truck moves its fences with it
+        Trip.update(self.conn, 1, truck_id=2)
+        self.assertEqual(self.ping(2, self.pickup, 5000), [])
+        self.assertEqual(self.ping(2, self.pickup, 5600), [(1, LoadStatus.LOADED)])
+
+    def test_new_and_moved_fences_are_inserted(self):
+        self.assertEqual(self.ping(1, self.pickup, 1000), [])
+        rebuilds = self.fences.stats()['rebuilds']
+        trip = Trip("Broker A", "RC3", 1500.0, "3562 Hewitt St Greensboro, NC 27407",
+                    "170 Glenwood Ave, Raleigh, NC 27603", "2025-07-01T08:00:00", "2025-07-02T08:00:00", 3)
+        trip.create(self.conn, trip.__dict__)
+        self.assertEqual(self.ping(3, self.pickup, 2000), [])
+        self.assertEqual(self.ping(3, self.pickup, 2600), [(trip.id, LoadStatus.LOADED)])
+        # trip 2's pickup moves, its old fence no longer counts
+        Trip.update(self.conn, 2, pickup_location="35.50000, -79.50000")
+        self.assertEqual(self.ping(2, self.pickup, 3000), [])
+        self.assertEqual(self.ping(2, self.pickup, 3600), [])
+        self.assertEqual(self.ping(2, (35.5, -79.5), 4000), [])
+        self.assertEqual(self.ping(2, (35.5, -79.5), 4600), [(2, LoadStatus.LOADED)])
+        stats = self.fences.stats()
+        self.assertEqual((stats['rebuilds'], stats['inserts'], stats['dead_fences']), (rebuilds, 2, 2))
+
+    def test_truck_ids_wider_than_truck_bits(self):
+        wide = (1 << 30) + 1
+        Trip.update(self.conn, 1, truck_id=wide)
+        self.assertEqual(self.ping(wide, self.pickup, 1000), [])
+        self.assertEqual(self.ping(wide, self.pickup, 1600), [(1, LoadStatus.LOADED)])
+        self.assertEqual(self.fences._truck_bits, 31)
+        # a truck id too wide for any key is refused instead of spilling into the cell bits
+        Trip.update(self.conn, 2, truck_id=1 << 62)
+        with self.assertRaises(ValueError):
+            self.ping(wide, self.dropoff, 2000)
+
+
+class TestPayroll(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        migrate(self.conn)
+        drivers = [(1, 'L1', 0.6, PayModel.PER_MILE), (2, 'L2', 25.0, PayModel.PERCENTAGE),
+                   (3, 'L3', 400.0, PayModel.FLAT), (4, 'L4', 0.5, PayModel.PER_MILE)]
+        self.conn.executemany("INSERT INTO drivers (id, license_number, pay_rate, pay_model, status, profile_id, created_at, updated_at) "
+                              "VALUES (?, ?, ?, ?, 'active', 1, '2025-01-01 00:00:00', '2025-01-01 00:00:00')", drivers)
+        greensboro, raleigh = '36.07200, -79.79200', '35.77960, -78.63820'
+        trips = [(1, 2000.0, greensboro, raleigh, '2025-07-02T08:00:00', LoadStatus.DELIVERED),
+                 (2, 2000.0, greensboro, raleigh, '2025-07-03T08:00:00', LoadStatus.DELIVERED),
+                 (3, 1500.0, greensboro, raleigh, '2025-07-04T08:00:00', LoadStatus.DELIVERED),
+                 (3, 1500.0, 'Nowhere Land', raleigh, '2025-07-05T08:00:00', LoadStatus.DELIVERED),
+                 # outside the period or not delivered, not paid
+                 (1, 9000.0, greensboro, raleigh, '2025-07-16T08:00:00', LoadStatus.DELIVERED),
+                 (4, 9000.0, greensboro, raleigh, '2025-07-05T08:00:00', LoadStatus.IN_TRANSIT)]
+        self.conn.executemany("INSERT INTO trips (truck_id, driver_id, broker, rate_con_number, rate, pickup_location, dropoff_location, "
+                              "pickup_date, delivery_date, status, created_at, updated_at) "
+                              "VALUES (1, ?, 'Broker', 'RC', ?, ?, ?, '2025-07-01T08:00:00', ?, ?, '2025-06-01 00:00:00', '2025-06-01 00:00:00')",
+                              trips)
+        self.conn.commit()
+        self.miles = analytics.haversine_miles(36.072, -79.792, 35.7796, -78.6382) * analytics.ROAD_FACTOR
+
+    def tearDown(self):
+        self.conn.close()
+
+    def lines(self, run_id):
+        lines = payroll.snapshot(self.conn, run_id).raw()['found']['lines']
+        return {line['driver_id']: line for line in lines}
+
+    def test_pay_models(self):
+        run = payroll.run_payroll(self.conn, '2025-07-01', '2025-07-16')
+        self.assertEqual(run['status'], payroll.COMPLETE)
+        lines = self.lines(run['id'])
+        self.assertEqual(sorted(lines), [1, 2, 3])
+        self.assertAlmostEqual(lines[1]['loaded_miles'], self.miles, places=1)
+        self.assertAlmostEqual(lines[1]['driver_pay'], round(self.miles, 2) * 0.6, places=1)
+        self.assertEqual(lines[2]['driver_pay'], 500.0)
+        self.assertEqual(lines[2]['company_margin'], 1500.0)
+        # flat pay does not need miles, the trip that could not be placed is still paid
+        self.assertEqual((lines[3]['trips'], lines[3]['unmeasured_trips'], lines[3]['driver_pay']), (2, 1, 800.0))
+        self.assertEqual((run['drivers'], run['trips'], run['gross']), (3, 4, 7000.0))
+        self.assertAlmostEqual(run['driver_pay'] + run['company_margin'], run['gross'], places=1)
+
+    def test_resume_and_recompute(self):
+        run = payroll.start_run(self.conn, '2025-07-01', '2025-07-16')
+        lines, last = payroll.next_chunk(self.conn, run, chunk=2)
+        run = payroll.save_chunk(self.conn, run, lines, last)
+        self.assertEqual((run['status'], run['last_driver_id'], run['drivers']), (payroll.RUNNING, 2, 2))
+        # a chunk read from where the run no longer is, is not written twice
+        self.assertEqual(payroll.save_chunk(self.conn, {**run, 'last_driver_id': 0}, lines, last)['drivers'], 2)
+        run = payroll.run_payroll(self.conn, '2025-07-01', '2025-07-16', chunk=2)
+        self.assertEqual((run['status'], run['drivers'], run['trips']), (payroll.COMPLETE, 3, 4))
+
+        # past payroll keeps the rate it was paid with until it is recomputed
+        self.conn.execute('UPDATE drivers SET pay_rate = 50.0 WHERE id = 2')
+        self.conn.commit()
+        self.assertEqual(payroll.run_payroll(self.conn, '2025-07-01', '2025-07-16'), run)
+        self.assertEqual(self.lines(run['id'])[2]['pay_rate'], 25.0)
+        run = payroll.run_payroll(self.conn, '2025-07-01', '2025-07-16', recompute=True)
+        self.assertEqual(self.lines(run['id'])[2]['driver_pay'], 1000.0)
+        self.assertEqual(len(payroll.runs(self.conn).raw()['found']), 1)
+
+    def test_bad_period(self):
+        with self.assertRaises(ValueError):
+            payroll.start_run(self.conn, '2025-07-16', '2025-07-01')
+        with self.assertRaises(ValueError):
+            payroll.start_run(self.conn, 'July', '2025-07-16')
+        self.assertEqual(payroll.snapshot(self.conn, 99).apicode, 404)
+
+
+class TestRevenue(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        migrate(self.conn)
+        # 2025-07-13 is a Sunday, the week of 2025-07-07
+        trips = [("Broker A", 1000.0, "2025-07-07T08:00:00", 1), ("Broker A", 2000.0, "2025-07-13T23:00:00", 2),
+                 ("Broker B", 500.0, "2025-07-14T08:00:00", 1), ("Broker B", 700.0, "2025-08-01T08:00:00", 2)]
+        for i, (broker, rate, pickup, truck_id) in enumerate(trips):
+            trip = Trip(broker, f"RC{i}", rate, "Location A", "Location B", pickup, "2025-08-10T08:00:00", truck_id)
+            trip.create(self.conn, trip.__dict__)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def rows(self, **kwargs):
+        return [(row['period'], row.get('broker'), row['trips'], row['revenue'])
+                for row in revenue.revenue(self.conn, **kwargs).raw()['found']['rows']]
+
+    def test_buckets(self):
+        self.assertEqual(self.rows(bucket='week', group_by=['broker']),
+                         [('2025-07-07', 'Broker A', 2, 3000.0), ('2025-07-14', 'Broker B', 1, 500.0),
+                          ('2025-07-28', 'Broker B', 1, 700.0)])
+        self.assertEqual(self.rows(bucket='month'), [('2025-07-01', None, 3, 3500.0), ('2025-08-01', None, 1, 700.0)])
+        self.assertEqual(self.rows(bucket='day', start='2025-07-13', end='2025-07-14'), [('2025-07-13', None, 1, 2000.0)])
+        # an end with a time counts the whole of its day, not the day before it
+        self.assertEqual(self.rows(bucket='day', start='2025-07-13T12:00:00', end='2025-07-13T12:00:00'),
+                         [('2025-07-13', None, 1, 2000.0)])
+        self.assertEqual(self.rows(bucket='day', start='2025-07-13', end='2025-07-14T00:00:00'), [('2025-07-13', None, 1, 2000.0)])
+        total = revenue.revenue(self.conn, truck_id=1, bucket='month').raw()['found']['total']
+        self.assertEqual(total, {'trips': 2, 'revenue': 1500.0, 'avg_rate': 750.0})
+
+    def test_rollup_follows_writes(self):
+        Trip.update(self.conn, 1, rate=1500.0, broker="Broker B")
+        Trip.bulk_update_status(self.conn, [4], LoadStatus.CANCELLED)
+        self.conn.execute('DELETE FROM trips WHERE id = 3')
+        self.conn.commit()
+        self.assertEqual(aggregates.check(self.conn), {})
+        # cancelled trips are only counted when asked for
+        self.assertEqual(self.rows(bucket='month', group_by=['broker']),
+                         [('2025-07-01', 'Broker A', 1, 2000.0), ('2025-07-01', 'Broker B', 1, 1500.0)])
+        self.assertEqual(self.rows(bucket='month', status=[LoadStatus.CANCELLED]), [('2025-08-01', None, 1, 700.0)])
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM revenue_daily').fetchone()[0], 3)
+
+    def test_rebuild_fixes_drift(self):
+        self.conn.execute("UPDATE revenue_daily SET trips = 5 WHERE day = '2025-07-07'")
+        self.conn.execute("DELETE FROM revenue_daily WHERE day = '2025-08-01'")
+        drift = aggregates.check(self.conn)
+        self.assertEqual(drift['revenue_daily 2025-07-07/1/Broker A/Scheduled'], ((5, 1000.0), (1, 1000.0)))
+        self.assertEqual(drift['revenue_daily 2025-08-01/2/Broker B/Scheduled'], ((0, 0.0), (1, 700.0)))
+        self.assertEqual(aggregates.rebuild(self.conn)['revenue_days'], 4)
+        self.assertEqual(aggregates.check(self.conn), {})
+
+    def test_bad_query(self):
+        self.assertEqual(revenue.revenue(self.conn, bucket='quarter').apicode, 400)
+        self.assertEqual(revenue.revenue(self.conn, group_by=['driver']).apicode, 400)
+        self.assertEqual(revenue.revenue(self.conn, start='July').apicode, 400)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_migrate_records_version(self):
+        self.assertEqual(current_version(self.conn), 0)
+        applied = migrate(self.conn)
+        self.assertEqual(applied[0], 1)
+        self.assertEqual(current_version(self.conn), latest_version())
+        # running again is a no-op
+        self.assertEqual(migrate(self.conn), [])
+
+    def test_migrate_to_target(self):
+        self.assertEqual(migrate(self.conn, target=1), [1])
+        self.assertEqual(current_version(self.conn), 1)
+
+    def test_filters_use_indexes(self):
+        migrate(self.conn)
+        for kwargs in ({'status': 'Scheduled'}, {'truck_id': 1}, {'driver_id': 1}, {'broker': 'Broker A'}):
+            sql, params = Trip._select(self.conn, **kwargs)
+            self.assertFalse(is_scan(explain(self.conn, sql, params)), sql)
+        sql, params = Truck._select(self.conn, status='active')
+        self.assertFalse(is_scan(explain(self.conn, sql, params)), sql)
+
+    def test_counters_follow_writes(self):
+        migrate(self.conn)
+        trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                    "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1).__dict__
+        ids = Trip.bulk_create(self.conn, [dict(trip, rate_con_number=f"RC{i}") for i in range(3)]).raw()['created']['ids']
+        Trip.bulk_update_status(self.conn, ids[:2], LoadStatus.LOADED)
+        Trip.update(self.conn, ids[0], broker="Broker B")
+        self.conn.execute('DELETE FROM trips WHERE id = ?', (ids[2],))
+        self.conn.commit()
+        counts = aggregates.summary(self.conn)
+        self.assertEqual(counts['totals'], {'trips': 2, 'trucks': 0, 'drivers': 0})
+        self.assertEqual(counts['trips_by_status'], {LoadStatus.LOADED: 2})
+        self.assertEqual(aggregates.check(self.conn), {})
+
+    def test_trip_search(self):
+        migrate(self.conn)
+        trip = Trip("Broker A", "RC1", 1500.0, "3562 Hewitt St Greensboro, NC", "170 Glenwood Ave, Raleigh, NC",
+                    "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1).__dict__
+        Trip.bulk_create(self.conn, [trip, dict(trip, broker="Greensboro Freight", rate_con_number="RC-2077",
+                                                pickup_location="Durham, NC")])
+        ids = lambda res: [t['id'] for t in res.raw()['found']]
+        self.assertEqual(ids(Trip.search(self.conn, 'greens')), [2, 1])
+        self.assertEqual(ids(Trip.search(self.conn, 'raleigh hewitt')), [1])
+        self.assertEqual(ids(Trip.search(self.conn, 'RC-2077')), [2])
+        Trip.update(self.conn, 1, pickup_location="Charlotte, NC")
+        self.assertEqual(Trip.search(self.conn, 'hewitt').apicode, 404)
+        self.assertEqual(ids(Trip.search(self.conn, 'charl')), [1])
+        self.assertEqual(Trip.search(self.conn, ' , ').apicode, 400)
+
+    def test_trip_events(self):
+        migrate(self.conn)
+        trip = Trip("Broker A", "RC1", 1500.0, "Location A", "Location B",
+                    "2024-06-25T10:00:00", "2024-06-30T18:00:00", 1)
+        trip.create(self.conn, trip.__dict__)
+        Trip.update_status(trip.id, LoadStatus.LOADED, self.conn)
+        Trip.update(self.conn, trip.id, truck_id=2, driver_id=5, rate=1700.0)
+        Trip.bulk_update_status(self.conn, [trip.id], LoadStatus.IN_TRANSIT)
+        history = TripHistory(trip.id)
+        first = history.get_history(self.conn, limit=2).raw()
+        self.assertEqual([e['event'] for e in first['found']], ['created', 'status'])
+        rest = history.get_history(self.conn, after=first['next'], limit=4).raw()
+        # the three changes of one UPDATE can be logged in any order
+        self.assertEqual(sorted((e['event'], e['field']) for e in rest['found'][:3]),
+                         [('driver', 'driver_id'), ('truck', 'truck_id'), ('updated', 'rate')])
+        self.assertEqual(rest['found'][3]['new_value'], LoadStatus.IN_TRANSIT)
+        self.assertIsNone(history.get_history(self.conn, after=rest['next']).raw()['next'])
+        self.assertEqual(len(TripHistory.for_truck(self.conn, 2).raw()['found']), 4)
+        details = TripDetails(trip.id, None)
+        details.load(self.conn)
+        self.assertEqual([(c['from'], c['to']) for c in details.status_changes],
+                         [(LoadStatus.SCHEDULED, LoadStatus.LOADED), (LoadStatus.LOADED, LoadStatus.IN_TRANSIT)])
+        self.assertEqual(details.truck_changes[0]['to'], '2')
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute('DELETE FROM trip_events')
 
+    def test_rebuild_fixes_drift(self):
+        migrate(self.conn)
+        self.conn.execute("UPDATE table_counts SET count = 9 WHERE name = 'trucks'")
+        self.assertEqual(aggregates.check(self.conn), {'trucks': (9, 0)})
+        aggregates.rebuild(self.conn)
+        self.assertEqual(aggregates.check(self.conn), {})
 
 # testing drivers 
 class TestUsers:
@@ -7,6 +7,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.
 
 from fastapi.testclient import TestClient
 from main import app
+from services.dashboard import dashboard_cache
+from location.location import ping_buffer, truck_locations, geocoder
+from config.db import storage
 
 client = TestClient(app)
 
@@ -88,3 +91,270 @@ def test_trip_put():
 
 
 
+
+
+def test_trip_get_page():
+    response = client.get('/api/trips/?limit=2')
+    assert response.status_code == 200
+    page = response.json()
+    assert [trip['id'] for trip in page['found']] == [1, 2]
+    assert page['next'] == 2
+
+    response = client.get(f"/api/trips/?limit=2&after={page['next']}")
+    assert [trip['id'] for trip in response.json()['found']] == [3, 4]
+
+def test_trip_stream():
+    response = client.get('/api/trips/?stream=true&broker=Tinashe%20Inc')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 1
+    assert rows[0]['id'] == 1
+
+def test_trip_bulk_create():
+    trip = {
+        "broker":"Bulk Inc",
+        "rate_con_number":"RC900",
+        "rate":1200.0,
+        "pickup_location":"Location A",
+        "dropoff_location":"Location B",
+        "pickup_date":"2025-07-01T10:00:00",
+        "delivery_date":"2025-07-02T18:00:00",
+        "truck_id":1
+    }
+    rows = [trip, dict(trip, rate_con_number="RC901"), dict(trip, status="Lost"), {"broker": "Bulk Inc"}]
+    response = client.post('/api/trips/bulk?chunk_size=1', json=rows)
+    assert response.status_code == 201
+    ret = response.json()['created']
+    assert [row['index'] for row in ret['rows']] == [0, 1]
+    assert ret['rows'][1]['id'] == ret['rows'][0]['id'] + 1
+    assert [error['index'] for error in ret['errors']] == [2, 3]
+
+    response = client.get(f"/api/trips/{ret['rows'][1]['id']}")
+    assert response.json()['found']['rate_con_number'] == "RC901"
+
+def test_trip_filter_language():
+    response = client.get('/api/trips/?pickup_date__lte=2024-12-31T00:00:00&order_by=-id&limit=2')
+    assert response.status_code == 200
+    assert [trip['id'] for trip in response.json()['found']] == [4, 3]
+
+    response = client.get('/api/trips/?status=Scheduled&status=Delivered&broker=Tinashe%20Inc')
+    assert [trip['id'] for trip in response.json()['found']] == [1]
+
+    response = client.get('/api/trips/?pick_up_location=Location&drop_off_location=Location%20B&end_date=2024-06-30T18:00:00')
+    assert [trip['id'] for trip in response.json()['found']] == [1, 2, 3, 4]
+
+    response = client.get('/api/trips/?pick_up_location=')
+    assert response.status_code == 400
+
+def test_trip_filter_bad_order_by():
+    response = client.get('/api/trips/?order_by=password')
+    assert response.status_code == 400
+    assert response.json()['error']['columns'] == ['password']
+
+def test_trip_fields():
+    response = client.get('/api/trips/?fields=status,pickup_location&limit=2')
+    assert response.status_code == 200
+    assert set(response.json()['found'][0]) == {'id', 'status', 'pickup_location'}
+    response = client.get('/api/trips/1?fields=broker')
+    assert response.json()['found'] == {'broker': 'Tinashe Inc'}
+    response = client.get('/api/trips/1?fields=password')
+    assert response.status_code == 400
+
+def test_trip_get_cached_until_update():
+    before = client.get('/api/trips/8').json()['found']
+    hits = client.get('/api/db/stats').json()['found']['entities']['hits']
+    assert client.get('/api/trips/8').json()['found'] == before
+    assert client.get('/api/db/stats').json()['found']['entities']['hits'] == hits + 1
+    client.put('/api/trips/8/?broker=Cache%20Inc')
+    assert client.get('/api/trips/8').json()['found']['broker'] == 'Cache Inc'
+
+def test_dashboard_counts():
+    response = client.get('/api/dashboard')
+    assert response.status_code == 200
+    body = response.json()
+    assert body['total_trips'] == sum(body['trips_by_status'].values())
+    before = body['trips_by_status'].get('Cancelled', 0)
+    # a trip of its own, so reruns and other tests cancelling trips do not change the count
+    trip_id = client.post('/api/trips/', json={
+        'broker': 'Dashboard Freight', 'rate_con_number': 'RC-DASH', 'rate': 900.0,
+        'pickup_location': 'Location A', 'dropoff_location': 'Location B',
+        'pickup_date': '2025-07-01T08:00:00', 'delivery_date': '2025-07-02T08:00:00', 'truck_id': 1}).json()['created']['id']
+    response = client.post('/api/trips/status', json={'trip_ids': [trip_id], 'status': 'Cancelled'})
+    assert response.json()['updated']['applied'] == [trip_id]
+    dashboard_cache.clear()
+    assert client.get('/api/dashboard').json()['trips_by_status'].get('Cancelled', 0) == before + 1
+
+def test_dashboard_sections():
+    dashboard_cache.clear()
+    body = client.get('/api/dashboard').json()
+    # trips 1-4 were due in 2024 and are still Scheduled
+    assert [trip['id'] for trip in body['alerts']['overdue_trips']][:4] == [1, 2, 3, 4]
+    assert body['alerts']['overdue_count'] >= 4
+    assert {'upcoming_trips', 'recently_delivered', 'recent_activity'} <= set(body)
+    builds = dashboard_cache.stats()['builds']
+    assert client.get('/api/dashboard').json() == body
+    assert dashboard_cache.stats()['builds'] == builds
+
+def test_dashboard_delivered_by_put():
+    trip_id = client.post('/api/trips/', json={
+        'broker': 'Dashboard Freight', 'rate_con_number': 'RC-DELIVER', 'rate': 900.0,
+        'pickup_location': 'Location A', 'dropoff_location': 'Location B',
+        'pickup_date': '2025-07-01T08:00:00', 'delivery_date': '2025-07-02T08:00:00', 'truck_id': 1}).json()['created']['id']
+    assert client.put(f'/api/trips/{trip_id}/?status=Delivered').status_code == 200
+    dashboard_cache.clear()
+    assert client.get('/api/dashboard').json()['recently_delivered'][0]['id'] == trip_id
+
+def test_trip_search():
+    response = client.get('/api/trips/search?q=tinashe')
+    assert response.status_code == 200
+    assert [trip['id'] for trip in response.json()['found']] == [1]
+    response = client.get('/api/trips/search?q=location&limit=2')
+    assert len(response.json()['found']) == 2
+    assert response.json()['next'] == 2
+    assert client.get('/api/trips/search?q=%22%2C').status_code == 400
+
+def test_trip_history():
+    client.put('/api/trips/10/?broker=History%20Inc')
+    response = client.get('/api/trips/10/history?limit=1')
+    assert response.status_code == 200
+    assert response.json()['found'][0]['event'] == 'created'
+    response = client.get(f"/api/trips/10/history?after={response.json()['next']}")
+    assert response.json()['found'][-1]['new_value'] == 'History Inc'
+    assert client.get('/api/trips/999/history').status_code == 404
+
+def test_truck_availability():
+    response = client.get('/api/truck/2/availability?start=2024-06-26&end=2024-06-27')
+    assert response.status_code == 200
+    assert response.json()['found']['available'] is False
+    assert response.json()['found']['conflicts'] == [1, 2, 3, 4]
+    response = client.get('/api/truck/2/availability?start=2030-01-01&end=2030-01-02')
+    assert response.json()['found']['available'] is True
+    response = client.get('/api/trucks/available?start=2024-06-26&end=2024-06-27')
+    assert response.status_code == 200
+    assert client.get('/api/trucks/available?start=later&end=2024-06-27').status_code == 400
+
+def test_deadhead_report():
+    response = client.get('/api/reports/deadhead?truck_id=2')
+    assert response.status_code == 200
+    assert response.json()['found']['fleet']['trips'] == 4
+    assert [row['truck_id'] for row in response.json()['found']['trucks']] == [2]
+    assert client.get('/api/reports/deadhead?start=2030-01-01').status_code == 404
+
+def test_truck_location():
+    truck_id = client.post('/api/truck/', json={'license_plate': 'LOC1', 'model': 'Volvo', 'year': 2020,
+                                                'towing_capacity': 10000}).json()['created']['id']
+    response = client.post(f'/api/truck/{truck_id}/location', json={'lat': 36.0726, 'lon': -79.792})
+    assert response.status_code == 200
+    assert response.json()['updated']['latest'] is True
+    # an older ping only goes to the history
+    client.post(f'/api/truck/{truck_id}/location', json={'lat': 35.0, 'lon': -79.0, 'ts': '2020-01-01T00:00:00'})
+    response = client.get(f'/api/truck/{truck_id}/location?history=5')
+    assert response.json()['found']['lat'] == 36.0726
+    assert len(response.json()['found']['history']) == 2
+    positions = client.get(f'/api/trucks/positions?truck_id={truck_id}').json()['found']
+    assert [row['truck_id'] for row in positions] == [truck_id]
+    response = client.get('/api/trucks/?location=Greensboro,%20NC')
+    assert truck_id in [row['id'] for row in response.json()['found']]
+    assert client.get('/api/trucks/?location=Location%20A').status_code == 400
+    assert client.post(f'/api/truck/{truck_id}/location', json={'lat': 1, 'lon': 1, 'ts': 'soon'}).status_code == 400
+    assert client.post('/api/truck/99999/location', json={'lat': 1, 'lon': 1}).status_code == 404
+    # a millisecond epoch is refused and does not become the newest position
+    assert client.post(f'/api/truck/{truck_id}/location', json={'lat': 1, 'lon': 1, 'ts': 1760000000000}).status_code == 400
+    response = client.get('/api/trucks/positions')
+    assert response.status_code == 200
+    assert [row['lat'] for row in response.json()['found'] if row['truck_id'] == truck_id] == [36.0726]
+    nearby = client.get('/api/trucks/nearby?lat=36.07&lon=-79.79&radius=150&limit=5').json()['found']['trucks']
+    assert truck_id in [row['truck_id'] for row in nearby]
+    assert client.get('/api/trucks/nearby?lat=-33.9&lon=151.2&radius=10').json()['found']['trucks'] == []
+    client.put(f'/api/trucks/{truck_id}/?status=sold')
+    nearby = client.get('/api/trucks/nearby?lat=36.07&lon=-79.79&radius=150').json()['found']['trucks']
+    assert truck_id not in [row['truck_id'] for row in nearby]
+    assert client.get('/api/trucks/nearby?lat=95&lon=0').status_code == 422
+
+
+def test_truck_ping_batch():
+    truck_id = client.post('/api/truck/', json={'license_plate': 'PING1', 'model': 'Volvo', 'year': 2021,
+                                                'towing_capacity': 10000}).json()['created']['id']
+    pings = [{'truck_id': truck_id, 'lat': 35.78, 'lon': -78.64, 'ts': '2025-07-01T08:00:00'},
+             {'truck_id': truck_id, 'lat': 'north', 'lon': -78.64}, {'truck_id': 99999, 'lat': 1, 'lon': 1}]
+    response = client.post('/api/trucks/locations/batch', json=pings)
+    assert response.status_code == 202
+    assert response.json()['accepted']['accepted'] == 1
+    assert [error['index'] for error in response.json()['accepted']['errors']] == [1, 2]
+    bad = [dict(pings[0], ts=1751356800000), dict(pings[0], ts=1e20)]
+    response = client.post('/api/trucks/locations/batch', json=bad)
+    assert response.status_code == 400
+    assert [error['index'] for error in response.json()['error']['errors']] == [0, 1]
+    assert client.get(f'/api/truck/{truck_id}/location').json()['found']['lat'] == 35.78
+    stats = client.get('/api/db/stats').json()['found']['pings']
+    assert stats['accepted'] >= 1
+    assert client.post('/api/trucks/locations/batch', json=pings[1:]).status_code == 400
+    # a full buffer refuses the batch
+    capacity = ping_buffer.capacity
+    ping_buffer.capacity = ping_buffer.stats()['waiting']
+    try:
+        response = client.post('/api/trucks/locations/batch', json=pings[:1])
+    finally:
+        ping_buffer.capacity = capacity
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '2'
+
+
+def test_lifespan_flushes_buffers():
+    truck_id = client.post('/api/truck/', json={'license_plate': 'LIFE1', 'model': 'Volvo', 'year': 2021,
+                                                'towing_capacity': 10000}).json()['created']['id']
+    with TestClient(app) as running:
+        assert ping_buffer._flusher is not None
+        ping = {'truck_id': truck_id, 'lat': 35.9, 'lon': -79.0, 'ts': '2025-07-02T08:00:00'}
+        assert running.post('/api/trucks/locations/batch', json=[ping]).status_code == 202
+    # shutdown stopped the threads and wrote what was still in memory
+    assert (ping_buffer._flusher, truck_locations._flusher, geocoder._flusher) == (None, None, None)
+    assert ping_buffer.stats()['waiting'] == 0
+    with storage.reader.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM truck_pings WHERE truck_id = ?', (truck_id,)).fetchone()[0] == 1
+        assert conn.execute('SELECT lat FROM truck_locations WHERE truck_id = ?', (truck_id,)).fetchone()[0] == 35.9
+
+
+def test_geofence_moves_trip():
+    truck_id = client.post('/api/truck/', json={'license_plate': 'FENCE1', 'model': 'Volvo', 'year': 2022,
+                                                'towing_capacity': 10000}).json()['created']['id']
+    trip_id = client.post('/api/trips/', json={
+        'broker': 'Fence Freight', 'rate_con_number': 'RC-FENCE', 'rate': 1800.0,
+        'pickup_location': '3562 Hewitt St Greensboro, NC 27407', 'dropoff_location': '170 Glenwood Ave, Raleigh, NC 27603',
+        'pickup_date': '2025-07-01T08:00:00', 'delivery_date': '2025-07-02T08:00:00', 'truck_id': truck_id}).json()['created']['id']
+    fences = client.get(f'/api/trips/{trip_id}/geofence').json()['found']
+    pickup, dropoff = fences['pickup'], fences['dropoff']
+    ping = lambda point, ts: {'truck_id': truck_id, 'lat': point['lat'], 'lon': point['lon'], 'ts': ts}
+    # half an hour at the pickup, on the road, half an hour at the dropoff
+    pings = [ping(pickup, 1751371200), ping(pickup, 1751373000), ping({'lat': 35.9, 'lon': -79.3}, 1751376600),
+             ping(dropoff, 1751382000), ping(dropoff, 1751383800)]
+    response = client.post('/api/trucks/locations/batch', json=pings)
+    assert response.status_code == 202
+    assert response.json()['accepted']['trips'] == [{'trip_id': trip_id, 'status': 'Loaded'},
+                                                     {'trip_id': trip_id, 'status': 'In Transit'},
+                                                     {'trip_id': trip_id, 'status': 'Delivered'}]
+    assert client.get(f'/api/trips/{trip_id}').json()['found']['status'] == 'Delivered'
+    assert client.get(f'/api/trips/{trip_id}/geofence').status_code == 404
+
+def test_payroll_run():
+    response = client.post('/api/payroll/runs?start=2025-07-16&end=2025-07-01')
+    assert response.status_code == 400
+    response = client.post('/api/payroll/runs?start=2025-07-01&end=2025-07-16')
+    assert response.status_code == 200
+    run = response.json()['found']
+    assert run['status'] == 'complete'
+    assert client.get('/api/payroll/runs').json()['found'][0]['id'] == run['id']
+    snapshot = client.get(f"/api/payroll/runs/{run['id']}").json()['found']
+    assert snapshot['run'] == run and len(snapshot['lines']) == run['drivers']
+    assert client.get('/api/payroll/runs/9999').status_code == 404
+
+def test_revenue_report():
+    response = client.get('/api/reports/revenue?start=2024-01-01&end=2026-01-01&bucket=month&group_by=status')
+    assert response.status_code == 200
+    report = response.json()['found']
+    assert report['total']['trips'] == sum(row['trips'] for row in report['rows']) > 0
+    assert 'Cancelled' not in {row['status'] for row in report['rows']}
+    weeks = client.get('/api/reports/revenue?start=2024-01-01&end=2026-01-01&bucket=week').json()['found']
+    assert weeks['total'] == report['total']
+    assert client.get('/api/reports/revenue?bucket=quarter').status_code == 400
@@ -17,6 +17,7 @@ class DriverItem:
     password: str
     license_number: str
     pay_rate: float
+    pay_model: str = msg.PayModel.PER_MILE
     status: str
     profile_picture: str = None
 
@@ -51,11 +52,13 @@ class Profile(ConfigManager):
 
 class Driver(ConfigManager):
     table_name = 'drivers'
-    fields = ['id', 'license_number', 'pay_rate', 'status', 'created_at', 'updated_at', 'profile_id']
-    def __init__(self, profile: Profile, license_number: str, pay_rate: float | None = None, status=None):
+    fields = ['id', 'license_number', 'pay_rate', 'pay_model', 'status', 'created_at', 'updated_at', 'profile_id']
+    def __init__(self, profile: Profile, license_number: str, pay_rate: float | None = None, status=None,
+                 pay_model=msg.PayModel.PER_MILE):
         self.id = None
         self.license_number = license_number
         self.pay_rate = pay_rate
+        self.pay_model = pay_model # how pay_rate is read, see PayModel in messages.py
         self.status = status # this is their employment status 
         self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         self.updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")